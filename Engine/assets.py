@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+from time import perf_counter
+from typing import Optional, Tuple, List, Iterable
+import pygame
+
+"""
+Sprite assets
+
+Nothing is loaded when the module is imported. The sprite map and the sprite sheet are loaded on first use,
+or all at once by Assets.load during startup, after the display exists so every surface can be converted
+to the display pixel format.
+
+Assets.load also prepares every sprite of the sprite map scaled to the sizes the renderer uses. The scaled
+sprites are packed into one atlas image that is saved to an on-disk cache next to an index of where every
+sprite is. Cache files are named by the cache version, a hash of the sprite sheet and sprite map and the
+sizes, so a start with the same assets only loads one image instead of extracting and scaling every sprite.
+"""
+
+SPRITE_MAP_PATH = "Engine/sprite_map.json"
+SPRITE_SHEET_PATH = "assets/main.png"
+ATLAS_CACHE_DIR = ".cache/atlas"
+# Bump when the atlas layout or the way sprites are scaled changes, files of older versions are then ignored
+ATLAS_CACHE_VERSION = 1
+# Size of one sprite in the sprite sheet in pixels
+SHEET_SPRITE_SIZE = 16
+# Widest atlas row in pixels
+ATLAS_WIDTH = 1024
+
+
+def extract_sprite(sheet: pygame.Surface, x: int, y: int) -> pygame.Surface:
+    sprite = pygame.Surface((SHEET_SPRITE_SIZE, SHEET_SPRITE_SIZE), pygame.SRCALPHA)
+    sprite.blit(sheet, (0, 0), (x * SHEET_SPRITE_SIZE, y * SHEET_SPRITE_SIZE, SHEET_SPRITE_SIZE, SHEET_SPRITE_SIZE))
+    return sprite
+
+
+def to_display_format(surface: pygame.Surface) -> pygame.Surface:
+    # Surfaces in the display format blit without a per pixel format conversion, only possible once a display exists
+    if pygame.display.get_surface() is None:
+        return surface
+    return surface.convert_alpha()
+
+
+class Assets:
+    def __init__(self, sprite_map_path: str = SPRITE_MAP_PATH, sheet_path: str = SPRITE_SHEET_PATH,
+                 cache_dir: Optional[str] = ATLAS_CACHE_DIR):
+        self.sprite_map_path = sprite_map_path
+        self.sheet_path = sheet_path
+        # None disables the atlas cache
+        self.cache_dir = cache_dir
+
+        self.sprite_map: Optional[dict] = None
+        self.sheet: Optional[pygame.Surface] = None
+
+        # Sprites prepared by load, key is the same as SpriteCache keys
+        self.scaled: dict = {}
+
+        # Milliseconds spent in every stage of the latest load and whether the atlas came from the cache
+        self.load_times: dict = {}
+        self.cache_hit = False
+
+    def get_sprite_map(self) -> dict:
+        if self.sprite_map is None:
+            with open(self.sprite_map_path, "r") as file:
+                self.sprite_map = json.load(file)
+        return self.sprite_map
+
+    def get_sheet(self) -> pygame.Surface:
+        if self.sheet is None:
+            self.sheet = to_display_format(pygame.image.load(self.sheet_path))
+        return self.sheet
+
+    def sheet_position(self, sprite_category, sprite_type, action, animation, tower_level) -> Tuple[int, int]:
+        sprite_position = self.get_sprite_map()[sprite_category][sprite_type]
+        if sprite_category == "enemies":
+            sprite_position = sprite_position[action][animation]
+        elif sprite_category == "towers":
+            sprite_position = sprite_position[tower_level]
+        return sprite_position[0], sprite_position[1]
+
+    def sprite(self, sprite_category, sprite_type, action, animation, tower_level, size) -> pygame.Surface:
+        """
+        Sprite scaled to size, in the display format when a display exists
+        Arguments are a SpriteCache key, sprites prepared by load are returned without any work
+        """
+        surface = self.scaled.get((sprite_category, sprite_type, action, animation, tower_level, size))
+        if surface is not None:
+            return surface
+
+        x, y = self.sheet_position(sprite_category, sprite_type, action, animation, tower_level)
+        return to_display_format(pygame.transform.scale(extract_sprite(self.get_sheet(), x, y), size))
+
+    def sprite_keys(self, sizes: Iterable[Tuple[int, int]]) -> List[tuple]:
+        # Every sprite of the sprite map in every size, keys are normalized the same way as SpriteCache keys
+        keys = []
+        for size in sizes:
+            size = tuple(size)
+            for sprite_category, sprite_types in self.get_sprite_map().items():
+                for sprite_type, positions in sprite_types.items():
+                    if sprite_category == "enemies":
+                        keys.extend((sprite_category, sprite_type, action, animation, None, size)
+                                    for action, frames in positions.items() for animation in range(len(frames)))
+                    elif sprite_category == "towers":
+                        keys.extend((sprite_category, sprite_type, None, 0, tower_level, size)
+                                    for tower_level in positions)
+                    else:
+                        keys.append((sprite_category, sprite_type, None, 0, None, size))
+        return keys
+
+    def content_hash(self) -> str:
+        # Hash of the sprite sheet and sprite map files, any change to either invalidates the atlas cache
+        content = hashlib.sha256()
+        for path in (self.sheet_path, self.sprite_map_path):
+            with open(path, "rb") as file:
+                content.update(file.read())
+        return content.hexdigest()
+
+    def atlas_paths(self, sizes: List[Tuple[int, int]]) -> Tuple[str, str]:
+        # Atlas image and index file of the cache entry
+        size_names = "-".join(f"{width}x{height}" for width, height in sizes)
+        name = f"atlas_v{ATLAS_CACHE_VERSION}_{self.content_hash()[:16]}_{size_names}"
+        return os.path.join(self.cache_dir, name + ".png"), os.path.join(self.cache_dir, name + ".json")
+
+    def load(self, sizes: Iterable[Tuple[int, int]]):
+        """
+        Startup stage that loads every sprite scaled to the sizes, from the atlas cache when possible
+        :param sizes: Sprite sizes in pixels the renderer uses
+        """
+        start = perf_counter()
+        sizes = sorted({tuple(size) for size in sizes})
+
+        self.get_sprite_map()
+        keys = self.sprite_keys(sizes)
+        self.load_times["sprite_map"] = (perf_counter() - start) * 1000
+
+        stage_start = perf_counter()
+        atlas_path = index_path = None
+        if self.cache_dir is not None:
+            atlas_path, index_path = self.atlas_paths(sizes)
+        self.load_times["hash"] = (perf_counter() - stage_start) * 1000
+
+        stage_start = perf_counter()
+        self.cache_hit = atlas_path is not None and self.load_atlas(atlas_path, index_path, keys)
+        if not self.cache_hit:
+            atlas, rects = self.build_atlas(keys)
+            if atlas_path is not None:
+                self.save_atlas(atlas, rects, atlas_path, index_path)
+        self.load_times["atlas"] = (perf_counter() - stage_start) * 1000
+
+        self.load_times["total"] = (perf_counter() - start) * 1000
+
+    def build_atlas(self, keys: List[tuple]) -> Tuple[pygame.Surface, List[tuple]]:
+        """
+        Extract and scale every sprite and pack them into rows of one atlas surface
+        :return: Atlas and the (key, rect) of every sprite
+        """
+        rects = []
+        x = y = row_height = 0
+        for key in keys:
+            width, height = key[5]
+            if x + width > ATLAS_WIDTH and x > 0:
+                x, y, row_height = 0, y + row_height, 0
+            rects.append((key, (x, y, width, height)))
+            x += width
+            row_height = max(row_height, height)
+
+        atlas_width = max((rect[0] + rect[2] for _, rect in rects), default=1)
+        atlas = pygame.Surface((atlas_width, max(y + row_height, 1)), pygame.SRCALPHA)
+        for key, rect in rects:
+            atlas.blit(self.sprite(*key), rect[:2])
+
+        self.use_atlas(to_display_format(atlas), rects)
+        return atlas, rects
+
+    def use_atlas(self, atlas: pygame.Surface, rects: List[tuple]):
+        # Sprites are subsurfaces sharing the pixels of the atlas
+        for key, rect in rects:
+            self.scaled[key] = atlas.subsurface(rect)
+
+    def load_atlas(self, atlas_path: str, index_path: str, keys: List[tuple]) -> bool:
+        # Use the cached atlas if it exists and has every sprite, a broken cache is treated as missing
+        if not os.path.exists(atlas_path) or not os.path.exists(index_path):
+            return False
+
+        try:
+            with open(index_path, "r") as file:
+                index = json.load(file)
+            rects = [((*entry["key"], tuple(entry["size"])), tuple(entry["rect"])) for entry in index["sprites"]]
+            if index["version"] != ATLAS_CACHE_VERSION or {key for key, _ in rects} != set(keys):
+                return False
+
+            self.use_atlas(to_display_format(pygame.image.load(atlas_path)), rects)
+        except (OSError, ValueError, KeyError, TypeError, pygame.error):
+            return False
+
+        return True
+
+    @staticmethod
+    def save_atlas(atlas: pygame.Surface, rects: List[tuple], atlas_path: str, index_path: str):
+        # Files are written under a temporary name first so other processes never read half written files
+        index = {
+            "version": ATLAS_CACHE_VERSION,
+            "sprites": [{"key": list(key[:5]), "size": list(key[5]), "rect": list(rect)} for key, rect in rects],
+        }
+
+        try:
+            os.makedirs(os.path.dirname(atlas_path), exist_ok=True)
+            pygame.image.save(atlas, atlas_path + ".tmp.png")
+            os.replace(atlas_path + ".tmp.png", atlas_path)
+            with open(index_path + ".tmp", "w") as file:
+                json.dump(index, file)
+            os.replace(index_path + ".tmp", index_path)
+        except (OSError, pygame.error):
+            # Cache is only an optimization, the game runs without it
+            pass
+
+
+# Assets of the game, shared by every renderer
+assets = Assets()
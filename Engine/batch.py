@@ -0,0 +1,153 @@
+import contextlib
+import os
+import statistics
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Optional, List, Tuple, Iterable, Iterator
+
+from Engine.engine import Engine, SimulationResult
+from Engine.tower import Tower
+
+"""
+Batch simulation runner
+
+Runs many headless games spread over a pool of worker processes, for example to evaluate thousands of
+map seeds and tower layouts. Every job is one seeded game with optional tower placements and tick limit.
+Results are yielded as soon as the jobs finish and can be aggregated into a summary table.
+
+Games do not share any state. Every job is sent to the workers on its own, a job and its result are a few
+small dataclasses so the process communication is small compared to the simulation work, and every result is
+yielded as soon as its game ends instead of waiting for other jobs.
+"""
+
+
+@dataclass
+class BatchJob:
+    """
+    One headless game of a batch
+    tower_slots are indices into the tower slots of the generated level, None keeps the default tower
+    """
+    seed: int
+    tower_slots: Optional[Tuple[int, ...]] = None
+    max_ticks: Optional[int] = None
+    use_enemy_store: bool = False
+    waves_path: Optional[str] = None
+
+
+@dataclass
+class BatchResult:
+    job: BatchJob
+    result: Optional[SimulationResult] = None
+    error: Optional[str] = None
+
+
+def run_job(job: BatchJob) -> BatchResult:
+    # Keep anything the engine prints out of the worker output
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            engine = Engine(headless=True, use_enemy_store=job.use_enemy_store, seed=job.seed,
+                            waves_path=job.waves_path)
+
+            if job.tower_slots is not None:
+                # Layout of the job is placed directly on the level, it is not bought with the player money
+                # A slot that can not take a tower raises, so the job fails instead of running another layout
+                level = engine.game.level
+                for tower in list(level.towers):
+                    level.update(3, current_position=tower.position)
+                for slot_index in job.tower_slots:
+                    if not 0 <= slot_index < len(level.tower_slots):
+                        raise ValueError(f"Job places a tower on slot {slot_index}, "
+                                         f"level has {len(level.tower_slots)} tower slots")
+                    position = level.tower_slots[slot_index]
+                    level.update(2, current_position=position, tower=Tower("standard", position))
+
+            return BatchResult(job=job, result=engine.run_headless(max_ticks=job.max_ticks))
+        except Exception as error:
+            # One broken job should not stop the whole batch
+            return BatchResult(job=job, error=f"{type(error).__name__}: {error}")
+
+
+def run_batch(jobs: Iterable[BatchJob], workers: Optional[int] = None) -> Iterator[BatchResult]:
+    """
+    Run jobs in a process pool and yield the results in the order the jobs finish
+    :param jobs: Jobs to run
+    :param workers: Amount of worker processes, None uses every core and 1 runs in this process
+    """
+    jobs = list(jobs)
+    workers = workers if workers is not None else os.cpu_count() or 1
+
+    if workers <= 1:
+        for job in jobs:
+            yield run_job(job)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_job, job) for job in jobs]
+
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def summarize(results: List[BatchResult], elapsed_time: Optional[float] = None) -> dict:
+    """
+    Aggregate batch results
+    :param results: Results of the batch
+    :param elapsed_time: Wall clock time of the whole batch, used for the batch wide tick rate
+    """
+    finished = [batch_result.result for batch_result in results if batch_result.result is not None]
+    total_ticks = sum(result.ticks for result in finished)
+
+    def mean(values: List[float]) -> float:
+        return statistics.fmean(values) if values else 0.0
+
+    summary = {
+        "jobs": len(results),
+        "failed": len(results) - len(finished),
+        "cleared": sum(result.level_cleared for result in finished),
+        "game_over": sum(result.game_over for result in finished),
+        "mean_lives": mean([result.lives for result in finished]),
+        "mean_money": mean([result.money for result in finished]),
+        "mean_kills": mean([result.kills for result in finished]),
+        "mean_ticks": mean([result.ticks for result in finished]),
+        "mean_job_ticks_per_second": mean([result.ticks_per_second for result in finished]),
+        "total_ticks": total_ticks,
+    }
+
+    if elapsed_time is not None:
+        summary["elapsed_time"] = elapsed_time
+        summary["ticks_per_second"] = total_ticks / elapsed_time if elapsed_time > 0 else 0.0
+
+    return summary
+
+
+def format_result(batch_result: BatchResult) -> str:
+    job = batch_result.job
+    if batch_result.result is None:
+        return f"seed {job.seed:<10} failed: {batch_result.error}"
+
+    result = batch_result.result
+    outcome = "cleared" if result.level_cleared else "game over" if result.game_over else "unfinished"
+    return (f"seed {job.seed:<10} {outcome:<10} lives {result.lives:>3}  money {result.money:>6}  "
+            f"kills {result.kills:>4}  ticks {result.ticks:>7}  {result.ticks_per_second:>10.0f} ticks/s")
+
+
+def format_summary(summary: dict) -> str:
+    return "\n".join(f"{name:<28}{value:>14.2f}" if isinstance(value, float) else f"{name:<28}{value:>14}"
+                     for name, value in summary.items())
+
+
+def run_and_summarize(jobs: Iterable[BatchJob], workers: Optional[int] = None, verbose: bool = True) -> dict:
+    # Print every result as it arrives and return the summary of the whole batch
+    results = []
+    start = perf_counter()
+
+    for batch_result in run_batch(jobs, workers=workers):
+        results.append(batch_result)
+        if verbose:
+            print(format_result(batch_result))
+
+    summary = summarize(results, perf_counter() - start)
+    print(format_summary(summary))
+    return summary
+
@@ -1,7 +1,9 @@
-from typing import Optional, List
-from Engine.level import TerrainBlock
+from typing import Optional, List, Tuple
+from Engine.trace import traced
+from Engine.turret_math import PathTable
+from Engine.units import EnemyStats, get_enemy_stats
+import heapq
 import math
-import os
 
 """
 File for enemy classes and logic.
@@ -10,45 +12,7 @@ Currently, enemies cannot overlap so speed is not a factor.
 # TODO: Enemy movement vector or real position has to be calculate differently, currently with slow speed goes through walls
 # TODO: The movement vector is not calculate correctly, somehow it is bigger than 1
 
-ENEMY_PATH = "assets/enemies"
-
-# Template enemy values
-template_enemies = {
-    "normal": {
-        "health": 100,
-        "speed": 60,
-        "money_value": 50,
-        "armor": 0,
-        "enemy_asset": ""
-    },
-    "buff": {
-        "health": 150,
-        "speed": 50,
-        "money_value": 100,
-        "armor": 5,
-        "enemy_asset": ""
-    },
-    "fast": {
-        "health": 80,
-        "speed": 40,
-        "money_value": 75,
-        "armor": 2,
-        "enemy_asset": ""
-    },
-}
-
-
-class Node:
-    def __init__(self, parent=None, position=None):
-        # Node parent and position
-        self.parent = parent
-        # Position is used as unique identifier for the node
-        self.position = position
-
-        # Node attributes
-        self.travel_cost = 0
-        self.heuristic = 0
-        self.total_cost = 0
+# Enemy stats are defined in Engine/enemies.json, see Engine/units.py
 
 
 def euclidean_distance(position: List[int], end_position: List[int]) -> float:
@@ -56,101 +20,131 @@ def euclidean_distance(position: List[int], end_position: List[int]) -> float:
     return math.sqrt((position[0] - end_position[0]) ** 2 + (position[1] - end_position[1]) ** 2)
 
 
-def get_neighbors(node: Node, terrain: List[List]) -> List[List[int]]:
-    # Get the neighbors of the current node
+def get_neighbors(position: Tuple[int, int], terrain) -> List[Tuple[int, int]]:
+    # Get the neighbors of the current position
     neighbors = []
 
-    # Check node to every position to every direction (up, down, left, right)
+    # Check position to every direction (up, down, left, right)
     # Check if the position is within the terrain
-    # If position is open block for enemy or enemy block, add to neighbors
-    starting_position = node.position
-    offsets = [[0, 1], [1, 0], [0, -1], [-1, 0]]
+    # If position is a path block, add to neighbors. Enemies standing on the path do not block it
+    rows, cols, blocks = terrain.rows, terrain.cols, terrain.blocks
 
-    for offset in offsets:
-        new_position = [starting_position[0] + offset[0], starting_position[1] + offset[1]]
+    for row_offset, col_offset in ((0, 1), (1, 0), (0, -1), (-1, 0)):
+        row, col = position[0] + row_offset, position[1] + col_offset
 
-        if new_position[0] < 0 or new_position[0] >= len(terrain):
+        if row < 0 or row >= rows or col < 0 or col >= cols:
             continue
 
-        if new_position[1] < 0 or new_position[1] >= len(terrain[0]):
-            continue
-
-        new_block = terrain[new_position[0]][new_position[1]]
-
-        if isinstance(new_block, TerrainBlock) and new_block.block_type == 0:
-            neighbors.append(new_position)
-        elif isinstance(new_block, Enemy):
-            neighbors.append(new_position)
+        if blocks[row * cols + col] == 0:
+            neighbors.append((row, col))
 
     return neighbors
 
 
-def a_star_algorithm(current_position: List[int], terrain: List[List], end_position: List[int]) -> List[List[int]]:
+@traced("pathfinding.a_star")
+def a_star_algorithm(current_position: List[int], terrain, end_position: List[int]) -> List[List[int]]:
     # Calculate the shortest path using A* algorithm
-    # Return the shortest path as a list
+    # Return the shortest path as a list, or empty list if end cannot be reached
 
-    # Allowed nodes to move to are terrain blocks of type 0 and enemy blocks
+    # Allowed nodes to move to are path blocks, also when an enemy stands on them
     # Distance between nodes is 1
-    stack = []
-    visited = []
-    path = []
     node_distance = 1
+    start = (current_position[0], current_position[1])
+    end = (end_position[0], end_position[1])
+
+    # Open nodes are kept in a binary heap of (total cost, insertion order, position)
+    # Insertion order breaks ties so that equal cost nodes are expanded first in first out
+    counter = 0
+    open_heap = [(euclidean_distance(start, end), counter, start)]
+    travel_costs = {start: 0}
+    parents = {start: None}
+    visited = set()
+
+    while open_heap:
+        _, _, position = heapq.heappop(open_heap)
+
+        # The same position can be pushed multiple times, only the cheapest one is expanded
+        if position in visited:
+            continue
+
+        if position == end:
+            break
+
+        visited.add(position)
+        travel_cost = travel_costs[position] + node_distance
+
+        for neighbor in get_neighbors(position, terrain):
+            if neighbor in visited:
+                continue
 
-    # Create start and end nodes
-    start_node = Node(None, current_position)
-    end_node = Node(None, end_position)
+            if travel_cost >= travel_costs.get(neighbor, math.inf):
+                continue
 
-    # Calculate heuristic for the start node
-    start_node.heuristic = euclidean_distance(start_node.position, end_node.position)
+            travel_costs[neighbor] = travel_cost
+            parents[neighbor] = position
 
-    # Add start node to the stack
-    stack.append(start_node)
+            counter += 1
+            heapq.heappush(open_heap, (travel_cost + euclidean_distance(neighbor, end), counter, neighbor))
+    else:
+        return []
 
-    current_node = stack.pop(0)
+    # Reconstruct the path from the end node
+    path = []
+    while position is not None:
+        path.append([position[0], position[1]])
+        position = parents[position]
 
-    while current_node.position != end_node.position:
-        # Get the neighbors of the current node
-        neighbors_positions = get_neighbors(current_node, terrain)
+    # Reverse path and remove itself start from path
+    return path[::-1][1:]
 
-        # Check all the neighbors
-        for neighbor_pos in neighbors_positions:
-            # Create a new node
-            new_node = Node(current_node, neighbor_pos)
 
-            # Calculate the travel cost
-            new_node.travel_cost = current_node.travel_cost + node_distance
+class PathCache:
+    """
+    Cache for shortest paths keyed by (start, end, terrain version)
 
-            # Calculate the heuristic
-            new_node.heuristic = euclidean_distance(new_node.position, end_node.position)
+    Enemies sharing a route get the same path list by reference, so the paths must never be modified.
+    Enemies walk the path with their own cursor instead.
+    Arc length tables of the paths are cached the same way and built when first needed.
+    """
 
-            # Calculate the total cost
-            new_node.total_cost = new_node.travel_cost + new_node.heuristic
+    def __init__(self):
+        self.paths = {}
+        self.tables = {}
+        self.terrain_version = 0
 
-            # Check if the node has been visited
-            if new_node.position in visited:
-                continue
+        self.hits = 0
+        self.misses = 0
 
-            # Add the node to the stack
-            stack.append(new_node)
+    def get(self, start: List[int], end: List[int], terrain, terrain_version: int) -> List[List[int]]:
+        # Paths of older terrain versions can never be used again
+        if terrain_version != self.terrain_version:
+            self.paths.clear()
+            self.tables.clear()
+            self.terrain_version = terrain_version
 
-        # Add the current node to the visited list
-        visited.append(current_node.position)
+        key = (start[0], start[1], end[0], end[1], terrain_version)
 
-        # Sort the stack based on the total cost
-        stack = sorted(stack, key=lambda x: x.total_cost)
+        path = self.paths.get(key)
+        if path is not None:
+            self.hits += 1
+            return path
 
-        # Get the next node
-        current_node = stack.pop(0)
+        self.misses += 1
+        path = a_star_algorithm(start, terrain, end)
+        self.paths[key] = path
 
-    # Reconstruct the path from the end node
-    while current_node is not None:
-        path.append(current_node.position)
-        current_node = current_node.parent
+        return path
 
-    # Reverse path and remove itself start from path
-    path = path[::-1][1:]
+    def get_table(self, start: List[int], end: List[int], terrain_version: int) -> Optional[PathTable]:
+        # Arc length table of a cached path, the table starts from the start block
+        key = (start[0], start[1], end[0], end[1], terrain_version)
 
-    return path
+        table = self.tables.get(key)
+        if table is None and key in self.paths:
+            table = PathTable([start] + self.paths[key])
+            self.tables[key] = table
+
+        return table
 
 
 # General Enemy class with shared actions
@@ -159,22 +153,23 @@ class Enemy:
         self.movement_vector: Optional[List[int]] = None
         self.enemy_type = enemy_type
 
-        # Shortest path for the enemy to follow
+        # Shortest path for the enemy to follow, the path can be shared with other enemies so it is never modified
+        # Path index points to the next waypoint in the path
         self.shortest_path: List[List[int]] = []
+        self.path_index = 0
+        # Arc length table of the path including the start block, waypoint i of the table is the block before
+        # shortest_path[i], so the enemy stands on table waypoint path_index
+        self.path_table: Optional[PathTable] = None
         self.previous_waypoint = None
 
         # Real position will be the actual pixel the enemy is at with every frame
+        # Previous real position is the real position before the latest tick, None until the first tick
         self.real_position = None
+        self.previous_real_position = None
 
-        # Init enemy attributes
-        self.max_hp = template_enemies[enemy_type]["health"]
-        self.current_hp = template_enemies[enemy_type]["health"]
-        self.speed = template_enemies[enemy_type]["speed"]
-        self.money_value = template_enemies[enemy_type]["money_value"]
-        self.armor = template_enemies[enemy_type]["armor"]
-        self.enemy_asset_path = os.path.join(ENEMY_PATH, template_enemies[enemy_type]["enemy_asset"])
-
-        self.node_speed: int = 60 / self.speed
+        # Init enemy attributes, stats of the type are shared by every enemy of the type
+        self.stats: EnemyStats = get_enemy_stats(enemy_type)
+        self.current_hp = self.stats.health
 
         # TODO: Activate check paths once have some assets
         # if not os.path.exists(self.enemy_asset_path):
@@ -183,14 +178,82 @@ class Enemy:
         # Frame corresponding to the latest move
         self.last_move_frame = 0
 
-    def calculate_shortest_path(self, terrain: List[List], end_pos: List[int]) -> None:
-        # Calculate shortens path and save to self.shortest_path
-        self.shortest_path = a_star_algorithm(self.previous_waypoint, terrain, end_pos)
+        # Order in which the enemy was added to the entity registry, lower is spawned earlier
+        self.creation_index = 0
+
+        # Entity registry ID, 0 until the enemy is added to a level
+        self.entity_id = 0
+
+    @property
+    def max_hp(self) -> int:
+        return self.stats.health
+
+    @property
+    def speed(self) -> int:
+        return self.stats.speed
+
+    @property
+    def node_speed(self) -> float:
+        return self.stats.node_speed
+
+    @property
+    def money_value(self) -> int:
+        return self.stats.money_value
+
+    @property
+    def armor(self) -> int:
+        return self.stats.armor
+
+    @property
+    def enemy_asset_path(self) -> str:
+        return self.stats.asset_path
+
+    def calculate_shortest_path(
+            self,
+            terrain,
+            end_pos: List[int],
+            path_cache: Optional[PathCache] = None,
+            terrain_version: int = 0
+    ) -> None:
+        # Calculate shortest path and save to self.shortest_path, cached path is used if cache is given
+        if path_cache is not None:
+            shortest_path = path_cache.get(self.previous_waypoint, end_pos, terrain, terrain_version)
+            path_table = path_cache.get_table(self.previous_waypoint, end_pos, terrain_version)
+        else:
+            shortest_path = a_star_algorithm(self.previous_waypoint, terrain, end_pos)
+            path_table = None
+
+        self.set_shortest_path(shortest_path, path_table)
+
+    def set_shortest_path(self, shortest_path: List[List[int]], path_table: Optional[PathTable] = None) -> None:
+        self.shortest_path = shortest_path
+        self.path_index = 0
+        self.path_table = path_table if path_table is not None else PathTable([self.previous_waypoint] + shortest_path)
 
         # Based on where the next shortest path is calculate the movement vector
+        if len(self.shortest_path) == 0:
+            self.movement_vector = (0, 0)
+            return
+
         next_block = self.shortest_path[0]
         self.movement_vector = (next_block[0] - self.previous_waypoint[0], next_block[1] - self.previous_waypoint[1])
 
+    def interpolated_position(self, interpolation: float) -> Tuple[float, float]:
+        # Position between the previous tick and the current one, interpolation 0 is previous and 1 is current
+        if self.previous_real_position is None:
+            return self.real_position
+
+        previous_row, previous_col = self.previous_real_position
+        row, col = self.real_position
+        return previous_row + (row - previous_row) * interpolation, previous_col + (col - previous_col) * interpolation
+
+    def path_distance(self) -> float:
+        # Distance the enemy has travelled along its path
+        # Real position trails the block the enemy stands on, so it is projected to the segment leading to the block
+        if self.path_index == 0:
+            return 0.0
+        return self.path_table.distance_on_segment(self.path_index - 1, self.real_position)
+
     def real_position_change(self):
         # print(F"Movement vector: {self.enemy_movement_vector}")
         enemy_movement_unit_vector = (self.movement_vector[0] / self.speed, self.movement_vector[1] / self.speed)
@@ -198,12 +261,11 @@ class Enemy:
         # Real position change based on enemy movement vector
         self.real_position = (self.real_position[0] + enemy_movement_unit_vector[0], self.real_position[1] + enemy_movement_unit_vector[1])
 
-    def move_forward(self, terrain: List[List], end_pos: List[List[int]], current_frame: int) -> bool:
+    def move_forward(self, level, current_frame: int) -> bool:
         """
         Move enemy to the next block
+        :param level: Level the enemy moves in
         :param current_frame:
-        :param end_pos:
-        :param terrain:
         :return: True if enemy reaches the end block and False otherwise
         """
         self.real_position_change()
@@ -213,29 +275,43 @@ class Enemy:
         if current_frame - self.last_move_frame < self.speed:
             return False
 
+        return self.step_forward(level, current_frame)
+
+    def step_forward(self, level, current_frame: int) -> bool:
+        """
+        Move enemy to the next block without changing the real position, caller makes sure the enemy is allowed to move
+        :param level: Level the enemy moves in
+        :param current_frame:
+        :return: True if enemy reaches the end block and False otherwise
+        """
         # Move enemy to the next block
         # TODO: Base on the movement speed of the enemy check if it is supposed to move now
-        next_block = self.shortest_path.pop(0)
+        # Path is empty when the end block cannot be reached, the enemy stays in place
+        if self.path_index >= len(self.shortest_path):
+            self.movement_vector = (0, 0)
+            return False
+
+        next_block = self.shortest_path[self.path_index]
 
         # Calculate the movement vector
         self.movement_vector = (next_block[0] - self.previous_waypoint[0], next_block[1] - self.previous_waypoint[1])
 
         # Make certain next block is not occupied by another enemy
-        if isinstance(terrain[next_block[0]][next_block[1]], Enemy):
+        if level.terrain.is_occupied(next_block[0], next_block[1]):
             return False
 
-        # Move enemy to the next block
-        terrain[next_block[0]][next_block[1]] = self
-        terrain[self.previous_waypoint[0]][self.previous_waypoint[1]] = TerrainBlock(0)
+        # Move enemy to the next block, level keeps the terrain up to date
+        level.update(0, current_position=self.previous_waypoint, new_position=next_block)
 
         # Update enemy position
         self.previous_waypoint = next_block
+        self.path_index += 1
 
         # Update last move frame
         self.last_move_frame = current_frame
 
         # Check if enemy reached the end
-        return self.previous_waypoint in end_pos
+        return self.previous_waypoint in level.end_blocks
 
     def take_damage(self, damage: int) -> bool:
         # General damage logic for all enemies, total_damage = damage - armor
@@ -243,14 +319,9 @@ class Enemy:
 
         if total_damage > 0:
             self.current_hp -= total_damage
-            print(f"Taking {total_damage} damage! HP: {self.current_hp}")
 
         # Check if enemy is dead
-        if self.current_hp <= 0:
-            print("Enemy is dead!")
-            return True
-
-        return False
+        return self.current_hp <= 0
 
     def apply_actions(self):
         # Apply actions based on enemy type
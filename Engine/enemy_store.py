@@ -0,0 +1,184 @@
+from typing import Optional, List, Tuple
+
+from Engine.enemy import Enemy
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+Struct of arrays storage for enemies
+
+Enemy attributes that change every frame are stored in NumPy arrays, one row per enemy slot,
+so that movement and damage can be applied to every enemy at once.
+StoredEnemy is a thin view over one slot so the rest of the engine can keep using enemies as objects.
+
+The store is optional and only used when NumPy is installed.
+"""
+
+
+class EnemyStore:
+    def __init__(self, capacity: int = 64):
+        if np is None:
+            raise ImportError("EnemyStore requires numpy")
+
+        self.capacity = 0
+
+        # Per slot arrays
+        self.position = np.zeros((0, 2), dtype=np.float64)
+        self.previous_position = np.zeros((0, 2), dtype=np.float64)
+        self.movement = np.zeros((0, 2), dtype=np.float64)
+        self.current_hp = np.zeros(0, dtype=np.int64)
+        self.max_hp = np.zeros(0, dtype=np.int64)
+        self.armor = np.zeros(0, dtype=np.int64)
+        self.speed = np.zeros(0, dtype=np.int64)
+        self.path_index = np.zeros(0, dtype=np.int64)
+        self.last_move_frame = np.zeros(0, dtype=np.int64)
+        # Registry creation index of the enemy in the slot, used to process enemies in spawn order
+        self.creation_index = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+
+        # Enemy view owning each slot
+        self.enemies: List[Optional["StoredEnemy"]] = []
+        self.free_slots: List[int] = []
+
+        self.grow(capacity)
+
+    def grow(self, new_capacity: int):
+        extra = new_capacity - self.capacity
+
+        self.position = np.concatenate((self.position, np.full((extra, 2), np.nan)))
+        self.previous_position = np.concatenate((self.previous_position, np.full((extra, 2), np.nan)))
+        self.movement = np.concatenate((self.movement, np.full((extra, 2), np.nan)))
+        for name in ("current_hp", "max_hp", "armor", "speed", "path_index", "last_move_frame", "creation_index"):
+            setattr(self, name, np.concatenate((getattr(self, name), np.zeros(extra, dtype=np.int64))))
+        self.alive = np.concatenate((self.alive, np.zeros(extra, dtype=bool)))
+
+        self.enemies.extend([None] * extra)
+        # Free slots are popped from the end, so keep the lowest slots last
+        self.free_slots.extend(range(new_capacity - 1, self.capacity - 1, -1))
+        self.capacity = new_capacity
+
+    def __len__(self):
+        return self.capacity - len(self.free_slots)
+
+    def add(self, enemy: "StoredEnemy") -> int:
+        if len(self.free_slots) == 0:
+            self.grow(self.capacity * 2)
+
+        slot = self.free_slots.pop()
+
+        self.position[slot] = np.nan
+        self.previous_position[slot] = np.nan
+        self.movement[slot] = np.nan
+        self.path_index[slot] = 0
+        self.last_move_frame[slot] = 0
+        self.creation_index[slot] = 0
+        self.alive[slot] = True
+        self.enemies[slot] = enemy
+
+        return slot
+
+    def remove(self, slot: int):
+        if not self.alive[slot]:
+            raise ValueError(f"Enemy slot {slot} is not in use")
+
+        self.alive[slot] = False
+        self.enemies[slot] = None
+        self.free_slots.append(slot)
+
+    def integrate_positions(self):
+        # Move the real position of every enemy by one frame worth of its movement vector
+        moving = self.alive & ~np.isnan(self.movement[:, 0]) & ~np.isnan(self.position[:, 0])
+        self.position[moving] += self.movement[moving] / self.speed[moving, None]
+
+    def save_previous_positions(self):
+        self.previous_position[:] = self.position
+
+    def due_enemies(self, current_frame: int) -> List["StoredEnemy"]:
+        # Enemies allowed to move to the next block this frame, in spawn order
+        due_slots = np.flatnonzero(self.alive & (current_frame - self.last_move_frame >= self.speed))
+        due_slots = due_slots[np.argsort(self.creation_index[due_slots], kind="stable")]
+
+        return [self.enemies[slot] for slot in due_slots]
+
+    def apply_damage(self, slots, damage) -> "np.ndarray":
+        """
+        Apply damage to multiple enemies at once, total_damage = damage - armor
+        Same slot can appear multiple times and every hit is applied
+        :param slots: Slots of the enemies hit
+        :param damage: Damage of every hit, single value or one per slot
+        :return: Boolean array telling which of the given slots are dead after all hits
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        total_damage = np.maximum(np.asarray(damage, dtype=np.int64) - self.armor[slots], 0)
+        np.subtract.at(self.current_hp, slots, total_damage)
+
+        return self.current_hp[slots] <= 0
+
+
+class _ScalarField:
+    """ Descriptor that reads and writes one slot of a scalar store array """
+
+    def __init__(self, array_name: str):
+        self.array_name = array_name
+
+    def __get__(self, enemy, owner=None):
+        if enemy is None:
+            return self
+        return int(getattr(enemy.store, self.array_name)[enemy.slot])
+
+    def __set__(self, enemy, value):
+        getattr(enemy.store, self.array_name)[enemy.slot] = value
+
+
+class _VectorField:
+    """ Descriptor for a slot of a (n, 2) store array, None is stored as NaN """
+
+    def __init__(self, array_name: str):
+        self.array_name = array_name
+
+    def __get__(self, enemy, owner=None) -> Optional[Tuple[float, float]]:
+        if enemy is None:
+            return self
+
+        row, col = getattr(enemy.store, self.array_name)[enemy.slot]
+        if row != row:
+            return None
+        return float(row), float(col)
+
+    def __set__(self, enemy, value):
+        if value is None:
+            value = (np.nan, np.nan)
+        getattr(enemy.store, self.array_name)[enemy.slot] = value
+
+
+class StoredEnemy(Enemy):
+    """ Enemy whose per frame attributes live in an EnemyStore slot """
+
+    real_position = _VectorField("position")
+    previous_real_position = _VectorField("previous_position")
+    movement_vector = _VectorField("movement")
+    current_hp = _ScalarField("current_hp")
+    max_hp = _ScalarField("max_hp")
+    armor = _ScalarField("armor")
+    speed = _ScalarField("speed")
+    path_index = _ScalarField("path_index")
+    last_move_frame = _ScalarField("last_move_frame")
+    creation_index = _ScalarField("creation_index")
+
+    def __init__(self, enemy_type: str, store: EnemyStore):
+        # Slot has to exist before the Enemy init writes the attributes
+        self.store = store
+        self.slot = store.add(self)
+
+        super().__init__(enemy_type)
+
+        # Store arrays need the stats of the enemy for the batched movement and damage
+        store.max_hp[self.slot] = self.stats.health
+        store.armor[self.slot] = self.stats.armor
+        store.speed[self.slot] = self.stats.speed
+
+    def release(self):
+        self.store.remove(self.slot)
@@ -1,61 +1,189 @@
 """
 Engine class that binds all the modules of the engine
 """
+from dataclasses import dataclass
+from typing import Optional
+
 from Engine.game import Game
-from Engine.render import Render, ReturnPackage
-from pygame import time
+from Engine.package import ReturnPackage
+from Engine.replay import Recording
+from Engine.trace import traced
+from Engine.waves import load_waves
 from time import perf_counter
 
 
-class Engine:
-    from Engine.render import ReturnPackage
+# Simulation ticks per second of game time at normal speed
+TICK_RATE = 60
+# Selectable game speed multipliers
+GAME_SPEEDS = (1, 2, 4, 16)
+# Longest wall clock time in seconds a single rendered frame can add to the simulation
+MAX_FRAME_TIME = 0.25
+
+
+@dataclass
+class SimulationResult:
+    """ Final state and timing of a headless run """
+    ticks: int
+    elapsed_time: float
+    ticks_per_second: float
+    frame: int
+    lives: int
+    money: int
+    kills: int
+    current_wave: int
+    enemies_left: int
+    towers: int
+    game_over: bool
+    level_cleared: bool
 
-    def __init__(self):
-        self.game = Game()
-        self.render = Render()
-        self.clock = time.Clock()
 
-        self.render_times = []
+class Engine:
+    def __init__(self, headless: bool = False, use_enemy_store: bool = False, seed: Optional[int] = None,
+                 waves_path: Optional[str] = None, verbose: bool = False):
+        # Startup is measured from here to the first frame on screen
+        self.start_time = perf_counter()
+        self.time_to_first_frame: Optional[float] = None
+        # Print the startup report once the first frame is on screen
+        self.verbose = verbose
+
+        waves = load_waves(waves_path) if waves_path is not None else None
+        self.game = Game(use_enemy_store=use_enemy_store, seed=seed, waves=waves)
+        self.headless = headless
+        self.game_speed = 1
+
+        # Every applied package is recorded so the session can be replayed from the seed
+        self.recording = Recording(seed=self.game.seed, use_enemy_store=use_enemy_store, waves_path=waves_path)
+
+        # Headless engine never imports the pygame display code
+        self.render = None
+        self.clock = None
+        if not headless:
+            from Engine.render import Render
+            from pygame import time
+            self.render = Render()
+            self.clock = time.Clock()
 
         self.DEBUG_MODE = False
 
     def print_game(self):
-        from Engine.level import TerrainBlock
-        from Engine.enemy import Enemy
-        from Engine.tower import Tower
-        for row in self.game.level.terrain:
-            for block in row:
-                if isinstance(block, TerrainBlock):
-                    print(block.block_type, end=" ")
-                elif isinstance(block, Enemy):
+        terrain = self.game.level.terrain
+        for row in range(terrain.rows):
+            for col in range(terrain.cols):
+                if not terrain.is_occupied(row, col):
+                    print(terrain.get_block_type(row, col), end=" ")
+                elif terrain.get_block_type(row, col) == 0:
                     print("E", end=" ")
-                elif isinstance(block, Tower):
+                else:
                     print("T", end=" ")
             print()
 
         print("\n")
 
+    @traced("engine.handle_package")
     def handle_package(self, return_package: ReturnPackage):
-        # TODO: also needs upgrade tower
         from Engine.tower import Tower
+        self.recording.record(self.game.frame, return_package)
+
+        if return_package.game_speed is not None and return_package.game_speed in GAME_SPEEDS:
+            self.game_speed = return_package.game_speed
+
         if return_package.game_over is True:
             self.game.game_running = False
         elif return_package.new_tower_position is not None and return_package.new_tower_type is not None:
-            new_tower = Tower("standard", return_package.new_tower_position)
-            self.game.level.update(2, current_position=return_package.new_tower_position, tower=new_tower)
+            # Towers cost money to build and upgrade and selling refunds what was paid for the tower
+            # Actions the player can not afford and actions on a slot that does not allow them are ignored
+            position = return_package.new_tower_position
+            new_tower = Tower("standard", position)
+            if self.is_empty_tower_slot(position) and self.game.money >= new_tower.cost:
+                self.game.level.update(2, current_position=position, tower=new_tower)
+                self.game.money -= new_tower.cost
+                new_tower.money_spent = new_tower.cost
         elif return_package.remove_tower_position is not None:
-            self.game.level.update(3, current_position=return_package.remove_tower_position)
+            position = return_package.remove_tower_position
+            tower = self.get_tower(position)
+            if tower is not None:
+                self.game.level.update(3, current_position=position)
+                self.game.money += tower.money_spent
+        elif return_package.upgrade_tower_position is not None:
+            position = return_package.upgrade_tower_position
+            tower = self.get_tower(position)
+            if tower is not None and tower.can_upgrade() and self.game.money >= tower.upgrade_cost():
+                upgrade_cost = tower.upgrade_cost()
+                self.game.level.update(4, current_position=position)
+                self.game.money -= upgrade_cost
+                tower.money_spent += upgrade_cost
+
+    def is_empty_tower_slot(self, position) -> bool:
+        terrain = self.game.level.terrain
+        return (terrain.in_bounds(position[0], position[1]) and terrain.get_block_type(position[0], position[1]) == 1
+                and not terrain.is_occupied(position[0], position[1]))
+
+    def get_tower(self, position):
+        # Tower standing on the position, None if there is none
+        from Engine.tower import Tower
+        terrain = self.game.level.terrain
+        if not terrain.in_bounds(position[0], position[1]):
+            return None
+        occupant = self.game.level.get_occupant(position[0], position[1])
+        return occupant if isinstance(occupant, Tower) else None
+
+    def run_headless(self, max_ticks: Optional[int] = None) -> SimulationResult:
+        """
+        Step the game as fast as possible without rendering or tick rate
+        Runs until game is over, level is cleared or max_ticks is reached
+        :param max_ticks: Maximum amount of game updates, None runs until the game ends
+        :return: Final state and timing of the run
+        """
+        ticks = 0
+        start = perf_counter()
+
+        while self.game.game_running and not self.game.level.is_cleared():
+            if max_ticks is not None and ticks >= max_ticks:
+                break
+
+            self.game.update()
+            ticks += 1
+
+        elapsed_time = perf_counter() - start
+        self.recording.finish(self.game)
+
+        return SimulationResult(
+            ticks=ticks,
+            elapsed_time=elapsed_time,
+            ticks_per_second=ticks / elapsed_time if elapsed_time > 0 else 0.0,
+            frame=self.game.frame,
+            lives=self.game.lives,
+            money=self.game.money,
+            kills=self.game.enemies_killed,
+            current_wave=self.game.level.current_wave,
+            enemies_left=len(self.game.level.enemies),
+            towers=len(self.game.level.towers),
+            game_over=self.game.lives <= 0,
+            level_cleared=self.game.level.is_cleared(),
+        )
+
+    def run(self, max_ticks: Optional[int] = None) -> Optional[SimulationResult]:
+        if self.headless:
+            return self.run_headless(max_ticks)
+
+        # Fixed timestep loop, simulation always advances in ticks of 1 / TICK_RATE seconds of game time
+        # Rendering happens once per loop and catches up with as many ticks as needed
+        tick_time = 1 / TICK_RATE
+        accumulator = 0.0
+        previous_time = perf_counter()
 
-    def run(self):
         while self.game.game_running:
-            if self.game.frame % 60 == 0:
-                print("Frame: ", self.game.frame)
+            current_time = perf_counter()
+            # Limit the frame time so a long stall does not cause an endless catch up
+            frame_time = min(current_time - previous_time, MAX_FRAME_TIME)
+            previous_time = current_time
 
-                if self.DEBUG_MODE:
-                    self.print_game()
+            # Faster game speed runs more ticks for the same wall clock time, but never more renders
+            accumulator += frame_time * self.game_speed
 
-            # Update loop to run the game
-            self.game.update()
+            while accumulator >= tick_time and self.game.game_running:
+                self.tick()
+                accumulator -= tick_time
 
             # Render info package
             render_package = {
@@ -63,23 +191,39 @@ class Engine:
                 "lives": self.game.lives,
                 "current_frame": self.game.frame,
                 "level": self.game.level,
+                "projectiles": self.game.projectiles,
+                "game_speed": self.game_speed,
+                # How far the game time is between the last tick and the next one, used to smooth enemy movement
+                "interpolation": min(accumulator / tick_time, 1.0),
             }
             if not self.DEBUG_MODE:
-                start = perf_counter()
+                # Render time is measured by the tracer span of Render.update when tracing is enabled
                 return_package: ReturnPackage = self.render.update(render_package)
-                end = perf_counter()
-                self.render_times.append(end - start)
 
-                # Calculate average render time every 60 frames
-                if self.game.frame % 60 == 0:
-                    print("Average render time: ", sum(self.render_times) / len(self.render_times))
-                    self.render_times = []
+                if self.time_to_first_frame is None:
+                    self.time_to_first_frame = (perf_counter() - self.start_time) * 1000
+                    if self.verbose:
+                        print(self.startup_report())
 
                 # Deal with the package and check up all the evens
                 self.handle_package(return_package)
 
-            # Create tick rate
-            self.clock.tick(60)
+            # Limit the render rate, simulation speed does not depend on it
+            self.clock.tick(TICK_RATE)
 
         # Cleanup
+        self.recording.finish(self.game)
         self.render.close_window()
+
+    def startup_report(self) -> str:
+        from Engine.assets import assets
+        startup_times = self.render.startup_times
+        return (f"Time to first frame {self.time_to_first_frame:.1f} ms (window {startup_times['window']:.1f} ms, "
+                f"assets {startup_times['assets']:.1f} ms, atlas cache {'hit' if assets.cache_hit else 'miss'})")
+
+    def tick(self):
+        if self.DEBUG_MODE and self.game.frame % 60 == 0:
+            self.print_game()
+
+        # Update loop to run the game
+        self.game.update()
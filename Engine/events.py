@@ -0,0 +1,122 @@
+import json
+from collections import Counter
+from dataclasses import dataclass, asdict
+from typing import Callable, List, Tuple
+
+"""
+Game event bus
+
+Game code publishes typed events instead of printing. Events are buffered during a tick and delivered
+to every subscriber in one batch at the end of the tick, together with the frame of that tick.
+Subscribers are callables taking (frame, events), for example ConsoleLogger, FileSink and EventCounter.
+
+Publishers check EventBus.active before creating an event, so without subscribers publishing
+costs one attribute check and no event objects are created.
+"""
+
+
+@dataclass(frozen=True, slots=True)
+class ShotFired:
+    tower_position: Tuple[int, int]
+    enemy_index: int
+    angle: float
+
+
+@dataclass(frozen=True, slots=True)
+class EnemyDamaged:
+    enemy_index: int
+    damage: int
+    hp_left: int
+
+
+@dataclass(frozen=True, slots=True)
+class EnemyKilled:
+    enemy_index: int
+    enemy_type: str
+    position: Tuple[int, int]
+    money_value: int
+
+
+@dataclass(frozen=True, slots=True)
+class EnemyLeaked:
+    enemy_index: int
+    enemy_type: str
+    lives_left: int
+
+
+@dataclass(frozen=True, slots=True)
+class WaveStarted:
+    wave: int
+
+
+@dataclass(frozen=True, slots=True)
+class TowerPlaced:
+    tower_type: str
+    position: Tuple[int, int]
+
+
+@dataclass(frozen=True, slots=True)
+class GameOver:
+    lives: int
+
+
+class EventBus:
+    def __init__(self):
+        self.subscribers: List[Callable] = []
+        self.buffer: List = []
+        # True when anyone listens, publishers skip creating events otherwise
+        self.active = False
+
+    def subscribe(self, subscriber: Callable):
+        self.subscribers.append(subscriber)
+        self.active = True
+
+    def unsubscribe(self, subscriber: Callable):
+        self.subscribers.remove(subscriber)
+        self.active = len(self.subscribers) > 0
+
+    def publish(self, event):
+        # Use as: if events.active: events.publish(ShotFired(...))
+        self.buffer.append(event)
+
+    def flush(self, frame: int):
+        # Deliver the events of the tick to every subscriber in one batch
+        if not self.buffer:
+            return
+
+        events = self.buffer
+        self.buffer = []
+        for subscriber in self.subscribers:
+            subscriber(frame, events)
+
+
+class ConsoleLogger:
+    """ Prints every event, same information the game used to print """
+
+    def __call__(self, frame: int, events: List):
+        print("\n".join(f"Frame {frame}: {event}" for event in events))
+
+
+class FileSink:
+    """ Writes every event as one JSON line with the frame and event type """
+
+    def __init__(self, path: str):
+        self.file = open(path, "w")
+
+    def __call__(self, frame: int, events: List):
+        self.file.writelines(
+            json.dumps({"frame": frame, "event": type(event).__name__, **asdict(event)}) + "\n" for event in events
+        )
+
+    def close(self):
+        self.file.close()
+
+
+class EventCounter:
+    """ Counts events by type """
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def __call__(self, frame: int, events: List):
+        self.counts.update(type(event).__name__ for event in events)
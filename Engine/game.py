@@ -1,10 +1,16 @@
 from typing import Optional, List, Tuple
+import hashlib
 import random
 
 # Engine modules
+import Engine.targeting as targeting
 from Engine.tower import Tower
 from Engine.enemy import Enemy
-from Engine.level import Level, TerrainBlock
+from Engine.events import EventBus, EnemyKilled, EnemyLeaked, GameOver
+from Engine.level import Level
+from Engine.projectile import ProjectilePool, SECONDS_PER_TICK, resolve_hits
+from Engine.trace import traced
+from Engine.waves import Wave
 
 """
 Class that handles all the logic of the game
@@ -19,13 +25,29 @@ Enemies killed give some money
 """
 
 
+def normalize_position(position) -> Optional[Tuple[float, float]]:
+    if position is None:
+        return None
+    return float(position[0]), float(position[1])
+
+
 class Game:
-    def __init__(self):
+    def __init__(self, use_enemy_store: bool = False, seed: Optional[int] = None, waves: Optional[List[Wave]] = None):
         # Init the game state
         self.state: List[List] = []
 
-        # Init level
-        self.level = Level()
+        # Game owns the only random generator, the same seed always creates the same game
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed)
+
+        # Game events are published here and delivered to the subscribers once per tick
+        self.events = EventBus()
+
+        # Init level, enemy store keeps enemies in NumPy arrays which pays off with large amounts of enemies
+        self.level = Level(use_enemy_store=use_enemy_store, rng=self.rng, events=self.events, waves=waves)
+
+        # Projectiles in flight, towers launch them and they deal their damage when they hit an enemy
+        self.projectiles = ProjectilePool()
 
         # Current frame of the game
         self.frame = 0
@@ -34,6 +56,7 @@ class Game:
         self.game_running = True
         self.lives = 10
         self.money = 1000
+        self.enemies_killed = 0
 
         # Force spawn turret for testing
         # self.force_spawn_turret_for_testing()
@@ -52,64 +75,123 @@ class Game:
         if len(self.level.tower_slots) == 0:
             return
 
-        random_turret_position = random.choice(self.level.tower_slots)
+        random_turret_position = self.rng.choice(self.level.tower_slots)
         new_tower = Tower("standard", random_turret_position)
         self.level.update(2, current_position=random_turret_position, tower=new_tower)
 
+    @traced("game.tower_actions")
     def tower_actions(self):
         # Function that applies all the tower damage to enemies in their area
-        # Loop through towers and loop through every enemy in their are of influence, and then apply towers damage
-        for tower in self.level.towers:
-            possible_death_enemy: Enemy = tower.shoot(self.level.enemies, self.frame)
-
-            if possible_death_enemy is None:
-                continue
-
-            # If enemy dies, remove it from the enemy_list, add 0 terrain block to the position and add money
-            self.money += possible_death_enemy.money_value
-            self.level.update(1, current_position=possible_death_enemy.previous_waypoint)
-
+        # Targets of all towers are selected in one pass using the level coverage tables,
+        # then every tower launches a projectile at its target in order
+        selection = targeting.select_targets(self.level.towers, self.level, self.frame)
+        targeting.apply_shots(self.level.towers, selection, self.frame, self.events, projectiles=self.projectiles)
+
+    @traced("game.projectile_actions")
+    def projectile_actions(self):
+        # Move every projectile, projectiles that hit an enemy deal their damage and disappear
+        terrain = self.level.terrain
+        self.projectiles.step(SECONDS_PER_TICK, terrain.rows, terrain.cols)
+
+        hits = self.projectiles.find_hits(self.level.enemies, self.level.enemy_store)
+        for dead_enemy in resolve_hits(self.projectiles, hits, self.events, self.level.enemy_store):
+            self.handle_enemy_killed(dead_enemy)
+
+    def handle_enemy_killed(self, enemy: Enemy):
+        # If enemy dies, remove it from the enemy_list, add 0 terrain block to the position and add money
+        self.money += enemy.money_value
+        self.enemies_killed += 1
+        if self.events.active:
+            position = enemy.previous_waypoint
+            self.events.publish(EnemyKilled(enemy.creation_index, enemy.enemy_type,
+                                            (position[0], position[1]), enemy.money_value))
+        self.level.update(1, enemy=enemy)
+
+    @traced("game.enemy_actions")
     def enemy_actions(self):
         # Go through all the enemies and try to move them forward
         # For enemy to know which next block to go calculate the shortest path using A* algorithm
 
         # For now this will be little clunky because if the order of moving enemies is not right,
         # enemies will block each other for now because they cannot yet overlap
-        for enemy in self.level.enemies:
+        enemy_store = self.level.enemy_store
+        if enemy_store is not None:
+            # Move every real position at once and only step the enemies that are allowed to move this frame
+            enemy_store.integrate_positions()
+            for enemy in enemy_store.due_enemies(self.frame):
+                enemy_reach_end = enemy.step_forward(self.level, self.frame)
+                self.handle_enemy_reach_end(enemy, enemy_reach_end)
+            return
+
+        # Enemies move in spawn order so the enemy in front moves away before the one behind it tries to move
+        for enemy in self.level.enemies_in_spawn_order():
             # Move enemy
-            enemy_reach_end = enemy.move_forward(self.level.terrain, self.level.end_blocks, self.frame)
-
-            # Print enemy shortest path
-            if abs(enemy.movement_vector[0]) > 0 and abs(enemy.movement_vector[1]) > 0:
-                # print("Current waypoint: ", enemy.previous_waypoint)
-                # print("Next waypoint: ", enemy.shortest_path[0])
-                # print("movement vector: ", enemy.movement_vector)
-                pass
-
-            if enemy_reach_end:
-                # If enemy reached the end, remove enemy from the list, remove 0 terrain block from the position
-                # and remove 1 life from the player
-                self.lives -= 1
-                self.level.update(1, current_position=enemy.previous_waypoint)
-                print(f"Enemy reached the end! Lives left: {self.lives}")
+            enemy_reach_end = enemy.move_forward(self.level, self.frame)
+            self.handle_enemy_reach_end(enemy, enemy_reach_end)
+
+    def handle_enemy_reach_end(self, enemy: Enemy, enemy_reach_end: bool):
+        if enemy_reach_end:
+            # If enemy reached the end, remove enemy from the list, remove 0 terrain block from the position
+            # and remove 1 life from the player
+            self.lives -= 1
+            self.level.update(1, enemy=enemy)
+            if self.events.active:
+                self.events.publish(EnemyLeaked(enemy.creation_index, enemy.enemy_type, self.lives))
+
+    def save_previous_positions(self):
+        # Real positions before this tick, render interpolates between them and the current positions
+        self.projectiles.save_previous_positions()
+
+        enemy_store = self.level.enemy_store
+        if enemy_store is not None:
+            enemy_store.save_previous_positions()
+            return
 
+        for enemy in self.level.enemies:
+            enemy.previous_real_position = enemy.real_position
+
+    def state_digest(self) -> str:
+        # Hash of everything that makes up the game state, two games with the same digest are in the same state
+        state = (
+            self.frame, self.lives, self.money, self.game_running,
+            self.level.current_wave, self.level.wave_schedule.state(),
+            # Positions are lists or tuples depending on the enemy storage, normalized so both hash the same
+            [(enemy.enemy_type, enemy.previous_waypoint, normalize_position(enemy.real_position),
+              enemy.current_hp, enemy.path_index)
+             for enemy in self.level.enemies_in_spawn_order()],
+            [(tower.type, tower.position, tower.tower_level, tower.last_shot_frame, tower.angle)
+             for tower in self.level.towers],
+            self.projectiles.state(),
+        )
+        return hashlib.sha256(repr(state).encode()).hexdigest()
+
+    @traced("game.update")
     def update(self):
         """
         1. Move all enemies forward
         1.1 Check if enemy reach the end --> lose life if so
 
-        2. Check tower actions
-        2.1 Deal damage to enemies, if enemy dies remove it, add money
+        2. Move projectiles
+        2.1 Deal damage to enemies that got hit, if enemy dies remove it, add money
+
+        3. Check tower actions
+        3.1 Launch projectiles at the enemies in range
 
-        3. Check if new enemy should spawn
-        3.1 Run the level class which has logic how to spawn enemies
+        4. Check if new enemy should spawn
+        4.1 Run the level class which has logic how to spawn enemies
         """
         if self.lives <= 0:
-            print("Game over! You lost all your lives!")
             self.game_running = False
+            if self.events.active:
+                self.events.publish(GameOver(self.lives))
 
+        self.save_previous_positions()
         self.enemy_actions()
+        self.projectile_actions()
         self.tower_actions()
         self.level.spawn_enemy_wave(self.frame)
 
+        # Deliver the events of this tick in one batch
+        self.events.flush(self.frame)
+
         self.frame += 1
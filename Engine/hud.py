@@ -0,0 +1,168 @@
+from typing import Optional, Tuple, List
+import pygame
+
+"""
+Retained mode HUD
+
+The HUD is a list of widgets that keep their rendered surface between frames. Every widget is bound to a value
+of the dict passed to HUD.update and renders its surface again only when that value changes, on every other
+frame it costs one comparison. A widget that rendered again reports the region that changed, the union of
+where it was and where it is now.
+
+Widgets are drawn with the same draw commands as the rest of the frame, in the order they were added.
+"""
+
+# Value of a widget that has not been rendered yet, never equal to a bound value
+UNSET = object()
+
+
+class Widget:
+    def __init__(self, position: Tuple[int, int]):
+        self.position = position
+
+        # Bound value the surface was rendered from and the rendered surface, None surface is not drawn
+        self.value = UNSET
+        self.surface: Optional[pygame.Surface] = None
+        self.rect = pygame.Rect(position, (0, 0))
+
+    def bound_value(self, values: dict):
+        raise NotImplementedError
+
+    def render(self, value) -> Optional[pygame.Surface]:
+        raise NotImplementedError
+
+    def update(self, values: dict) -> Optional[pygame.Rect]:
+        """
+        Render the widget again if its bound value changed
+        :return: Region that changed, None if nothing changed
+        """
+        value = self.bound_value(values)
+        if value == self.value:
+            return None
+
+        previous_rect = self.rect
+        self.value = value
+        self.surface = self.render(value)
+        self.rect = pygame.Rect(self.position, self.surface.get_size() if self.surface is not None else (0, 0))
+
+        return previous_rect.union(self.rect)
+
+    def draw_command(self) -> Optional[tuple]:
+        if self.surface is None:
+            return None
+        return "blit", self.surface, self.rect.topleft
+
+
+class Panel(Widget):
+    """ Translucent background of other widgets, rendered once """
+
+    def __init__(self, rect: pygame.Rect, colour: Tuple[int, int, int, int], border_radius: int = 0):
+        super().__init__(rect.topleft)
+        self.size = rect.size
+        self.colour = colour
+        self.border_radius = border_radius
+
+    def bound_value(self, values: dict):
+        return self.size, self.colour
+
+    def render(self, value) -> pygame.Surface:
+        surface = pygame.Surface(self.size, pygame.SRCALPHA)
+        pygame.draw.rect(surface, self.colour, surface.get_rect(), border_radius=self.border_radius)
+        return surface
+
+
+class Label(Widget):
+    """
+    Text bound to one value
+    Text is text_format filled in with the value, None value hides the label
+    """
+
+    def __init__(self, position: Tuple[int, int], font: pygame.font.Font, colour, text_format: str, value_key: str):
+        super().__init__(position)
+        self.font = font
+        self.colour = colour
+        self.text_format = text_format
+        self.value_key = value_key
+
+    def bound_value(self, values: dict):
+        return values.get(self.value_key)
+
+    def render(self, value) -> Optional[pygame.Surface]:
+        if value is None:
+            return None
+        return self.font.render(self.text_format.format(value), True, self.colour)
+
+
+class Button(Widget):
+    """
+    Clickable text button
+    Bound to whether it is enabled and whether the mouse is over it, clicking an enabled button returns its action
+    """
+
+    # Background colour of the button when it is disabled, enabled and enabled with the mouse over it
+    COLOURS = {
+        "disabled": (60, 60, 60),
+        "enabled": (40, 90, 150),
+        "hovered": (70, 130, 200),
+    }
+
+    def __init__(self, rect: pygame.Rect, font: pygame.font.Font, text: str, action: str, enabled_key: str):
+        super().__init__(rect.topleft)
+        self.size = rect.size
+        self.button_rect = pygame.Rect(rect)
+        self.font = font
+        self.text = text
+        self.action = action
+        self.enabled_key = enabled_key
+
+    @property
+    def enabled(self) -> bool:
+        return self.value is not UNSET and self.value[0]
+
+    def bound_value(self, values: dict):
+        enabled = bool(values.get(self.enabled_key))
+        mouse_position = values.get("mouse_position")
+        hovered = mouse_position is not None and self.button_rect.collidepoint(mouse_position)
+        return enabled, enabled and hovered
+
+    def render(self, value) -> pygame.Surface:
+        enabled, hovered = value
+        state = "hovered" if hovered else "enabled" if enabled else "disabled"
+
+        surface = pygame.Surface(self.size)
+        surface.fill(self.COLOURS[state])
+
+        text = self.font.render(self.text, True, "White" if enabled else "Gray")
+        surface.blit(text, text.get_rect(center=surface.get_rect().center))
+        return surface
+
+
+class HUD:
+    def __init__(self):
+        self.widgets: List[Widget] = []
+
+    def add(self, widget: Widget) -> Widget:
+        self.widgets.append(widget)
+        return widget
+
+    def update(self, values: dict) -> List[pygame.Rect]:
+        """
+        Update every widget from the bound values
+        :return: Regions of the widgets that rendered again
+        """
+        dirty_rects = []
+        for widget in self.widgets:
+            dirty_rect = widget.update(values)
+            if dirty_rect is not None:
+                dirty_rects.append(dirty_rect)
+        return dirty_rects
+
+    def draw_commands(self) -> List[tuple]:
+        return [command for command in (widget.draw_command() for widget in self.widgets) if command is not None]
+
+    def click(self, position: Tuple[int, int]) -> Optional[str]:
+        # Action of the enabled button at the position, None if there is none
+        for widget in reversed(self.widgets):
+            if isinstance(widget, Button) and widget.enabled and widget.rect.collidepoint(position):
+                return widget.action
+        return None
@@ -1,7 +1,15 @@
+import math
 import random
+from array import array
+from collections import deque
 
-from typing import Optional, List
+from typing import Optional, List, Tuple, Callable
+from Engine.events import EventBus, WaveStarted, TowerPlaced
+from Engine.registry import EntityRegistry
 from Engine.tower import Tower
+from Engine.units import TOWER_STATS
+from Engine.trace import traced
+from Engine.waves import Wave, WaveSchedule, load_waves
 
 
 class TerrainBlock:
@@ -21,6 +29,74 @@ class TerrainBlock:
         self.asset_image = asset_image_path
 
 
+# Blocks of the same type are identical, so one shared block per type is used everywhere
+TERRAIN_BLOCKS = {block_type: TerrainBlock(block_type) for block_type in (0, 1, 2)}
+
+
+class Terrain:
+    """
+    Terrain grid split into two layers
+
+    Block layer holds the static block type of every block in a bytearray.
+    Occupancy layer holds the entity registry ID of the enemy or tower standing on the block, 0 when the block is empty.
+    Both layers are flat and row major, block (row, col) is at index row * cols + col.
+
+    Enemies can only stand on path blocks and towers only on tower placements,
+    so the block type alone tells what kind of entity an occupied block holds.
+    """
+
+    def __init__(self, rows: int, cols: int, block_type: int = 2):
+        self.rows = rows
+        self.cols = cols
+
+        self.blocks = bytearray([block_type]) * (rows * cols)
+        self.occupancy = array("q", [0]) * (rows * cols)
+
+    @classmethod
+    def from_block_types(cls, block_types: List[List[int]]) -> "Terrain":
+        terrain = cls(len(block_types), len(block_types[0]))
+        for row, row_types in enumerate(block_types):
+            for col, block_type in enumerate(row_types):
+                terrain.set_block_type(row, col, block_type)
+        return terrain
+
+    def index(self, row: int, col: int) -> int:
+        return row * self.cols + col
+
+    def in_bounds(self, row: int, col: int) -> bool:
+        return 0 <= row < self.rows and 0 <= col < self.cols
+
+    def get_block_type(self, row: int, col: int) -> int:
+        return self.blocks[row * self.cols + col]
+
+    def set_block_type(self, row: int, col: int, block_type: int):
+        self.blocks[row * self.cols + col] = block_type
+
+    def get_block(self, row: int, col: int) -> TerrainBlock:
+        return TERRAIN_BLOCKS[self.blocks[row * self.cols + col]]
+
+    def is_occupied(self, row: int, col: int) -> bool:
+        return self.occupancy[row * self.cols + col] != 0
+
+    def get_entity_id(self, row: int, col: int) -> int:
+        return self.occupancy[row * self.cols + col]
+
+    def place(self, entity_id: int, row: int, col: int):
+        self.occupancy[row * self.cols + col] = entity_id
+
+    def move(self, row: int, col: int, new_row: int, new_col: int):
+        index = row * self.cols + col
+        self.occupancy[new_row * self.cols + new_col] = self.occupancy[index]
+        self.occupancy[index] = 0
+
+    def remove(self, row: int, col: int) -> int:
+        # Empty the block and return the ID of the entity that stood on it
+        index = row * self.cols + col
+        entity_id = self.occupancy[index]
+        self.occupancy[index] = 0
+        return entity_id
+
+
 class Level:
     """
     Class for level attributes and methods
@@ -28,48 +104,65 @@ class Level:
     Level class is responsible for creating the terrain and holds the information about the waves of enemies
     """
 
-    def __init__(self):
-        # Define waves of enemies (Later defined on a separate file)
-        self.waves = {
-            0: {
-                "normal": 2,
-                "buff": 0
-            },
-            1: {
-                "normal": 10,
-                "buff": 0
-            }
-        }
-
-        # Current wave
+    def __init__(self, use_enemy_store: bool = False, rng: Optional[random.Random] = None,
+                 events: Optional[EventBus] = None, waves: Optional[List[Wave]] = None):
+        # All randomness of the level comes from this generator so a seeded game is reproducible
+        self.rng = rng if rng is not None else random.Random()
+        self.events = events if events is not None else EventBus()
+
+        # Waves of enemies, loaded from the default waves file unless given
+        # Waves are compiled into a timeline of spawns once, see Engine/waves.py
+        self.waves: List[Wave] = waves if waves is not None else load_waves()
+        self.wave_schedule = WaveSchedule(self.waves)
+
+        # Current wave is the latest wave that has spawned an enemy
         self.current_wave = 0
-        # Boolean to know whether to keep checking if more enemies need to be spawned
-        self.spawn_enemies = True
-        # Spawn timer set to 120 ticks
-        self.spawn_timer = 120
-        self.previous_spawn_frame = 0
+        # Last wave a WaveStarted event was published for, published when the first enemy of a wave spawns
+        self.started_wave = -1
 
         # Start end block positions
         self.start_blocks = []
         self.end_blocks = []
 
-        # Terrain blocks of objects. Consists of terrain block objects, enemy objects and tower objects
-        self.terrain: List[List] = []
-
-        # List of enemies and towers
-        self.enemies: List = []
-        self.towers: List[Tower] = []
+        # Block types and the enemies and towers standing on the blocks
+        self.terrain: Optional[Terrain] = None
+
+        self.path_blocks_by_progress: List[Tuple[int, int]] = []
+
+        # Called with the list of (row, col) cells whose block or tower changed, None when the whole terrain changed
+        self.terrain_listeners: List[Callable] = []
+
+        # Terrain version is bumped every time the terrain changes in a way that can change enemy paths
+        # Paths are cached per start, end and terrain version
+        from Engine.enemy import PathCache
+        self.terrain_version = 0
+        self.path_cache = PathCache()
+
+        # Every enemy and tower is registered in the entity registry
+        # Enemies and towers are the dense lists of the registry, they are not kept in spawn or placement order
+        # Registry also keeps the entities in creation order, which is the spawn order for enemies
+        self.entities = EntityRegistry()
+        # Enemy store keeps per frame enemy attributes in NumPy arrays when enabled
+        from Engine.enemy_store import EnemyStore
+        self.enemy_store: Optional[EnemyStore] = EnemyStore() if use_enemy_store else None
+        self.enemies: List = self.entities.components("enemy")
+        self.towers: List[Tower] = self.entities.components("tower")
         self.tower_slots: List[List[int]] = []
 
+        # Path cells covered by every tower slot and tower range, ordered by path progress
+        # Key is (row, column, range) and value is a list of (row, column) path cells
+        self.coverage_tables: dict = {}
+
         # Create terrain
         # self.create_terrain()
         self.create_terrain_2()
+        self.build_coverage_tables()
 
     def create_random_level(self):
         random_enemy_path = []
 
         # Start from random position on the left wall
-        current_pos = [random.randint(0, 9), 0]
+        current_pos = [self.rng.randint(0, 9), 0]
         random_enemy_path.append(current_pos.copy())
 
         # From starting_pos move randomly only to right or up or down, also cannot go to visited position
@@ -77,7 +170,7 @@ class Level:
             # Randomly choose direction and make certain it is valid
             new_pos = None
             while True:
-                random_direction = random.randint(0, 2)
+                random_direction = self.rng.randint(0, 2)
 
                 if random_direction == 0:
                     if current_pos[1] + 1 < 20:
@@ -105,12 +198,11 @@ class Level:
         random_enemy_path = self.create_random_level()
 
         # First fill terrain with static blocks
-        for i in range(10):
-            self.terrain.append([TerrainBlock(2) for _ in range(20)])
+        self.terrain = Terrain(10, 20, 2)
 
         # Place enemy path
         for path in random_enemy_path:
-            self.terrain[path[0]][path[1]] = TerrainBlock(0)
+            self.terrain.set_block_type(path[0], path[1], 0)
 
         # Set the start and end blocks
         self.start_blocks.append(random_enemy_path[0])
@@ -118,14 +210,14 @@ class Level:
 
         # Randomly put two tower placements on any of the static blocks
         for _ in range(2):
-            x = random.randint(0, 9)
-            y = random.randint(0, 19)
+            x = self.rng.randint(0, 9)
+            y = self.rng.randint(0, 19)
 
-            while self.terrain[x][y].block_type != 2:
-                x = random.randint(0, 9)
-                y = random.randint(0, 19)
+            while self.terrain.get_block_type(x, y) != 2:
+                x = self.rng.randint(0, 9)
+                y = self.rng.randint(0, 19)
 
-            self.terrain[x][y] = TerrainBlock(1)
+            self.terrain.set_block_type(x, y, 1)
 
             # Save the tower slot
             self.tower_slots.append([x, y])
@@ -137,25 +229,104 @@ class Level:
         # 10x20 grid with straight path from top to bottom for enemies, and some tower placements
         # Static blocks to make the path
         # Only one start and end block
-        for i in range(10):
-            self.terrain.append([TerrainBlock(2) for _ in range(20)])
+        self.terrain = Terrain(10, 20, 2)
 
         # Place path for enemies in the middle
         for i in range(20):
-            self.terrain[4][i] = TerrainBlock(0)
+            self.terrain.set_block_type(4, i, 0)
 
         # Save start and end block positions
         self.start_blocks.append([4, 0])
         self.end_blocks.append([4, 19])
 
         # Place some tower placements next to the path
-        self.terrain[3][10] = TerrainBlock(1)
-        self.terrain[5][10] = TerrainBlock(1)
+        self.terrain.set_block_type(3, 10, 1)
+        self.terrain.set_block_type(5, 10, 1)
+
+    def is_path_block(self, row: int, col: int) -> bool:
+        return self.terrain.get_block_type(row, col) == 0
+
+    def load_terrain(self, terrain: Terrain, start_blocks: List[List[int]], end_blocks: List[List[int]],
+                     tower_slots: List[List[int]]):
+        # Replace the generated terrain with a premade one, must be done before enemies or towers are added
+        self.terrain = terrain
+        self.start_blocks = start_blocks
+        self.end_blocks = end_blocks
+        self.tower_slots = tower_slots
+
+        self.terrain_version += 1
+        self.build_coverage_tables()
+        self.notify_terrain_changed(None)
+
+    def add_terrain_listener(self, listener: Callable):
+        self.terrain_listeners.append(listener)
+
+    def notify_terrain_changed(self, cells: Optional[List[Tuple[int, int]]]):
+        for listener in self.terrain_listeners:
+            listener(cells)
+
+    def compute_path_distances(self) -> dict:
+        # Distance of every path block to the closest end block, walking only on path blocks
+        distances = {}
+        queue = deque()
+
+        for end_block in self.end_blocks:
+            distances[(end_block[0], end_block[1])] = 0
+            queue.append((end_block[0], end_block[1]))
+
+        while queue:
+            row, col = queue.popleft()
+
+            for next_row, next_col in ((row, col + 1), (row + 1, col), (row, col - 1), (row - 1, col)):
+                if (next_row, next_col) in distances:
+                    continue
+                if not self.terrain.in_bounds(next_row, next_col):
+                    continue
+                if not self.is_path_block(next_row, next_col):
+                    continue
+
+                distances[(next_row, next_col)] = distances[(row, col)] + 1
+                queue.append((next_row, next_col))
+
+        return distances
+
+    def build_coverage_tables(self):
+        """
+        Precompute which path blocks every tower slot covers with every tower range
+        Enemies can only stand on path blocks and towers only on tower slots, so this never changes after terrain is created
+        """
+        self.coverage_tables = {}
+
+        # Path blocks ordered by progress, blocks closest to the end first so the most advanced enemy is found first
+        path_distances = self.compute_path_distances()
+        path_blocks = [(row, col)
+                       for row in range(self.terrain.rows)
+                       for col in range(self.terrain.cols)
+                       if self.is_path_block(row, col)]
+        path_blocks.sort(key=lambda block: (path_distances.get(block, math.inf), block))
+        self.path_blocks_by_progress = path_blocks
+
+        tower_ranges = {stats.range for levels in TOWER_STATS.values() for stats in levels}
+        for slot in self.tower_slots:
+            for tower_range in tower_ranges:
+                self.get_coverage(slot, tower_range)
+
+    def get_coverage(self, position: List[int], tower_range: float) -> List[Tuple[int, int]]:
+        # Path blocks in range of the position ordered by path progress, calculated once per position and range
+        key = (position[0], position[1], tower_range)
+
+        coverage = self.coverage_tables.get(key)
+        if coverage is None:
+            coverage = [(row, col) for row, col in self.path_blocks_by_progress
+                        if math.sqrt((position[0] - row) ** 2 + (position[1] - col) ** 2) <= tower_range]
+            self.coverage_tables[key] = coverage
+
+        return coverage
 
     def print_terrain(self):
-        for row in self.terrain:
-            for block in row:
-                print(block.block_type, end=" ")
+        for row in range(self.terrain.rows):
+            for col in range(self.terrain.cols):
+                print(self.terrain.get_block_type(row, col), end=" ")
             print()
 
     def get_terrain(self):
@@ -164,137 +335,145 @@ class Level:
     def get_current_wave(self):
         return self.current_wave
 
-    def get_current_wave_enemies(self):
-        return self.waves[self.current_wave]
-
-    def next_wave(self):
-        self.current_wave += 1
-        return self.waves[self.current_wave]
-
     def is_last_wave(self):
         return self.current_wave == len(self.waves) - 1
 
-    def spawn_enemy_wave(self, current_frame: int):
-        from Engine.enemy import Enemy
-        # Make certain that the spawn timer is met
-        if current_frame - self.previous_spawn_frame < self.spawn_timer:
-            return
+    @property
+    def spawn_enemies(self) -> bool:
+        # True while the waves still have enemies to spawn
+        return not self.wave_schedule.finished
 
-        # Check if enemies still to spawn in the current wave, if there are choose randomly enemy to spawn
-        wave_enemies = self.get_current_wave_enemies()
+    def is_cleared(self):
+        # Level is cleared once the last wave has nothing left to spawn and no enemies are alive
+        return self.wave_schedule.finished and len(self.enemies) == 0
 
-        enemy = None
-        for enemy_type, amount in wave_enemies.items():
-            if amount == 0:
-                continue
+    def create_enemy(self, enemy_type: str):
+        from Engine.enemy import Enemy
+        from Engine.enemy_store import StoredEnemy
+        if self.enemy_store is not None:
+            return StoredEnemy(enemy_type, self.enemy_store)
 
-            # Create enemy object
-            enemy = Enemy(enemy_type)
-            break
+        return Enemy(enemy_type)
 
-        # If no enemies to spawn anymore, return
-        if enemy is None:
-            self.spawn_enemies = False
-            return
+    def release_enemy(self, enemy):
+        # Give the store slot back when enemy is removed from the game
+        if self.enemy_store is not None:
+            enemy.release()
 
-        # Reduce the amount of enemies to spawn
-        wave_enemies[enemy.enemy_type] -= 1
+    @traced("level.spawn_enemy_wave")
+    def spawn_enemy_wave(self, current_frame: int):
+        # Nothing to do on frames without due spawns
+        wave_schedule = self.wave_schedule
+        if not wave_schedule.has_due(current_frame):
+            return
 
-        # Choose random start and make certain it is empty
-        random_start = None
-        possible_starts = self.start_blocks.copy()
+        # Start blocks that are empty path blocks, a block is taken out once an enemy spawns on it
+        free_starts = [start for start in self.start_blocks
+                       if self.is_path_block(start[0], start[1]) and not self.terrain.is_occupied(start[0], start[1])]
 
-        while random_start is None:
-            # If no possible spawns are available, return
-            if len(possible_starts) == 0:
-                return
+        for spawn in wave_schedule.due_spawns(current_frame):
+            if spawn.start is None:
+                # Choose random free start
+                start = self.rng.choice(free_starts) if free_starts else None
+            else:
+                if spawn.start >= len(self.start_blocks):
+                    raise ValueError(f"Wave {spawn.wave} spawns at start block {spawn.start}, "
+                                     f"level has {len(self.start_blocks)} start blocks")
+                start = self.start_blocks[spawn.start]
+                start = start if start in free_starts else None
+
+            # Blocked spawns are not lost, they are tried again on the next frame
+            if start is None:
+                wave_schedule.retry(spawn)
+                continue
 
-            # Choose random start
-            random_start = random.choice(possible_starts)
+            free_starts.remove(start)
+            self.add_enemy(self.create_enemy(spawn.enemy_type), start)
 
-            # Make certain the block is terrain block and 0 to have valid start
-            start_block = self.terrain[random_start[0]][random_start[1]]
-            if isinstance(start_block, TerrainBlock) and start_block.block_type == 0:
-                break
-            else:
-                # Remove the start from possible starts
-                possible_starts.remove(random_start)
-                random_start = None
+            if spawn.wave > self.started_wave:
+                self.started_wave = self.current_wave = spawn.wave
+                if self.events.active:
+                    self.events.publish(WaveStarted(spawn.wave))
 
+    def add_enemy(self, enemy, position: List[int]):
+        # Place a new enemy on an empty path block
         # Save enemy position
-        enemy.previous_waypoint = random_start
-        enemy.real_position = random_start
+        enemy.previous_waypoint = position
+        enemy.real_position = position
 
-        # Add enemy to the list of enemies
-        self.enemies.append(enemy)
+        # Register the enemy, which also adds it to the list of enemies and numbers it in spawn order
+        self.entities.create(enemy, "enemy")
 
         # Update the terrain
-        self.terrain[random_start[0]][random_start[1]] = enemy
-
-        self.previous_spawn_frame = current_frame
+        self.terrain.place(enemy.entity_id, position[0], position[1])
 
-        # Calculate the shortest path for enemy
+        # Calculate the shortest path for enemy, enemies with same start share the cached path
         # TODO: Currently can only handle one end block
-        enemy.calculate_shortest_path(self.terrain, self.end_blocks[0])
+        enemy.calculate_shortest_path(self.terrain, self.end_blocks[0], self.path_cache, self.terrain_version)
 
     def move_enemy(self, current_position: List[int], new_position: List[int]):
-        from Engine.enemy import Enemy
         # Make sure current position is enemy
-        if not isinstance(self.terrain[current_position[0]][current_position[1]], Enemy):
+        if not self.is_path_block(*current_position) or not self.terrain.is_occupied(*current_position):
             raise ValueError("Current position is not enemy")
 
         # Make sure new position is empty path for enemy
-        if self.terrain[new_position[0]][new_position[1]].block_type != 0:
+        if not self.is_path_block(*new_position) or self.terrain.is_occupied(*new_position):
             raise ValueError("New position is not empty path for enemy")
 
-        # Move the enemy to the new position (Maybe can create error handling for this with references)
-        self.terrain[new_position[0]][new_position[1]] = self.terrain[current_position[0]][current_position[1]]
-
-        # Remove the enemy from the old position
-        self.terrain[current_position[0]][current_position[1]] = TerrainBlock(0)
-
-    def kill_enemy(self, position: List[int]):
-        # Kill the enemy and then check if the wave is over
-        enemy = self.terrain[position[0]][position[1]]
-
-        # Remove enemy from the list
-        self.enemies.remove(enemy)
+        # Move the enemy to the new position, only the occupancy layer changes
+        enemy = self.get_occupant(*current_position)
+        self.terrain.move(current_position[0], current_position[1], new_position[0], new_position[1])
 
+    def kill_enemy(self, enemy):
+        # Kill the enemy, waves are spawned on their own timeline so killing enemies does not start waves
         # Remove enemy from the terrain
-        self.terrain[position[0]][position[1]] = TerrainBlock(0)
+        position = enemy.previous_waypoint
+        self.terrain.remove(position[0], position[1])
 
-        # Check if the wave is over
-        if len(self.enemies) == 0:
-            # If wave is over, check if it was the last wave
-            if self.is_last_wave():
-                print("Game over!")
-            else:
-                # If not last wave, spawn next wave
-                self.spawn_enemies = True
-                self.next_wave()
+        # Remove enemy from the registry and the list of enemies
+        self.entities.destroy(enemy.entity_id)
+        self.release_enemy(enemy)
 
     def place_tower(self, position: List[int], tower: Tower):
         # Check if the position is empty tower placement
-        if self.terrain[position[0]][position[1]].block_type != 1:
+        if self.terrain.get_block_type(position[0], position[1]) != 1 or self.terrain.is_occupied(*position):
             raise ValueError("Position is not empty tower placement")
 
-        # Place the tower to the position
-        self.terrain[position[0]][position[1]] = tower
+        # Register the tower, which also adds it to the list of towers, and place it to the position
+        self.entities.create(tower, "tower")
+        self.terrain.place(tower.entity_id, position[0], position[1])
+
+        self.terrain_version += 1
+        self.notify_terrain_changed([(position[0], position[1])])
 
-        # Add tower to the list of towers
-        self.towers.append(tower)
+        if self.events.active:
+            self.events.publish(TowerPlaced(tower.type, (position[0], position[1])))
 
     def remove_tower(self, position: List[int]):
         # Check if the position is tower
-        if not isinstance(self.terrain[position[0]][position[1]], Tower):
+        if self.terrain.get_block_type(position[0], position[1]) != 1 or not self.terrain.is_occupied(*position):
+            raise ValueError("Position is not tower")
+
+        # Remove the tower from the terrain, the registry and the list of towers
+        self.entities.destroy(self.terrain.remove(position[0], position[1]))
+
+        self.terrain_version += 1
+        self.notify_terrain_changed([(position[0], position[1])])
+
+    def upgrade_tower(self, position: List[int]):
+        # Check if the position is tower
+        if self.terrain.get_block_type(position[0], position[1]) != 1 or not self.terrain.is_occupied(*position):
             raise ValueError("Position is not tower")
 
-        # Remove the tower from the list of towers
-        tower = self.terrain[position[0]][position[1]]
-        self.towers.remove(tower)
+        self.get_occupant(position[0], position[1]).upgrade_tower()
+
+    def enemies_in_spawn_order(self) -> List:
+        # New list, so enemies can be removed while it is iterated
+        return self.entities.in_creation_order("enemy")
 
-        # Remove the tower from the terrain
-        self.terrain[position[0]][position[1]] = TerrainBlock(1)
+    def get_occupant(self, row: int, col: int):
+        # Enemy or tower standing on the block, None if the block is empty
+        return self.entities.get(self.terrain.get_entity_id(row, col))
 
     def update(self,
                event: int,
@@ -311,10 +490,11 @@ class Level:
         - Enemy is killed
         - Tower is placed
         - Tower is removed
+        - Tower is upgraded
 
         :param event: Event that happened
         :param tower: Tower object if tower was placed
-        :param enemy: Enemy object if enemy was spawned
+        :param enemy: Enemy object if enemy was killed
         :param current_position: Current position of the object
         :param new_position: New position of the object
         """
@@ -323,11 +503,13 @@ class Level:
             case 0:
                 self.move_enemy(current_position, new_position)
             case 1:
-                self.kill_enemy(current_position)
+                self.kill_enemy(enemy if enemy is not None else self.get_occupant(*current_position))
             case 2:
                 self.place_tower(current_position, tower)
             case 3:
                 self.remove_tower(current_position)
+            case 4:
+                self.upgrade_tower(current_position)
             case _:
                 raise ValueError("Invalid event")
 
@@ -0,0 +1,18 @@
+from dataclasses import dataclass
+from typing import Optional, List
+
+"""
+Packages passed between the engine modules
+
+Kept separate from the render module so that the game can run without importing pygame
+"""
+
+
+@dataclass
+class ReturnPackage:
+    game_over: bool = False
+    new_tower_position: Optional[List[int]] = None
+    new_tower_type: Optional[str] = None
+    remove_tower_position: Optional[List[int]] = None
+    upgrade_tower_position: Optional[List[int]] = None
+    game_speed: Optional[int] = None
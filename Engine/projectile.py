@@ -0,0 +1,375 @@
+import math
+from array import array
+from typing import List, Tuple
+
+from Engine.events import EnemyDamaged
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+Pooled projectiles
+
+Every projectile in flight is one slot of a preallocated pool of parallel arrays, so firing and stepping
+projectiles does not create any per projectile Python objects. Slots of projectiles that hit or expire are
+reused by later shots, the pool grows by doubling when every slot is in use.
+
+Projectiles are stepped all at once every tick. A projectile hits the first enemy, in spawn order, whose
+real position is within HIT_RADIUS of it. Real positions of the enemies are bucketed into cells of one block
+once per tick, so every projectile only looks at the enemies in the cells around it. The level keeps no other
+spatial index of the enemies, targeting reads the terrain occupancy through the coverage tables.
+
+With NumPy the pool is stored in NumPy arrays and stepped with array operations,
+without NumPy the same arrays are Python arrays stepped in a loop.
+"""
+
+# Game time of one tick in seconds, projectile and enemy speeds are in blocks per second
+SECONDS_PER_TICK = 1 / 60
+# Distance in blocks from the enemy real position that counts as a hit
+HIT_RADIUS = 0.5
+# Below this many projectiles in flight hits are found in a Python loop, which beats the NumPy setup cost
+VECTORIZED_HITS_MIN_PROJECTILES = 100
+# Extra flight time after the solved impact time before a projectile that missed disappears
+LIFETIME_MARGIN = 0.5
+
+
+class ProjectilePool:
+    def __init__(self, capacity: int = 64):
+        self.capacity = 0
+
+        # Per slot arrays, positions and velocities are stored as separate row and column arrays
+        self.row = self._float_array(0)
+        self.col = self._float_array(0)
+        self.previous_row = self._float_array(0)
+        self.previous_col = self._float_array(0)
+        self.velocity_row = self._float_array(0)
+        self.velocity_col = self._float_array(0)
+        self.time_left = self._float_array(0)
+        self.damage = self._int_array(0)
+        # Entity IDs of the tower that fired and the enemy it was aimed at
+        self.owner = self._int_array(0)
+        self.target = self._int_array(0)
+        self.active = self._bool_array(0)
+
+        self.free_slots: List[int] = []
+        self.active_count = 0
+
+        self.grow(capacity)
+
+    @staticmethod
+    def _float_array(size: int):
+        return np.zeros(size, dtype=np.float64) if np is not None else array("d", bytes(8 * size))
+
+    @staticmethod
+    def _int_array(size: int):
+        return np.zeros(size, dtype=np.int64) if np is not None else array("q", bytes(8 * size))
+
+    @staticmethod
+    def _bool_array(size: int):
+        return np.zeros(size, dtype=bool) if np is not None else bytearray(size)
+
+    def grow(self, new_capacity: int):
+        extra = new_capacity - self.capacity
+
+        for name in ("row", "col", "previous_row", "previous_col", "velocity_row", "velocity_col", "time_left"):
+            self._extend(name, self._float_array(extra))
+        for name in ("damage", "owner", "target"):
+            self._extend(name, self._int_array(extra))
+        self._extend("active", self._bool_array(extra))
+
+        # Free slots are popped from the end, so keep the lowest slots last
+        self.free_slots.extend(range(new_capacity - 1, self.capacity - 1, -1))
+        self.capacity = new_capacity
+
+    def _extend(self, name: str, extra):
+        if np is not None:
+            setattr(self, name, np.concatenate((getattr(self, name), extra)))
+        else:
+            getattr(self, name).extend(extra)
+
+    def __len__(self):
+        return self.active_count
+
+    def spawn(self, position: Tuple[float, float], velocity: Tuple[float, float], damage: int, owner: int,
+              target: int, lifetime: float) -> int:
+        if len(self.free_slots) == 0:
+            self.grow(max(self.capacity * 2, 1))
+
+        slot = self.free_slots.pop()
+
+        self.row[slot] = self.previous_row[slot] = position[0]
+        self.col[slot] = self.previous_col[slot] = position[1]
+        self.velocity_row[slot] = velocity[0]
+        self.velocity_col[slot] = velocity[1]
+        self.damage[slot] = damage
+        self.owner[slot] = owner
+        self.target[slot] = target
+        self.time_left[slot] = lifetime
+        self.active[slot] = True
+        self.active_count += 1
+
+        return slot
+
+    def release(self, slot: int):
+        self.active[slot] = False
+        self.free_slots.append(slot)
+        self.active_count -= 1
+
+    def clear(self):
+        # Release every slot at once
+        for index in range(self.capacity):
+            self.active[index] = False
+        self.free_slots = list(range(self.capacity - 1, -1, -1))
+        self.active_count = 0
+
+    def active_slots(self) -> List[int]:
+        # Slots in flight in slot order
+        if np is not None:
+            return np.flatnonzero(self.active).tolist()
+        return [slot for slot in range(self.capacity) if self.active[slot]]
+
+    def interpolated_positions(self, interpolation: float):
+        # Rows and columns of the projectiles in flight between the previous and the current tick
+        if np is not None:
+            slots = np.flatnonzero(self.active)
+            rows = self.previous_row[slots] + (self.row[slots] - self.previous_row[slots]) * interpolation
+            cols = self.previous_col[slots] + (self.col[slots] - self.previous_col[slots]) * interpolation
+            return rows, cols
+
+        rows, cols = [], []
+        for slot in self.active_slots():
+            rows.append(self.previous_row[slot] + (self.row[slot] - self.previous_row[slot]) * interpolation)
+            cols.append(self.previous_col[slot] + (self.col[slot] - self.previous_col[slot]) * interpolation)
+        return rows, cols
+
+    def save_previous_positions(self):
+        if np is not None:
+            self.previous_row[:] = self.row
+            self.previous_col[:] = self.col
+        else:
+            self.previous_row[:] = self.row[:]
+            self.previous_col[:] = self.col[:]
+
+    def step(self, seconds: float, rows: int, cols: int):
+        # Move every projectile and release the ones that ran out of time or left the terrain
+        if self.active_count == 0:
+            return
+
+        if np is None:
+            for slot in self.active_slots():
+                self.row[slot] += self.velocity_row[slot] * seconds
+                self.col[slot] += self.velocity_col[slot] * seconds
+                self.time_left[slot] -= seconds
+                if self.time_left[slot] <= 0 or not (-1 < self.row[slot] < rows and -1 < self.col[slot] < cols):
+                    self.release(slot)
+            return
+
+        active = self.active
+        self.row[active] += self.velocity_row[active] * seconds
+        self.col[active] += self.velocity_col[active] * seconds
+        self.time_left[active] -= seconds
+
+        expired = active & ((self.time_left <= 0) | (self.row <= -1) | (self.row >= rows) |
+                            (self.col <= -1) | (self.col >= cols))
+        for slot in np.flatnonzero(expired).tolist():
+            self.release(slot)
+
+    def find_hits(self, enemies: List, enemy_store=None) -> List[Tuple[int, object]]:
+        """
+        Find the enemy every projectile hits
+        :param enemies: Enemies that can be hit
+        :param enemy_store: Store of the enemies when the level uses one, positions are then read from its arrays
+        :return: (slot, enemy) pairs in slot order, projectiles that did not hit anything are left out
+        """
+        if self.active_count == 0 or len(enemies) == 0:
+            return []
+
+        vectorized = np is not None and self.active_count >= VECTORIZED_HITS_MIN_PROJECTILES
+
+        if enemy_store is not None:
+            store_slots = np.flatnonzero(enemy_store.alive & ~np.isnan(enemy_store.position[:, 0]))
+            enemies = [enemy_store.enemies[slot] for slot in store_slots.tolist()]
+            positions = enemy_store.position[store_slots]
+            if not vectorized:
+                return self._find_hits_python(enemies, positions.tolist())
+            spawn_order = enemy_store.creation_index[store_slots]
+        else:
+            positions = [enemy.real_position for enemy in enemies]
+            if not vectorized:
+                return self._find_hits_python(enemies, positions)
+            positions = np.array(positions, dtype=np.float64)
+            spawn_order = np.array([enemy.creation_index for enemy in enemies], dtype=np.int64)
+
+        if len(enemies) == 0:
+            return []
+
+        # Bucket the enemies by the block their real position is in, sorted by block and then by spawn order
+        # Block keys are row * stride + column, columns are shifted so the neighbours of every enemy block fit a row
+        enemy_rows = np.floor(positions[:, 0]).astype(np.int64)
+        enemy_cols = np.floor(positions[:, 1]).astype(np.int64)
+        min_col = int(enemy_cols.min()) - 1
+        stride = int(enemy_cols.max()) - min_col + 2
+        enemy_keys = enemy_rows * stride + (enemy_cols - min_col)
+
+        by_block = np.lexsort((spawn_order, enemy_keys))
+        enemy_keys = enemy_keys[by_block]
+        enemy_positions = positions[by_block]
+        spawn_order = spawn_order[by_block]
+
+        slots = np.flatnonzero(self.active)
+        rows, cols = self.row[slots], self.col[slots]
+        # HIT_RADIUS is half a block, so only the two rows and two columns of blocks closest to a projectile can hit
+        projectile_rows = np.floor(rows - HIT_RADIUS).astype(np.int64)
+        projectile_cols = np.floor(cols - HIT_RADIUS).astype(np.int64) - min_col
+
+        # Earliest spawned enemy hit by every projectile
+        first_order = np.full(len(slots), np.iinfo(np.int64).max, dtype=np.int64)
+        first_enemy = np.full(len(slots), -1, dtype=np.int64)
+        squared_radius = HIT_RADIUS * HIT_RADIUS
+
+        for row_offset in (0, 1):
+            for col_offset in (0, 1):
+                block_cols = projectile_cols + col_offset
+                keys = (projectile_rows + row_offset) * stride + block_cols
+                start = np.searchsorted(enemy_keys, keys, side="left")
+                end = np.searchsorted(enemy_keys, keys, side="right")
+                # Columns outside the shifted range would alias to another row
+                end = np.where((block_cols >= 0) & (block_cols < stride), end, start)
+
+                # Every bucket is walked one enemy at a time for all projectiles at once
+                for offset in range(int((end - start).max(initial=0))):
+                    index = start + offset
+                    in_bucket = index < end
+                    index = np.minimum(index, len(enemy_keys) - 1)
+
+                    row_dist = rows - enemy_positions[index, 0]
+                    col_dist = cols - enemy_positions[index, 1]
+                    hit = (in_bucket & (row_dist * row_dist + col_dist * col_dist <= squared_radius) &
+                           (spawn_order[index] < first_order))
+
+                    first_order = np.where(hit, spawn_order[index], first_order)
+                    first_enemy = np.where(hit, index, first_enemy)
+
+        hit_projectiles = np.flatnonzero(first_enemy >= 0)
+        hit_enemies = by_block[first_enemy[hit_projectiles]]
+
+        return [(slot, enemies[enemy_index])
+                for slot, enemy_index in zip(slots[hit_projectiles].tolist(), hit_enemies.tolist())]
+
+    def _find_hits_python(self, enemies: List, positions: List) -> List[Tuple[int, object]]:
+        # Same as find_hits for a few projectiles, enemies are bucketed into a dict of blocks
+        blocks: dict = {}
+        for enemy, (enemy_row, enemy_col) in zip(enemies, positions):
+            blocks.setdefault((math.floor(enemy_row), math.floor(enemy_col)), []).append((enemy_row, enemy_col, enemy))
+
+        hits = []
+        squared_radius = HIT_RADIUS * HIT_RADIUS
+        for slot in self.active_slots():
+            row, col = self.row[slot], self.col[slot]
+            block_row, block_col = math.floor(row - HIT_RADIUS), math.floor(col - HIT_RADIUS)
+
+            first_enemy = None
+            for row_offset in (0, 1):
+                for col_offset in (0, 1):
+                    for enemy_row, enemy_col, enemy in blocks.get((block_row + row_offset, block_col + col_offset), ()):
+                        if ((row - enemy_row) ** 2 + (col - enemy_col) ** 2 <= squared_radius and
+                                (first_enemy is None or enemy.creation_index < first_enemy.creation_index)):
+                            first_enemy = enemy
+
+            if first_enemy is not None:
+                hits.append((slot, first_enemy))
+
+        return hits
+
+    def state(self) -> tuple:
+        # Projectiles in flight, used for the game state digest
+        return tuple((self.row[slot], self.col[slot], self.velocity_row[slot], self.velocity_col[slot],
+                      self.damage[slot], self.target[slot], self.time_left[slot]) for slot in self.active_slots())
+
+
+def fire_projectiles(pool: ProjectilePool, shots: List, bullet_vectors, impact_times):
+    """
+    Launch one projectile for every (tower, enemy) shot
+    :param bullet_vectors: Solved velocity of every shot
+    :param impact_times: Solved time until impact of every shot
+    """
+    for (tower, enemy), bullet_vector, impact_time in zip(shots, bullet_vectors, impact_times):
+        pool.spawn((float(tower.position[0]), float(tower.position[1])),
+                   (float(bullet_vector[0]), float(bullet_vector[1])),
+                   tower.damage, tower.entity_id, enemy.entity_id, float(impact_time) + LIFETIME_MARGIN)
+
+
+def resolve_hits(pool: ProjectilePool, hits: List[Tuple[int, object]], events=None, enemy_store=None) -> List:
+    """
+    Apply the damage of every hit in slot order and release the projectiles that hit
+    Enemies that died earlier in the same tick can not be hit anymore, projectiles flying through them keep going
+    :param enemy_store: Store of the enemies when the level uses one, damage is then applied in one batch
+    :return: Enemies that died, in the order they died
+    """
+    if enemy_store is not None and len(hits) > 0:
+        return _resolve_hits_store(pool, hits, events, enemy_store)
+
+    dead_enemies = []
+    dead_set = set()
+
+    for slot, enemy in hits:
+        if enemy in dead_set:
+            continue
+
+        hp_before = enemy.current_hp
+        enemy_died = enemy.take_damage(int(pool.damage[slot]))
+        pool.release(slot)
+
+        if events is not None and events.active:
+            events.publish(EnemyDamaged(enemy.creation_index, hp_before - enemy.current_hp, enemy.current_hp))
+
+        if enemy_died:
+            dead_set.add(enemy)
+            dead_enemies.append(enemy)
+
+    return dead_enemies
+
+
+def _resolve_hits_store(pool: ProjectilePool, hits: List[Tuple[int, object]], events, enemy_store) -> List:
+    # Same as resolve_hits with the damage of every hit applied to the store arrays at once
+    hit_slots = np.array([slot for slot, _ in hits], dtype=np.int64)
+    store_slots = np.array([enemy.slot for _, enemy in hits], dtype=np.int64)
+    damage = pool.damage[hit_slots]
+    total_damage = np.maximum(damage - enemy_store.armor[store_slots], 0)
+
+    # Damage every hit takes from hits before it on the same enemy, hits are grouped by enemy in hit order
+    by_enemy = np.argsort(store_slots, kind="stable")
+    grouped_slots = store_slots[by_enemy]
+    grouped_damage = total_damage[by_enemy]
+    damage_so_far = np.cumsum(grouped_damage) - grouped_damage
+    first_in_group = np.ones(len(hits), dtype=bool)
+    first_in_group[1:] = grouped_slots[1:] != grouped_slots[:-1]
+    group_start = np.maximum.accumulate(np.where(first_in_group, np.arange(len(hits)), 0))
+
+    damage_before = np.empty(len(hits), dtype=np.int64)
+    damage_before[by_enemy] = damage_so_far - damage_so_far[group_start]
+    is_first = np.empty(len(hits), dtype=bool)
+    is_first[by_enemy] = first_in_group
+
+    # A hit lands unless an earlier hit of the tick already killed the enemy
+    hp_before = enemy_store.current_hp[store_slots] - damage_before
+    landed = is_first | (hp_before > 0)
+    killed = landed & (hp_before - total_damage <= 0)
+
+    enemy_store.apply_damage(store_slots[landed], damage[landed])
+
+    dead_enemies = []
+    for index in np.flatnonzero(landed).tolist():
+        slot, enemy = hits[index]
+        pool.release(slot)
+
+        if events is not None and events.active:
+            events.publish(EnemyDamaged(enemy.creation_index, int(total_damage[index]),
+                                        int(hp_before[index] - total_damage[index])))
+
+        if killed[index]:
+            dead_enemies.append(enemy)
+
+    return dead_enemies
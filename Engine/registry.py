@@ -0,0 +1,132 @@
+from typing import Optional, List
+
+"""
+Entity registry with generational IDs
+
+Every enemy and tower gets an integer entity ID when it is added to the level. The ID packs a slot index
+and the generation of the slot. When an entity is removed the slot generation is bumped, so old IDs of the
+slot are detected as stale instead of pointing to whatever entity reuses the slot. ID 0 is never handed out
+and means no entity, same as an empty block in the terrain occupancy layer.
+
+Entities of the same kind are kept in a dense list, removal moves the last entity into the hole (swap remove),
+so adding and removing are O(1). Dense lists are not kept in any order.
+The registry also numbers the entities of each kind in creation order and keeps them by ID in a dict,
+which keeps insertion order and removes in O(1), so entities can be iterated in creation order without sorting.
+"""
+
+# Lowest bits of an ID are the slot index, the rest is the generation of the slot
+INDEX_BITS = 24
+INDEX_MASK = (1 << INDEX_BITS) - 1
+
+
+class EntityRegistry:
+    def __init__(self):
+        # Per slot data
+        self.generations: List[int] = []
+        self.slot_entities: List[Optional[object]] = []
+        self.slot_kinds: List[Optional[str]] = []
+        # Position of the slot entity in the dense list of its kind
+        self.dense_index: List[int] = []
+        self.free_slots: List[int] = []
+
+        # Kind of entity to the dense list of entities and their IDs
+        self.dense: dict = {}
+        self.dense_ids: dict = {}
+        # Kind of entity to the entities by ID in creation order and the number of entities created
+        self.created: dict = {}
+        self.created_count: dict = {}
+
+    def components(self, kind: str) -> List:
+        """
+        Dense list of the entities of a kind
+        The same list object is updated in place, so it can be kept and iterated directly
+        """
+        if kind not in self.dense:
+            self.dense[kind] = []
+            self.dense_ids[kind] = []
+            self.created[kind] = {}
+            self.created_count[kind] = 0
+        return self.dense[kind]
+
+    def create(self, entity, kind: str) -> int:
+        """
+        Add entity to the registry
+        :return: ID of the entity, also saved to entity.entity_id
+        Number of the entity in creation order of its kind is saved to entity.creation_index
+        """
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            slot = len(self.generations)
+            if slot > INDEX_MASK:
+                raise OverflowError("Too many entities")
+            self.generations.append(1)
+            self.slot_entities.append(None)
+            self.slot_kinds.append(None)
+            self.dense_index.append(-1)
+
+        dense = self.components(kind)
+        entity_id = (self.generations[slot] << INDEX_BITS) | slot
+
+        self.slot_entities[slot] = entity
+        self.slot_kinds[slot] = kind
+        self.dense_index[slot] = len(dense)
+        dense.append(entity)
+        self.dense_ids[kind].append(entity_id)
+
+        entity.entity_id = entity_id
+        entity.creation_index = self.created_count[kind]
+        self.created_count[kind] += 1
+        self.created[kind][entity_id] = entity
+        return entity_id
+
+    def destroy(self, entity_id: int):
+        """
+        Remove entity from the registry, the ID and every earlier ID of the slot become stale
+        :return: Removed entity
+        """
+        if not self.is_alive(entity_id):
+            raise ValueError(f"Entity {entity_id} does not exist")
+
+        slot = entity_id & INDEX_MASK
+        kind = self.slot_kinds[slot]
+        dense, dense_ids = self.dense[kind], self.dense_ids[kind]
+
+        # Move the last entity of the kind into the hole
+        index = self.dense_index[slot]
+        last_entity, last_id = dense.pop(), dense_ids.pop()
+        if index < len(dense):
+            dense[index] = last_entity
+            dense_ids[index] = last_id
+            self.dense_index[last_id & INDEX_MASK] = index
+
+        del self.created[kind][entity_id]
+
+        entity = self.slot_entities[slot]
+        self.slot_entities[slot] = None
+        self.slot_kinds[slot] = None
+        self.dense_index[slot] = -1
+        self.generations[slot] += 1
+        self.free_slots.append(slot)
+
+        entity.entity_id = 0
+        return entity
+
+    def in_creation_order(self, kind: str) -> List:
+        # New list, so entities can be destroyed while it is iterated
+        self.components(kind)
+        return list(self.created[kind].values())
+
+    def is_alive(self, entity_id: int) -> bool:
+        slot = entity_id & INDEX_MASK
+        return (entity_id != 0 and slot < len(self.generations)
+                and self.generations[slot] == entity_id >> INDEX_BITS and self.slot_entities[slot] is not None)
+
+    def get(self, entity_id: int) -> Optional[object]:
+        # Entity of the ID, None if the ID is stale or empty
+        if not self.is_alive(entity_id):
+            return None
+        return self.slot_entities[entity_id & INDEX_MASK]
+
+    def __len__(self):
+        return len(self.generations) - len(self.free_slots)
@@ -1,14 +1,19 @@
-import json
-from dataclasses import dataclass
+import itertools
+import math
+from collections import OrderedDict, Counter
+from time import perf_counter
 from typing import Optional, Tuple, List
 import pygame
 
+from Engine.assets import assets, to_display_format
+from Engine.hud import HUD, Panel, Label, Button
+from Engine.package import ReturnPackage
+from Engine.trace import traced
+
 """
 Class to render the game to the screen
 """
 
-# TODO: Still something wrong with turret rotation, only works for some angles
-# TODO: Render the bullet of the tower
 # TODO: Features to add: upgrade tower, sell tower, buy tower
 # TODO: menu to start new game, pause game, exit game
 
@@ -18,12 +23,25 @@ CAPTION_TEXT = "Tower Defense"
 WINDOW_WIDTH, WINDOW_HEIGHT = 1280, 720
 SCREEN_X_POS, SCREEN_Y_POS = 20, 20
 SCREEN_WIDTH, SCREEN_HEIGHT = 1240, 680
-
-# Read sprite map from json file
-with open("Engine/sprite_map.json", "r") as file:
-    sprite_map = json.load(file)
-
-sprite_sheet = pygame.image.load("Assets/main.png")
+# Keys to select the game speed multiplier
+SPEED_KEYS = {pygame.K_1: 1, pygame.K_2: 2, pygame.K_3: 4, pygame.K_4: 16}
+# Amount of pre rotated images per tower sprite, 64 steps is 5.625 degrees per step
+ROTATION_STEPS = 64
+# Size of sprites that are not drawn at the block size
+DEFAULT_SPRITE_SIZE = (80, 80)
+# Key to show the range of every tower, ranges of the hovered and selected tower are always shown
+RANGE_TOGGLE_KEY = pygame.K_r
+# Tower type built by the buy button
+BUY_TOWER_TYPE = "standard"
+# Frames whose dirty regions add up to more than this fraction of the window are pushed with one full update
+FULL_UPDATE_AREA_FRACTION = 0.5
+# Frames with more dirty regions than this are pushed with one full update, every region costs a blit and an update
+FULL_UPDATE_MAX_RECTS = 256
+# Tower range styles, (fill colour, outline colour) as RGBA, None fill draws only the outline
+RANGE_STYLES = {
+    "outline": (None, (0, 0, 255, 255)),
+    "filled": ((0, 0, 255, 48), (0, 0, 255, 255)),
+}
 
 
 def calculate_block_size() -> int:
@@ -34,13 +52,197 @@ def calculate_block_size() -> int:
     return min(block_size_x, block_size_y)
 
 
+class SpriteCache:
+    """
+    Process wide cache for extracted and scaled sprite surfaces
+
+    Only a handful of distinct images exist, so every entity drawing the same image shares one surface.
+    Key is (category, type, action, animation frame, tower level, size) and the cache is a bounded LRU.
+    Surfaces handed out are shared and must not be drawn on.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.surfaces: OrderedDict = OrderedDict()
+
+        # Rotation tables are few and expensive to build so they are not part of the LRU
+        self.rotation_tables: dict = {}
+
+        # Counters to see how well the cache is doing
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+            sprite_category: str,
+            sprite_type: str,
+            action: Optional[str] = None,
+            animation: int = 0,
+            tower_level: Optional[str] = None,
+            size: Tuple[int, int] = DEFAULT_SPRITE_SIZE
+    ) -> tuple:
+        # Parts of the key that do not apply to the category are normalized so that equal images share one entry
+        if sprite_category != "enemies":
+            action, animation = None, 0
+        if sprite_category != "towers":
+            tower_level = None
+        else:
+            tower_level = str(tower_level)
+
+        return sprite_category, sprite_type, action, animation, tower_level, tuple(size)
+
+    def get(
+            self,
+            sprite_category: str,
+            sprite_type: str,
+            action: Optional[str] = None,
+            animation: int = 0,
+            tower_level: Optional[str] = None,
+            size: Tuple[int, int] = DEFAULT_SPRITE_SIZE
+    ) -> pygame.Surface:
+        key = self.make_key(sprite_category, sprite_type, action, animation, tower_level, size)
+
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = self.load(*key)
+        self.surfaces[key] = surface
+
+        # Drop the least recently used surface if the cache is full
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+
+        return surface
+
+    @staticmethod
+    def load(sprite_category, sprite_type, action, animation, tower_level, size) -> pygame.Surface:
+        # Sprites prepared at startup come from the atlas, others are extracted from the sheet and scaled
+        return assets.sprite(sprite_category, sprite_type, action, animation, tower_level, size)
+
+    def get_rotation_table(
+            self,
+            sprite_type: str,
+            tower_level: str,
+            size: Tuple[int, int],
+            steps: int = ROTATION_STEPS
+    ) -> "RotationTable":
+        key = self.make_key("towers", sprite_type, tower_level=tower_level, size=size) + (steps,)
+
+        rotation_table = self.rotation_tables.get(key)
+        if rotation_table is None:
+            rotation_table = RotationTable(self.get("towers", sprite_type, tower_level=tower_level, size=size), steps)
+            self.rotation_tables[key] = rotation_table
+
+        return rotation_table
+
+    def clear(self):
+        self.surfaces.clear()
+        self.rotation_tables.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.surfaces),
+            "rotation_tables": len(self.rotation_tables),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class RotationTable:
+    """
+    Sprite pre rotated to a fixed amount of quantized angles
+
+    Every entry holds the rotated surface and the offset from the original top left corner
+    that keeps the rotated image centered on the original rect
+    """
+
+    def __init__(self, surface: pygame.Surface, steps: int = ROTATION_STEPS):
+        self.steps = steps
+        self.step_angle = 360 / steps
+
+        self.surfaces: List[pygame.Surface] = []
+        self.offsets: List[Tuple[int, int]] = []
+
+        original_center = surface.get_rect().center
+        for step in range(steps):
+            rotated_surface = pygame.transform.rotate(surface, step * self.step_angle)
+            rotated_rect = rotated_surface.get_rect(center=original_center)
+
+            self.surfaces.append(rotated_surface)
+            self.offsets.append(rotated_rect.topleft)
+
+    def angle_to_step(self, angle: float) -> int:
+        return round(angle / self.step_angle) % self.steps
+
+    def get(self, angle: float) -> Tuple[pygame.Surface, Tuple[int, int]]:
+        step = self.angle_to_step(angle)
+        return self.surfaces[step], self.offsets[step]
+
+
+class RangeOverlayCache:
+    """
+    Tower range circles pre rendered into transparent surfaces
+
+    Key is (range in blocks, block size, style), towers with the same range share one surface, so drawing a range
+    is a blit instead of rasterizing a circle every frame. Every entry holds the surface and the offset of its
+    top left corner from the tower center. Surfaces handed out are shared and must not be drawn on.
+    """
+
+    def __init__(self):
+        self.overlays: dict = {}
+
+    def get(self, tower_range: float, block_size: int, style: str) -> Tuple[pygame.Surface, Tuple[int, int]]:
+        key = (tower_range, block_size, style)
+
+        overlay = self.overlays.get(key)
+        if overlay is None:
+            overlay = self.create_overlay(tower_range, block_size, style)
+            self.overlays[key] = overlay
+
+        return overlay
+
+    @staticmethod
+    def create_overlay(tower_range: float, block_size: int, style: str) -> Tuple[pygame.Surface, Tuple[int, int]]:
+        if style not in RANGE_STYLES:
+            raise ValueError(f"Invalid range style: {style}")
+        fill_colour, outline_colour = RANGE_STYLES[style]
+
+        radius = tower_range * block_size
+        half_size = int(radius) + 1
+        surface = pygame.Surface((half_size * 2 + 1, half_size * 2 + 1), pygame.SRCALPHA)
+
+        if fill_colour is not None:
+            pygame.draw.circle(surface, fill_colour, (half_size, half_size), radius)
+        pygame.draw.circle(surface, outline_colour, (half_size, half_size), radius, width=1)
+
+        # Most of the overlay is transparent, run length encoding lets blits skip the transparent pixels
+        surface = to_display_format(surface)
+        surface.set_alpha(255, pygame.RLEACCEL)
+
+        return surface, (-half_size, -half_size)
+
+    def clear(self):
+        self.overlays.clear()
+
+
+sprite_cache = SpriteCache()
+range_overlay_cache = RangeOverlayCache()
+
+
 class Sprite:
     def __init__(
             self, sprite_category: str,
             sprite_type: str,
             enemy_action: Optional[str] = None,
             tower_level: Optional[str] = "0",
-            size: Tuple[int, int] = (80, 80)
+            size: Tuple[int, int] = DEFAULT_SPRITE_SIZE
     ):
         self.sprite_category = sprite_category
         self.sprite_type = sprite_type
@@ -54,20 +256,10 @@ class Sprite:
         self.rotated_sprite_object: Optional[pygame.Surface] = None
         self.init_sprite()
 
-    def extract_sprite(self, sprite_sheet: pygame.Surface, x: int, y: int) -> pygame.Surface:
-        sprite = pygame.Surface((16, 16), pygame.SRCALPHA)
-        sprite.blit(sprite_sheet, (0, 0), (x * 16, y * 16, 16, 16))
-        return sprite
-
     def init_sprite(self):
-        sprite_position = sprite_map[self.sprite_category][self.sprite_type]
-        if self.sprite_category == "enemies":
-            sprite_position = sprite_position[self.action][self.current_animation]
-        elif self.sprite_category == "towers":
-            sprite_position = sprite_map[self.sprite_category][self.sprite_type][self.tower_level]
-
-        sprite = self.extract_sprite(sprite_sheet, sprite_position[0], sprite_position[1])
-        sprite = pygame.transform.scale(sprite, self.size)
+        # Surfaces come from the shared cache, so creating many Sprite objects of the same image is cheap
+        sprite = sprite_cache.get(self.sprite_category, self.sprite_type, self.action, self.current_animation,
+                                  self.tower_level, self.size)
 
         self.sprite_object = sprite
         self.rotated_sprite_object = sprite
@@ -80,10 +272,10 @@ class Sprite:
             raise ValueError("Cannot upgrade a sprite that is not a tower")
 
         # Check if tower already max level and raise error
-        if int(self.tower_level) + 1 >= len(sprite_map[self.sprite_category][self.sprite_type]):
+        if int(self.tower_level) + 1 >= len(assets.get_sprite_map()[self.sprite_category][self.sprite_type]):
             raise ValueError("Tower is already at max level")
 
-        self.tower_level += 1
+        self.tower_level = str(int(self.tower_level) + 1)
         self.init_sprite()
 
     def select_next_animation(self):
@@ -91,7 +283,8 @@ class Sprite:
             raise ValueError("Action is not set for the sprite")
 
         # Make certain there is next animation in current action if not reset to 0
-        if self.current_animation + 1 >= len(sprite_map[self.sprite_category][self.sprite_type][self.action]):
+        animations = assets.get_sprite_map()[self.sprite_category][self.sprite_type][self.action]
+        if self.current_animation + 1 >= len(animations):
             self.current_animation = 0
         else:
             self.current_animation += 1
@@ -108,65 +301,289 @@ class Sprite:
 
 
 class Background:
-    """ Class to make the background of the game sprites"""
-
-    def __init__(self, object_terrain: List[List[object]]):
+    """
+    Cached background layers of the terrain, from bottom to top:
+    ground: tile of the block type of every cell
+    tower_bases: shadow under every placed tower
+    overlays: markers of the start and end blocks
+
+    Layers and the composed background are built once. Afterwards the level reports the cells that changed
+    and only those cells are redrawn and composed again, so the cost depends on the changed cells and not
+    on the size of the map. Only cells inside the background surface are ever drawn.
+    """
+
+    # Ground tile of every block type
+    GROUND_SPRITES = {
+        0: ("ground", "dirt"),
+        1: ("ground", "tower"),
+        2: ("ground", "grass"),
+    }
+
+    def __init__(self, level):
         self.bg_width = SCREEN_WIDTH
         self.bg_height = SCREEN_HEIGHT
 
-        self.bg: pygame.Surface = pygame.Surface((self.bg_width, self.bg_height))
-        self.object_terrain = object_terrain
+        self.level = level
+        self.terrain = level.terrain
         self.block_size = calculate_block_size()
 
-    def construct_sprite_matrix(self) -> List[List[Sprite]]:
-        from Engine.level import TerrainBlock
+        # Composed background and its layers, ground is opaque and the layers on top of it are transparent
+        self.bg: pygame.Surface = pygame.Surface((self.bg_width, self.bg_height))
+        self.ground = pygame.Surface((self.bg_width, self.bg_height))
+        self.tower_bases = pygame.Surface((self.bg_width, self.bg_height), pygame.SRCALPHA)
+        self.overlays = pygame.Surface((self.bg_width, self.bg_height), pygame.SRCALPHA)
+
+        # Cells waiting to be redrawn, full_rebuild is set when the level reports the whole terrain changed
+        self.changed_cells: set = set()
+        self.full_rebuild = False
+
+    def visible_cells(self):
+        rows = min(self.terrain.rows, math.ceil(self.bg_height / self.block_size))
+        cols = min(self.terrain.cols, math.ceil(self.bg_width / self.block_size))
+        return ((row, col) for row in range(rows) for col in range(cols))
+
+    def cell_rect(self, row: int, col: int) -> pygame.Rect:
+        return pygame.Rect(col * self.block_size, row * self.block_size, self.block_size, self.block_size)
+
+    def draw_cell(self, row: int, col: int) -> pygame.Rect:
+        # Redraw the cell on every layer
+        cell_rect = self.cell_rect(row, col)
+        block_type = self.terrain.get_block_type(row, col)
+
+        # Ground sprites can be larger than a block, only the part inside the cell is drawn
+        # Cell is cleared to black first, same as the empty background, so transparent pixels stay black
+        sprite_category, sprite_type = self.GROUND_SPRITES[block_type]
+        tile = sprite_cache.get(sprite_category, sprite_type)
+        self.ground.fill((0, 0, 0), cell_rect)
+        self.ground.blit(tile, cell_rect.topleft, (0, 0, self.block_size, self.block_size))
+
+        self.tower_bases.fill((0, 0, 0, 0), cell_rect)
+        if block_type == 1 and self.terrain.is_occupied(row, col):
+            inset = self.block_size // 8
+            pygame.draw.rect(self.tower_bases, (0, 0, 0, 90), cell_rect.inflate(-inset, -inset),
+                             border_radius=self.block_size // 8)
+
+        self.overlays.fill((0, 0, 0, 0), cell_rect)
+        if [row, col] in self.level.start_blocks:
+            pygame.draw.rect(self.overlays, "Green", cell_rect, 2)
+        elif [row, col] in self.level.end_blocks:
+            pygame.draw.rect(self.overlays, "Red", cell_rect, 2)
+
+        return cell_rect
+
+    def compose(self, rect: pygame.Rect):
+        self.bg.blit(self.ground, rect, rect)
+        self.bg.blit(self.tower_bases, rect, rect)
+        self.bg.blit(self.overlays, rect, rect)
 
-        object_sprite_map = {
-            0: ["ground", "dirt"],
-            1: ["ground", "tower"],
-            2: ["ground", "grass"],
-        }
+    def create_background(self):
+        self.terrain = self.level.terrain
+        for row, col in self.visible_cells():
+            self.draw_cell(row, col)
+        self.compose(self.bg.get_rect())
+
+        self.changed_cells.clear()
+        self.full_rebuild = False
+
+    def invalidate_cells(self, cells: Optional[List[Tuple[int, int]]]):
+        # Terrain listener of the level, None means the whole terrain was replaced
+        if cells is None:
+            self.full_rebuild = True
+        else:
+            self.changed_cells.update(cells)
 
-        sprite_matrix = []
-        for row in self.object_terrain:
-            sprite_row = []
-            for sprite_object in row:
-                if isinstance(sprite_object, TerrainBlock):
-                    sprite_category, sprite_type = object_sprite_map[sprite_object.block_type]
-                    sprite = Sprite(sprite_category, sprite_type)
-                    sprite_row.append(sprite)
-                else:
-                    # Just render grass for now
-                    sprite = Sprite("ground", "grass")
-                    sprite_row.append(sprite)
+    def apply_changes(self) -> List[pygame.Rect]:
+        """
+        Redraw the changed cells
+        :return: Rects of the background that changed
+        """
+        if self.full_rebuild:
+            self.create_background()
+            return [self.bg.get_rect()]
 
-            sprite_matrix.append(sprite_row)
+        if not self.changed_cells:
+            return []
 
-        return sprite_matrix
+        background_rect = self.bg.get_rect()
+        changed_rects = []
+        for row, col in self.changed_cells:
+            cell_rect = self.cell_rect(row, col)
+            if not background_rect.colliderect(cell_rect):
+                continue
 
-    def construct_background(self, sprite_matrix: List[List[Sprite]]):
-        for y, row in enumerate(sprite_matrix):
-            for x, sprite in enumerate(row):
-                self.bg.blit(sprite.get_sprite(), (x * self.block_size, y * self.block_size))
+            self.draw_cell(row, col)
+            self.compose(cell_rect)
+            changed_rects.append(cell_rect)
 
-    def create_background(self):
-        sprite_matrix = self.construct_sprite_matrix()
-        self.construct_background(sprite_matrix)
+        self.changed_cells.clear()
+        return changed_rects
 
     def get_background(self):
         return self.bg
 
 
-@dataclass
-class ReturnPackage:
-    game_over: bool = False
-    new_tower_position: Optional[List[int]] = None
-    new_tower_type: Optional[str] = None
-    remove_tower_position: Optional[List[int]] = None
+class DirtyRectRenderer:
+    """
+    Draws the frame from a list of draw commands and only pushes the changed regions to the display
 
+    Draw commands are tuples:
+    ("blit", surface, (x, y))
+    ("rect", color, (x, y, width, height), line_width)
+    ("circle", color, (x, y), radius, line_width)
+
+    Commands are compared with the previous frame. Regions of commands that disappeared or appeared are
+    restored from the cached window background, then every command touching those regions is redrawn in order.
+    The whole region of every redrawn command is restored first, so translucent pixels are never blended twice.
+    Commands identical to the previous frame and not touching a dirty region are not drawn at all.
+
+    Every dirty region is checked against the commands not yet redrawn only once, so a frame costs one
+    collision check per region. When the dirty regions add up to most of the window or there are too many of them
+    the whole frame is drawn and pushed with one update instead.
+    """
 
-class Render:
     def __init__(self):
+        self.previous_commands: Counter = Counter()
+        self.full_redraw = True
+        # Regions where the background changed, pushed with the next frame
+        self.invalid_rects: List[pygame.Rect] = []
+
+    def invalidate(self, rect: pygame.Rect):
+        self.invalid_rects.append(rect)
+
+    @staticmethod
+    def command_rect(command: tuple) -> pygame.Rect:
+        kind = command[0]
+        if kind == "blit":
+            return pygame.Rect(command[2], command[1].get_size())
+        elif kind == "rect":
+            return pygame.Rect(command[2])
+        elif kind == "circle":
+            center, radius = command[2], int(command[3]) + 1
+            return pygame.Rect(center[0] - radius, center[1] - radius, radius * 2 + 1, radius * 2 + 1)
+
+        raise ValueError(f"Invalid draw command: {kind}")
+
+    @classmethod
+    def draw_all(cls, window: pygame.Surface, commands):
+        # Runs of blit commands are drawn with one Surface.blits call
+        blits = []
+        for command in commands:
+            if command[0] == "blit":
+                blits.append((command[1], command[2]))
+                continue
+
+            if blits:
+                window.blits(blits, doreturn=False)
+                blits = []
+            cls.draw(window, command)
+
+        if blits:
+            window.blits(blits, doreturn=False)
+
+    @staticmethod
+    def draw(window: pygame.Surface, command: tuple):
+        kind = command[0]
+        if kind == "blit":
+            window.blit(command[1], command[2])
+        elif kind == "rect":
+            pygame.draw.rect(window, command[1], command[2], command[3])
+        elif kind == "circle":
+            pygame.draw.circle(window, command[1], command[2], command[3], width=command[4])
+
+    @traced("render.present")
+    def present(self, window: pygame.Surface, background: pygame.Surface, commands: List[tuple]) -> List[pygame.Rect]:
+        """
+        Draw the commands and update the display
+        :param window: Display surface
+        :param background: Window sized surface with everything that does not change between frames
+        :param commands: Draw commands in drawing order
+        :return: Rects pushed to the display
+        """
+        current_commands = Counter(commands)
+
+        if self.full_redraw:
+            return self.present_full(window, background, commands, current_commands)
+
+        removed_commands = self.previous_commands - current_commands
+        new_commands = current_commands - self.previous_commands
+
+        if not removed_commands and not new_commands and not self.invalid_rects:
+            self.previous_commands = current_commands
+            return []
+
+        # Rects are made while their area is added up, so a frame that needs a full update stops early
+        dirty_rects = itertools.chain((self.command_rect(command) for command in removed_commands),
+                                      (self.command_rect(command) for command in new_commands),
+                                      self.invalid_rects)
+        full_update_area = window.get_width() * window.get_height() * FULL_UPDATE_AREA_FRACTION
+        dirty_area = 0
+        restore_rects = []
+
+        for dirty_rect in dirty_rects:
+            restore_rects.append(dirty_rect)
+            dirty_area += dirty_rect.width * dirty_rect.height
+            if dirty_area > full_update_area or len(restore_rects) > FULL_UPDATE_MAX_RECTS:
+                return self.present_full(window, background, commands, current_commands)
+
+        # Unchanged commands touching a dirty region are redrawn whole, so their whole region is dirty too
+        # Otherwise translucent pixels outside the restored region would be blended on top of themselves again
+        # Only the regions added by the previous pass are checked, against the commands not redrawn yet
+        redraw = [command in new_commands for command in commands]
+        pending = [index for index, redrawn in enumerate(redraw) if not redrawn]
+        pending_rects = [self.command_rect(commands[index]) for index in pending]
+
+        added_rects = restore_rects
+        while added_rects and pending:
+            # Loop over the shorter list, the collision checks against the longer one run in C
+            if len(added_rects) <= len(pending_rects):
+                touching = set()
+                for added_rect in added_rects:
+                    touching.update(added_rect.collidelistall(pending_rects))
+            else:
+                touching = {position for position, pending_rect in enumerate(pending_rects)
+                            if pending_rect.collidelist(added_rects) != -1}
+            if not touching:
+                break
+
+            added_rects = [pending_rects[position] for position in touching]
+            for position in touching:
+                redraw[pending[position]] = True
+            for added_rect in added_rects:
+                dirty_area += added_rect.width * added_rect.height
+            restore_rects = restore_rects + added_rects
+            if dirty_area > full_update_area or len(restore_rects) > FULL_UPDATE_MAX_RECTS:
+                return self.present_full(window, background, commands, current_commands)
+
+            pending = [index for position, index in enumerate(pending) if position not in touching]
+            pending_rects = [rect for position, rect in enumerate(pending_rects) if position not in touching]
+
+        self.previous_commands = current_commands
+        self.invalid_rects = []
+
+        # Restore the background under every dirty region
+        for restore_rect in restore_rects:
+            window.blit(background, restore_rect, restore_rect)
+
+        # Redraw new commands and the unchanged ones whose pixels were restored
+        self.draw_all(window, (command for command, redrawn in zip(commands, redraw) if redrawn))
+
+        pygame.display.update(restore_rects)
+        return restore_rects
+
+    def present_full(self, window: pygame.Surface, background: pygame.Surface, commands: List[tuple],
+                     current_commands: Counter) -> List[pygame.Rect]:
+        # Draw the whole frame and push it with one display update
+        window.blit(background, (0, 0))
+        self.draw_all(window, commands)
+
+        pygame.display.update()
+        self.previous_commands = current_commands
+        self.full_redraw = False
+        self.invalid_rects = []
+        return [window.get_rect()]
+
+class Render:
+    def __init__(self, rotation_steps: int = ROTATION_STEPS):
         # Create game window, and screen where game will be displayed
         self.window_width, self.window_height = WINDOW_WIDTH, WINDOW_HEIGHT
         self.screen_width, self.screen_height = SCREEN_WIDTH, SCREEN_HEIGHT
@@ -180,40 +597,62 @@ class Render:
         self.updated_terrain = False
 
         self.block_size: int = calculate_block_size()
-
-        self.lives: int = 0
-        self.lives_font: object = None
-        self.lives_text: object = None
-        self.money: int = 0
-        self.money_font: object = None
-        self.money_text: object = None
+        self.rotation_steps = rotation_steps
 
         self.mouse_block_pos = None
         self.mouse_abs_pos = None
 
+        # Range of every tower is shown when toggled on, (row, col) of the tower slot selected by clicking it
+        self.show_ranges = False
+        self.selected_slot_pos: Optional[Tuple[int, int]] = None
+
+        # Milliseconds spent in every startup stage
+        self.startup_times: dict = {}
+
         # Get the game window to show up
+        start = perf_counter()
         self.create_game_window()
+        self.startup_times["window"] = (perf_counter() - start) * 1000
 
-        # Make background object
+        # Sprites are loaded once the window exists so they are converted to the display format
+        self.load_assets()
+
+        # Make background object, window background is the whole window without any of the moving parts
         self.background: Optional[Background] = None
+        self.window_background: Optional[pygame.Surface] = None
+
+        # Draw commands of the current frame, only changed regions are pushed to display
+        self.draw_commands: List[tuple] = []
+        self.dirty_rect_renderer = DirtyRectRenderer()
+        self.dirty_rects: List[pygame.Rect] = []
 
         self.temp_tower = Sprite("towers", "normal", tower_level="0")
 
-    def turn_tower(self, tower, sprite: Sprite) -> Tuple[Sprite, pygame.Rect]:
+        # Every projectile is drawn with the same small surface
+        self.projectile_surface: Optional[pygame.Surface] = None
+
+        # Lives, gold and the tower buttons, widgets only render again when the values they show change
+        self.hud = self.create_hud()
+
+    def turn_tower(self, tower, rotation_table: RotationTable) -> Tuple[pygame.Surface, Tuple[int, int]]:
         """
-        Turns the tower then returns the sprite and the new x,y position needed for correct alignment
+        Turns the tower then returns the sprite and the offset needed for correct alignment
         :param tower:
-        :param sprite:
+        :param rotation_table:
         :return:
         """
         from Engine.tower import Tower
         tower: Tower = tower
 
-        # Now rotate to the new angle
-        new_angle = tower.angle
-        rotated_rect = sprite.rotate_sprite(new_angle)
+        # Rotation is only a lookup from the pre rotated table
+        return rotation_table.get(tower.angle)
 
-        return sprite, rotated_rect
+    @traced("render.load_assets")
+    def load_assets(self):
+        # Every sprite in the sizes the renderer draws them in, from the atlas cache when it is up to date
+        start = perf_counter()
+        assets.load([(self.block_size, self.block_size), DEFAULT_SPRITE_SIZE])
+        self.startup_times["assets"] = (perf_counter() - start) * 1000
 
     def create_game_window(self):
         # Imports all pygame modules
@@ -226,89 +665,211 @@ class Render:
         self.game_window = pygame.display.set_mode((self.window_width, self.window_height))
         self.screen_rect = pygame.Rect(SCREEN_X_POS, SCREEN_Y_POS, self.screen_width, self.screen_height)
 
+    def queue_blit(self, surface: pygame.Surface, position: Tuple[float, float]):
+        self.draw_commands.append(("blit", surface, (int(position[0]), int(position[1]))))
+
+    def queue_rect(self, color: str, rect: pygame.Rect, width: int = 0):
+        self.draw_commands.append(("rect", color, (rect.x, rect.y, rect.width, rect.height), width))
+
+    def queue_circle(self, color: str, center: Tuple[float, float], radius: float, width: int = 0):
+        self.draw_commands.append(("circle", color, (int(center[0]), int(center[1])), radius, width))
+
+    def create_window_background(self):
+        self.window_background = pygame.Surface((self.window_width, self.window_height))
+        self.window_background.fill("Red")
+        self.window_background.blit(self.background.get_background(), (SCREEN_X_POS, SCREEN_Y_POS))
+
+        self.dirty_rect_renderer.full_redraw = True
+
+    @traced("render.background")
+    def update_background(self):
+        # Copy the changed background cells to the window background and push them with the next frame
+        background = self.background.get_background()
+        for changed_rect in self.background.apply_changes():
+            window_rect = changed_rect.move(SCREEN_X_POS, SCREEN_Y_POS)
+            self.window_background.blit(background, window_rect, changed_rect)
+            self.dirty_rect_renderer.invalidate(window_rect)
+
     def rotate_terrain(self, vertical_terrain):
         row_len = len(vertical_terrain[0])
         rotated_terrain = [[row[j] for row in vertical_terrain] for j in range(row_len - 1, -1, -1)]
         return rotated_terrain
 
-    def draw_health_bar(self, enemy):
+    def draw_health_bar(self, enemy, enemy_position: Tuple[float, float]):
 
         health_bar_width = int((enemy.current_hp / enemy.max_hp) * self.block_size)
         health_bar_height = self.block_size // 6
 
-        health_bar_x_pos = SCREEN_X_POS + (enemy.real_position[1] * self.block_size)
-        health_bar_y_pos = SCREEN_Y_POS + (enemy.real_position[0] * self.block_size)
+        health_bar_x_pos = SCREEN_X_POS + (enemy_position[1] * self.block_size)
+        health_bar_y_pos = SCREEN_Y_POS + (enemy_position[0] * self.block_size)
         health_rect = pygame.Rect(health_bar_x_pos, health_bar_y_pos, health_bar_width, health_bar_height)
 
         return health_rect
 
-    def render_enemies(self, enemies: List[object], current_frame: int):
+    @traced("render.enemies")
+    def render_enemies(self, enemies: List[object], current_frame: int, interpolation: float = 1.0):
         from Engine.enemy import Enemy
         enemies: List[Enemy] = enemies
 
         sprite_category = "enemies"
+        sprite_size = (self.block_size, self.block_size)
 
         for enemy in enemies:
             sprite_type = "normal"
             enemy_action = "run"
 
-            enemy_sprite = Sprite(sprite_category=sprite_category, sprite_type=sprite_type, enemy_action=enemy_action,
-                                  size=(self.block_size, self.block_size))
+            enemy_surface = sprite_cache.get(sprite_category, sprite_type, enemy_action, 0, size=sprite_size)
+
+            # Draw the enemy between its previous and current tick position for smooth movement
+            enemy_position = enemy.interpolated_position(interpolation)
+
+            enemy_x_pos = self.block_size * enemy_position[1] + SCREEN_X_POS
+            enemy_y_pos = self.block_size * enemy_position[0] + SCREEN_Y_POS
+
+            self.queue_blit(enemy_surface, (enemy_x_pos, enemy_y_pos))
 
-            enemy_x_pos = self.block_size * enemy.real_position[1] + SCREEN_X_POS
-            enemy_y_pos = self.block_size * enemy.real_position[0] + SCREEN_Y_POS
+            health_bar = self.draw_health_bar(enemy, enemy_position)
 
-            self.game_window.blit(enemy_sprite.get_sprite(), (enemy_x_pos, enemy_y_pos))
+            self.queue_rect("Red", health_bar)
 
-            health_bar = self.draw_health_bar(enemy)
+    @traced("render.projectiles")
+    def render_projectiles(self, projectiles, interpolation: float = 1.0):
+        from Engine.projectile import ProjectilePool
+        projectiles: ProjectilePool = projectiles
 
-            pygame.draw.rect(self.game_window, "Red", health_bar)
+        if len(projectiles) == 0:
+            return
 
+        if self.projectile_surface is None:
+            radius = max(self.block_size // 10, 2)
+            self.projectile_surface = pygame.Surface((radius * 2, radius * 2), pygame.SRCALPHA)
+            pygame.draw.circle(self.projectile_surface, "Yellow", (radius, radius), radius)
+
+        # Projectile positions are block coordinates of the block center, surface is drawn centered on them
+        offset = self.block_size / 2 - self.projectile_surface.get_width() / 2
+        rows, cols = projectiles.interpolated_positions(interpolation)
+        if isinstance(rows, list):
+            x_positions = [int(self.block_size * col + SCREEN_X_POS + offset) for col in cols]
+            y_positions = [int(self.block_size * row + SCREEN_Y_POS + offset) for row in rows]
+        else:
+            x_positions = (cols * self.block_size + (SCREEN_X_POS + offset)).astype(int).tolist()
+            y_positions = (rows * self.block_size + (SCREEN_Y_POS + offset)).astype(int).tolist()
+
+        surface = self.projectile_surface
+        self.draw_commands.extend(("blit", surface, position) for position in zip(x_positions, y_positions))
+
+    @traced("render.towers")
     def render_towers(self, towers: List[object]):
         from Engine.tower import Tower
         towers: List[Tower] = towers
 
         sprite_category = "towers"
+        sprite_size = (self.block_size, self.block_size)
+
+        # Range overlays are drawn on top of every tower, queued together they are drawn with one blits call
+        range_overlays = []
 
         for tower in towers:
             sprite_type = "normal"
             tower_level = str(tower.tower_level)
 
-            tower_sprite = Sprite(sprite_category=sprite_category, sprite_type=sprite_type, tower_level=tower_level,
-                                  size=(self.block_size, self.block_size))
+            rotation_table = sprite_cache.get_rotation_table(sprite_type, tower_level, sprite_size, self.rotation_steps)
 
             # Check turret rotation
-            tower_sprite, rotated_rect = self.turn_tower(tower, tower_sprite)
+            rotated_surface, rotated_offset = self.turn_tower(tower, rotation_table)
 
             tower_x_pos = self.block_size * tower.position[1] + SCREEN_X_POS
             tower_y_pos = self.block_size * tower.position[0] + SCREEN_Y_POS
 
-            # TODO: If condition might not be needed because rotated_rect is never None
-            if rotated_rect is not None:
-                self.game_window.blit(tower_sprite.rotated_sprite_object, (tower_x_pos + rotated_rect.topleft[0], tower_y_pos + rotated_rect.topleft[1]))
-            else:
-                self.game_window.blit(tower_sprite.rotated_sprite_object, (tower_x_pos, tower_y_pos))
-
-            tower_center_pos = (tower_x_pos + self.block_size // 2, tower_y_pos + self.block_size // 2)
-
-            pygame.draw.circle(self.game_window, "Blue", tower_center_pos, tower.range * self.block_size, width=1)
-
-    def render_player_info(self, cur_lives, cur_money):
-        if not self.lives and not self.money:
-            self.lives_font = pygame.font.Font(None, self.block_size // 2)
-            self.money_font = pygame.font.Font(None, self.block_size // 2)
-
-        self.lives = cur_lives
-        self.money = cur_money
-
-        # Display current lives and gold
-        self.lives_text = self.lives_font.render(f"Lives : {self.lives}", True, "Red")
-        self.money_text = self.money_font.render(f"Gold : {self.money}", True, "darkgoldenrod1")
-
-        # TODO: Draw a rectangle where money and lives will be displayed so it is easier to read
+            self.queue_blit(rotated_surface, (tower_x_pos + rotated_offset[0], tower_y_pos + rotated_offset[1]))
+
+            range_style = self.range_style(tower)
+            if range_style is not None:
+                overlay, overlay_offset = range_overlay_cache.get(tower.range, self.block_size, range_style)
+                tower_center_pos = (tower_x_pos + self.block_size // 2, tower_y_pos + self.block_size // 2)
+                range_overlays.append(("blit", overlay, (tower_center_pos[0] + overlay_offset[0],
+                                                         tower_center_pos[1] + overlay_offset[1])))
+
+        self.draw_commands.extend(range_overlays)
+
+    def range_style(self, tower) -> Optional[str]:
+        # Hovered and selected towers show a filled range, other towers only an outline when ranges are toggled on
+        tower_pos = (tower.position[0], tower.position[1])
+        hovered = self.mouse_block_pos is not None and self.mouse_block_pos == (tower_pos[1], tower_pos[0])
+        if hovered or tower_pos == self.selected_slot_pos:
+            return "filled"
+        if self.show_ranges:
+            return "outline"
+        return None
+
+    def create_hud(self) -> HUD:
+        hud = HUD()
+        font = pygame.font.Font(None, self.block_size // 2)
+
+        # Panel behind lives, gold and game speed so they are easy to read on top of the terrain
+        hud.add(Panel(pygame.Rect(self.block_size * 3 // 4, self.block_size * 3 // 8, self.block_size * 3,
+                                  self.block_size * 2), (0, 0, 0, 120), border_radius=self.block_size // 8))
+        hud.add(Label((self.block_size, self.block_size // 2), font, "Red", "Lives : {}", "lives"))
+        hud.add(Label((self.block_size, self.block_size), font, "darkgoldenrod1", "Gold : {}", "money"))
+        # Game speed is only shown when the game is sped up
+        hud.add(Label((self.block_size, self.block_size * 3 // 2), font, "White", "Speed : {}x", "game_speed"))
+
+        # Buttons for the selected tower slot along the bottom of the window
+        button_width, button_height = self.block_size * 2, self.block_size * 2 // 3
+        button_y_pos = self.window_height - button_height - self.block_size // 6
+        for index, (text, action) in enumerate((("Buy", "buy"), ("Upgrade", "upgrade"), ("Sell", "sell"))):
+            button_x_pos = self.block_size + index * (button_width + self.block_size // 6)
+            hud.add(Button(pygame.Rect(button_x_pos, button_y_pos, button_width, button_height), font, text, action,
+                           f"can_{action}"))
+
+        return hud
+
+    def hud_values(self, render_package: dict) -> dict:
+        # Values the HUD widgets are bound to
+        from Engine.units import get_tower_stats
+
+        level = render_package["level"]
+        money = render_package["money"]
+        game_speed = render_package.get("game_speed", 1)
+
+        tower = None
+        if self.selected_slot_pos is not None:
+            tower = level.get_occupant(*self.selected_slot_pos)
+
+        return {
+            "lives": render_package["lives"],
+            "money": money,
+            "game_speed": game_speed if game_speed != 1 else None,
+            "can_buy": self.selected_slot_pos is not None and tower is None and
+                       money >= get_tower_stats(BUY_TOWER_TYPE).cost,
+            "can_upgrade": tower is not None and tower.can_upgrade() and money >= tower.upgrade_cost(),
+            "can_sell": tower is not None,
+            "mouse_position": self.mouse_abs_pos,
+        }
 
-        self.game_window.blit(self.lives_text, (self.block_size, self.block_size // 2))
-        self.game_window.blit(self.money_text, (self.block_size, self.block_size))
+    def update_hud(self, render_package: dict):
+        # Only widgets whose values changed render again, their regions are pushed with the next frame
+        for dirty_rect in self.hud.update(self.hud_values(render_package)):
+            self.dirty_rect_renderer.invalidate(dirty_rect)
+
+    @traced("render.hud")
+    def render_hud(self, render_package: dict):
+        self.update_hud(render_package)
+        self.draw_commands.extend(self.hud.draw_commands())
+
+    def handle_hud_action(self, action: str):
+        # Button actions apply to the selected tower slot
+        if self.selected_slot_pos is None:
+            return
+
+        position = list(self.selected_slot_pos)
+        if action == "buy":
+            self.return_package.new_tower_position = position
+            self.return_package.new_tower_type = BUY_TOWER_TYPE
+        elif action == "upgrade":
+            self.return_package.upgrade_tower_position = position
+        elif action == "sell":
+            self.return_package.remove_tower_position = position
 
     def get_mouse_pos(self):
         # Get mouse position (x, y) based on level grid
@@ -324,14 +885,25 @@ class Render:
         tower_x_pos = SCREEN_X_POS + self.mouse_block_pos[0] * self.block_size
         tower_y_pos = SCREEN_Y_POS + self.mouse_block_pos[1] * self.block_size
         tower_rect = pygame.Rect(tower_x_pos, tower_y_pos, self.block_size, self.block_size)
-        pygame.draw.rect(self.game_window, "White", tower_rect, 1)
+        self.queue_rect("White", tower_rect, 1)
+
+    def select_tower_slot(self):
+        # Selected slot is the target of the HUD buttons, a selected tower keeps its range visible
+        self.selected_slot_pos = (self.mouse_block_pos[1], self.mouse_block_pos[0])
 
     def handle_existing_tower(self):
         left_click = pygame.mouse.get_pressed()[0]
 
+        if left_click:
+            self.select_tower_slot()
+
     def handle_empty_tower_slot(self):
         left_click = pygame.mouse.get_pressed()[0]
 
+        if left_click:
+            self.select_tower_slot()
+
+    @traced("render.mouse")
     def handle_mouse_events(self, tower_list: List[object], tower_slots):
         from Engine.tower import Tower
         tower_list: List[Tower] = tower_list
@@ -350,62 +922,92 @@ class Render:
                 else:
                     self.handle_empty_tower_slot()
 
+        # Outline the selected slot so it is clear what the HUD buttons act on
+        if self.selected_slot_pos is not None:
+            selected_rect = pygame.Rect(SCREEN_X_POS + self.selected_slot_pos[1] * self.block_size,
+                                        SCREEN_Y_POS + self.selected_slot_pos[0] * self.block_size,
+                                        self.block_size, self.block_size)
+            self.queue_rect("Yellow", selected_rect, 2)
+
     def render_game(self, render_package: dict):
         # Render enemies
         enemy_list = render_package["level"].enemies
         current_frame = render_package["current_frame"]
-        self.render_enemies(enemy_list, current_frame)
+        interpolation = render_package.get("interpolation", 1.0)
+        self.render_enemies(enemy_list, current_frame, interpolation)
 
         # Render towers, and their current shooting range
         tower_list = render_package["level"].towers
         self.render_towers(tower_list)
 
-        # Render current lives and money
-        cur_lives = render_package["lives"]
-        cur_money = render_package["money"]
-        self.render_player_info(cur_lives, cur_money)
+        # Render projectiles in flight on top of enemies and towers
+        projectiles = render_package.get("projectiles")
+        if projectiles is not None:
+            self.render_projectiles(projectiles, interpolation)
+
+        # Render current lives, money and the tower buttons
+        self.render_hud(render_package)
 
     def get_keyboard_input(self):
         key_pressed = pygame.key.get_pressed()
         if key_pressed[pygame.K_ESCAPE]:
             self.return_package.game_over = True
 
-    def handle_events(self):
+        # Number keys select the game speed
+        for key, game_speed in SPEED_KEYS.items():
+            if key_pressed[key]:
+                self.return_package.game_speed = game_speed
+
+    @traced("render.events")
+    def handle_events(self, render_package: dict):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self.return_package.game_over = True
-
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                # Buttons were last updated before the previous package was applied and the slot selected
+                self.update_hud(render_package)
+                action = self.hud.click(event.pos)
+                if action is not None:
+                    self.handle_hud_action(action)
+            elif event.type == pygame.KEYDOWN and event.key == RANGE_TOGGLE_KEY:
+                self.show_ranges = not self.show_ranges
+            elif event.type == pygame.VIDEOEXPOSE:
+                # Window contents were lost so the next frame has to push everything
+                self.dirty_rect_renderer.full_redraw = True
+
+    @traced("render.update")
     def update(self, render_package: dict) -> ReturnPackage:
         self.return_package = ReturnPackage()
-        self.game_window.fill("Red")
+        self.draw_commands = []
 
         # Handles keyboard inputs
         self.get_keyboard_input()
 
         # Handles pygame events
-        self.handle_events()
+        self.handle_events(render_package)
 
-        # Create background if it is not created
+        # Create background if it is not created, afterwards only the cells the level reports as changed are redrawn
         if self.background is None:
-            self.background = Background(render_package["level"].terrain)
+            level = render_package["level"]
+            self.background = Background(level)
             self.background.create_background()
+            level.add_terrain_listener(self.background.invalidate_cells)
+            self.create_window_background()
+        else:
+            self.update_background()
 
-        self.game_window.blit(self.background.get_background(), (SCREEN_X_POS, SCREEN_Y_POS))
-
-        # enemy_sprite = Sprite("enemies", "normal", "run")
-        # self.game_window.blit(enemy_sprite.get_sprite(), (SCREEN_X_POS + 100, SCREEN_Y_POS + 230))
-
-        # self.game_window.blit(self.temp_tower.rotated_sprite_object, (SCREEN_X_POS + 100, SCREEN_Y_POS + 230))
-        # self.temp_tower.rotate_sprite(90)
+        # Mouse position is needed before rendering to show the range of the hovered tower
+        self.get_mouse_pos()
 
         # Update various elements on screen
         self.render_game(render_package)
 
         # Handles mouse events
-        self.get_mouse_pos()
         self.handle_mouse_events(render_package["level"].towers, render_package["level"].tower_slots)
 
-        pygame.display.update()
+        # Draw the frame and push only the changed regions to the display
+        self.dirty_rects = self.dirty_rect_renderer.present(self.game_window, self.window_background,
+                                                            self.draw_commands)
 
         return self.return_package
 
@@ -0,0 +1,108 @@
+import json
+from dataclasses import dataclass, field, fields, asdict
+from typing import Optional, List, Tuple
+
+from Engine.package import ReturnPackage
+
+"""
+Input recording and replays
+
+Game randomness comes from a single seeded generator, so a session is fully described by the seed and
+the player actions. Every applied ReturnPackage is recorded with the frame it was applied on.
+Replayer runs the recording headless at maximum speed and checks the final state digest matches.
+
+Game speed only changes how fast ticks run on the wall clock, so it is not recorded.
+"""
+
+# ReturnPackage fields that do not change the game state
+UNRECORDED_FIELDS = ("game_speed",)
+
+
+@dataclass
+class Recording:
+    seed: int
+    use_enemy_store: bool = False
+    # Waves file of the game, None is the default waves file
+    waves_path: Optional[str] = None
+    # (frame, changed ReturnPackage fields) in the order they were applied
+    packages: List[Tuple[int, dict]] = field(default_factory=list)
+    final_frame: Optional[int] = None
+    final_digest: Optional[str] = None
+
+    def record(self, frame: int, return_package: ReturnPackage):
+        # Only fields that differ from an empty package are stored, empty packages are not stored at all
+        default = ReturnPackage()
+        changes = {
+            package_field.name: getattr(return_package, package_field.name)
+            for package_field in fields(ReturnPackage)
+            if package_field.name not in UNRECORDED_FIELDS
+            and getattr(return_package, package_field.name) != getattr(default, package_field.name)
+        }
+
+        if changes:
+            self.packages.append((frame, changes))
+
+    def finish(self, game):
+        self.final_frame = game.frame
+        self.final_digest = game.state_digest()
+
+    def save(self, path: str):
+        with open(path, "w") as file:
+            json.dump(asdict(self), file)
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        with open(path, "r") as file:
+            data = json.load(file)
+
+        data["packages"] = [(frame, changes) for frame, changes in data["packages"]]
+        return cls(**data)
+
+
+@dataclass
+class ReplayResult:
+    frame: int
+    digest: str
+    matches: bool
+    elapsed_time: float
+
+
+class Replayer:
+    def __init__(self, recording: Recording):
+        self.recording = recording
+
+    def run(self) -> ReplayResult:
+        from time import perf_counter
+        from Engine.engine import Engine
+
+        recording = self.recording
+        engine = Engine(headless=True, use_enemy_store=recording.use_enemy_store, seed=recording.seed,
+                        waves_path=recording.waves_path)
+        game = engine.game
+
+        packages_by_frame = {}
+        for frame, changes in recording.packages:
+            packages_by_frame.setdefault(frame, []).append(ReturnPackage(**changes))
+
+        start = perf_counter()
+
+        # Packages are applied before the tick of their frame, same as the engine applies them after rendering
+        final_frame = recording.final_frame if recording.final_frame is not None else game.frame
+        while True:
+            for return_package in packages_by_frame.get(game.frame, []):
+                engine.handle_package(return_package)
+
+            if not game.game_running or game.frame >= final_frame:
+                break
+
+            game.update()
+
+        elapsed_time = perf_counter() - start
+        digest = game.state_digest()
+
+        return ReplayResult(
+            frame=game.frame,
+            digest=digest,
+            matches=digest == recording.final_digest,
+            elapsed_time=elapsed_time,
+        )
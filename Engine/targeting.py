@@ -0,0 +1,129 @@
+from typing import List, Optional, Set
+
+from Engine.events import ShotFired, EnemyDamaged
+from Engine.registry import INDEX_MASK
+import Engine.turret_math as turret_math
+from Engine.projectile import fire_projectiles
+
+"""
+Batched tower targeting
+
+Targets of every tower are selected in one pass per tick and then the towers shoot in order.
+Each ready tower picks the first enemy in range. Enemies cannot overtake each other on the path,
+so the earliest spawned enemy in range is also the most advanced one.
+
+Every tower checks the occupancy of the path blocks it covers, ordered by path progress so the most
+advanced enemy is found first. Coverage of the tower slots is precomputed, other positions are covered the first
+time a tower stands on them.
+
+Targets used to be selected with a NumPy matrix of the squared distances of every tower and enemy pair.
+The coverage tables replaced it: a ready tower scans at most the path blocks it covers and stops at the
+first occupied one, while the matrix cost towers x enemies every tick.
+"""
+
+
+class CoverageTargetSelection:
+    """
+    Result of the coverage table targeting pass
+
+    coverages[i] holds the path blocks covered by tower i, they are only scanned when the tower shoots.
+    """
+
+    def __init__(self, terrain, entities, coverages: List):
+        self.terrain = terrain
+        self.entities = entities
+        self.coverages = coverages
+
+    def target(self, tower_index: int, dead_enemies: Set) -> Optional[object]:
+        # Covered blocks are path blocks, so any occupant is an enemy
+        # Occupancy only holds IDs of live entities, so the registry slot can be read without the generation check
+        occupancy, cols = self.terrain.occupancy, self.terrain.cols
+        slot_entities = self.entities.slot_entities
+        for row, col in self.coverages[tower_index]:
+            entity_id = occupancy[row * cols + col]
+            if entity_id:
+                enemy = slot_entities[entity_id & INDEX_MASK]
+                if enemy not in dead_enemies:
+                    return enemy
+        return None
+
+
+def select_targets(towers: List, level, cur_frame: int) -> CoverageTargetSelection:
+    """
+    Find the target of every tower in one pass
+    :param towers: Towers in the order they shoot
+    :param level: Level with the coverage tables
+    :param cur_frame: Current frame used to check the shot cooldowns
+    :return: Target selection of the towers
+    """
+    coverages = [level.get_coverage(tower.position, tower.range) if tower.is_ready(cur_frame) else []
+                 for tower in towers]
+
+    return CoverageTargetSelection(level.terrain, level.entities, coverages)
+
+
+def apply_shots(towers: List, selection, cur_frame: int, events=None, projectiles=None) -> List:
+    """
+    Let every tower shoot its selected target in tower order, bullet vectors of all shots are solved in one batch
+    :param events: Event bus that gets ShotFired and EnemyDamaged events of every shot
+    :param projectiles: Projectile pool, when given shots launch projectiles and damage is applied when they hit
+    :return: Enemies that died, in the order they died
+    """
+    dead_enemies = []
+    dead_set = set()
+    shots = []
+
+    for tower_index, tower in enumerate(towers):
+        enemy = selection.target(tower_index, dead_set)
+
+        if enemy is None:
+            continue
+
+        if projectiles is not None:
+            tower.start_shot(enemy, cur_frame)
+            shots.append((tower, enemy))
+
+            if events is not None and events.active:
+                events.publish(ShotFired((tower.position[0], tower.position[1]), enemy.creation_index, tower.angle))
+            continue
+
+        hp_before = enemy.current_hp
+        enemy_died: bool = tower.fire_at(enemy, cur_frame, aim=False)
+        shots.append((tower, enemy))
+
+        if events is not None and events.active:
+            events.publish(ShotFired((tower.position[0], tower.position[1]), enemy.creation_index, tower.angle))
+            events.publish(EnemyDamaged(enemy.creation_index, hp_before - enemy.current_hp, enemy.current_hp))
+
+        if enemy_died:
+            dead_set.add(enemy)
+            dead_enemies.append(enemy)
+
+    bullet_vectors, impact_times = aim_shots(shots)
+
+    if projectiles is not None:
+        fire_projectiles(projectiles, shots, bullet_vectors, impact_times)
+
+    return dead_enemies
+
+
+def aim_shots(shots: List):
+    """
+    Solve the bullet vectors of every (tower, enemy) shot at once
+    :return: Bullet vectors and impact times of the shots
+    """
+    if len(shots) == 0:
+        return [], []
+
+    bullet_vectors, impact_times, _ = turret_math.solve_intercepts(
+        [tower.position for tower, _ in shots],
+        [tower.projectile_speed for tower, _ in shots],
+        [enemy.path_table for _, enemy in shots],
+        [enemy.path_distance() for _, enemy in shots],
+        [enemy.node_speed for _, enemy in shots],
+    )
+
+    for (tower, _), bullet_vector in zip(shots, bullet_vectors):
+        tower.bullet_vector = (float(bullet_vector[0]), float(bullet_vector[1]))
+
+    return bullet_vectors, impact_times
@@ -0,0 +1,167 @@
+import functools
+import json
+import math
+import os
+from time import perf_counter_ns
+from typing import Optional, List
+
+"""
+Frame tracing with named spans
+
+Spans are stored in a fixed size ring buffer so tracing can stay on for long sessions.
+Per phase percentiles can be printed at any time and the buffer can be exported as Chrome trace event JSON,
+which opens in chrome://tracing or https://ui.perfetto.dev.
+
+Tracing is disabled by default. A disabled span only checks one flag, so the spans can stay in the code.
+"""
+
+
+class _NullSpan:
+    """ Span used when tracing is disabled, one shared instance that does nothing """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "start")
+
+    def __init__(self, tracer: "Tracer", name: str):
+        self.tracer = tracer
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, self.start, perf_counter_ns() - self.start)
+        return False
+
+
+class Tracer:
+    def __init__(self, capacity: int = 65536):
+        self.enabled = False
+        self.capacity = capacity
+
+        # Ring buffer of spans stored as parallel lists, next_index is where the next span is written
+        self.names: List[Optional[str]] = [None] * capacity
+        self.starts: List[int] = [0] * capacity
+        self.durations: List[int] = [0] * capacity
+        self.next_index = 0
+        self.count = 0
+
+        self.origin = perf_counter_ns()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self.names = [None] * self.capacity
+        self.next_index = 0
+        self.count = 0
+        self.origin = perf_counter_ns()
+
+    def span(self, name: str):
+        # Use as: with tracer.span("game.update"):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def record(self, name: str, start: int, duration: int):
+        index = self.next_index
+        self.names[index] = name
+        self.starts[index] = start
+        self.durations[index] = duration
+
+        self.next_index = (index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def spans(self):
+        # Spans in the buffer from oldest to newest as (name, start ns, duration ns)
+        first = (self.next_index - self.count) % self.capacity
+        for offset in range(self.count):
+            index = (first + offset) % self.capacity
+            yield self.names[index], self.starts[index], self.durations[index]
+
+    def percentiles(self) -> dict:
+        """
+        Percentiles of span durations per phase
+        :return: {name: {"count": int, "p50": ms, "p95": ms, "p99": ms}}
+        """
+        durations_by_name = {}
+        for name, _, duration in self.spans():
+            durations_by_name.setdefault(name, []).append(duration)
+
+        summary = {}
+        for name, durations in durations_by_name.items():
+            durations.sort()
+            summary[name] = {
+                "count": len(durations),
+                "p50": _percentile(durations, 50) / 1e6,
+                "p95": _percentile(durations, 95) / 1e6,
+                "p99": _percentile(durations, 99) / 1e6,
+            }
+
+        return summary
+
+    def report(self) -> str:
+        lines = [f"{'phase':<28}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        for name, stats in sorted(self.percentiles().items()):
+            lines.append(f"{name:<28}{stats['count']:>8}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}")
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path: str):
+        # Complete events ("ph": "X") with timestamps in microseconds
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.origin) / 1000,
+                "dur": duration / 1000,
+                "pid": pid,
+                "tid": 0,
+            }
+            for name, start, duration in self.spans()
+        ]
+
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+def _percentile(sorted_values: List[int], percent: float) -> float:
+    # Nearest rank percentile
+    index = max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+# Process wide tracer used by the engine modules
+tracer = Tracer()
+
+
+def traced(name: str):
+    """ Decorator that wraps every call of the function in a span """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+
+            with _Span(tracer, name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
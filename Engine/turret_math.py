@@ -1,104 +1,276 @@
 import math
+from typing import List, Optional, Tuple
 
-# Constants for the bullet and enemy path
-# BULLET_SPEED = 2
-# ENEMY_SPEED = 2  # Speed at which enemy moves between waypoints
-# WAYPOINT_DISTANCE = 1  # Fixed distance between waypoints
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-# Waypoints for the enemy path (each waypoint is spaced 1 unit apart)
-# enemy_waypoints = [(0, 2), (1, 2), (1, 3), (2, 4), (3, 4), (4, 4)]  # Example waypoints
+"""
+Projectile intercept math
 
+Enemy paths are parameterized by arc length once per path, see PathTable. An enemy on a path is then described
+by its distance along the path and its speed, so its position at any time is a lookup into the table.
 
-def change_coordinate_system(x, y):
-    # In game state using row, column coordinate system, origin at top-left
-    # In math using x, y coordinate system, origin at bottom-left
-    # row = -y, column = x
-    return -y, x
+The intercept is solved exactly per path segment: on segment k the enemy position is P(t) = D + w * t and the
+projectile reaches distance b * t from the tower, so the impact time is the smallest root of
+|D + w * t - T| = b * t that falls inside the time the enemy spends on that segment.
+Segments are tried in path order starting from the one the enemy is on.
+If the enemy reaches the end of its path before it can be hit, the projectile is aimed at the end of the path.
 
+All positions are in (row, col) block coordinates and speeds in blocks per second.
+"""
 
-# Function to calculate travel time between each waypoint (constant)
-def calculate_time_per_waypoint(speed):
-    WAYPOINT_DISTANCE = 1
-    return WAYPOINT_DISTANCE / speed
+# Intercept times closer than this to a segment boundary still count as inside the segment
+EPSILON = 1e-9
+# Smaller batches are solved one shot at a time, NumPy setup costs more than it saves for a few shots
+MIN_BATCH_SIZE = 8
 
 
-# Step 2: Calculate time for bullet to reach the current enemy position
-def calculate_time_to_hit(tx, ty, ex, ey, bullet_speed):
-    dist = math.sqrt((tx - ex) ** 2 + (ty - ey) ** 2)
-    return dist / bullet_speed
+class PathTable:
+    """
+    Cumulative arc length table of a path
+    points[i] is waypoint i and lengths[i] is the distance along the path from waypoint 0 to waypoint i
+    """
 
+    def __init__(self, waypoints: List):
+        self.points: List[Tuple[float, float]] = [(float(row), float(col)) for row, col in waypoints]
 
-# Step 3: Calculate enemy's exact position and velocity vector at t_impact
-def enemy_position_velocity_at_impact(waypoints, time_per_waypoint, t_impact, enemy_speed):
-    elapsed_time = 0
+        self.lengths: List[float] = [0.0]
+        for (row, col), (next_row, next_col) in zip(self.points, self.points[1:]):
+            self.lengths.append(self.lengths[-1] + math.hypot(next_row - row, next_col - col))
 
-    # Iterate through waypoints to find where t_impact lies
-    for i in range(len(waypoints) - 1):
-        if elapsed_time + time_per_waypoint > t_impact:
-            # t_impact falls within this segment
-            time_in_segment = t_impact - elapsed_time
-            p1 = waypoints[i]
-            p2 = waypoints[i + 1]
+        self.total_length = self.lengths[-1]
 
-            # Calculate exact position at t_impact
-            dx = p2[0] - p1[0]
-            dy = p2[1] - p1[1]
-            ex_impact = p1[0] + dx * (time_in_segment / time_per_waypoint)
-            ey_impact = p1[1] + dy * (time_in_segment / time_per_waypoint)
+        # Arrays for the batched solver
+        if np is not None:
+            self.point_array = np.array(self.points, dtype=np.float64).reshape(-1, 2)
+            self.length_array = np.array(self.lengths, dtype=np.float64)
 
-            # Velocity vector in this segment
-            velocity_vector = (dx * enemy_speed, dy * enemy_speed)
-            return (ex_impact, ey_impact), velocity_vector
+    def __len__(self):
+        return len(self.points)
 
-        elapsed_time += time_per_waypoint
+    def distance_on_segment(self, index: int, position: Tuple[float, float]) -> float:
+        """
+        Distance along the path of a position on the segment starting from waypoint index
+        The position is projected to the segment, so positions slightly off the path are fine
+        """
+        if index >= len(self.points) - 1:
+            return self.total_length
 
-    # If t_impact exceeds total path time, return last position
-    return waypoints[-1], (0, 0)
+        (row, col), (next_row, next_col) = self.points[index], self.points[index + 1]
+        segment_length = self.lengths[index + 1] - self.lengths[index]
+        if segment_length == 0:
+            return self.lengths[index]
 
+        along = ((position[0] - row) * (next_row - row) + (position[1] - col) * (next_col - col)) / segment_length
+        return self.lengths[index] + min(max(along, 0.0), segment_length)
 
-# Main function to calculate bullet velocity to hit moving enemy along a path
-def calculate_bullet_velocity(tx, ty, ex, ey, bullet_speed, waypoints, enemy_speed):
-    # Convert coordinates to math coordinate system
-    tx, ty = change_coordinate_system(tx, ty)
-    ex, ey = change_coordinate_system(ex, ey)
+    def position_at(self, distance: float) -> Tuple[float, float]:
+        if distance <= 0:
+            return self.points[0]
+        if distance >= self.total_length:
+            return self.points[-1]
 
-    # Convert the waypoints to math coordinate system
-    waypoints = [change_coordinate_system(x, y) for x, y in waypoints]
+        index = self.segment_index(distance)
+        (row, col), (next_row, next_col) = self.points[index], self.points[index + 1]
+        fraction = (distance - self.lengths[index]) / (self.lengths[index + 1] - self.lengths[index])
+        return row + (next_row - row) * fraction, col + (next_col - col) * fraction
 
-    # Calculate fixed time per waypoint
-    time_per_waypoint = calculate_time_per_waypoint(enemy_speed)
+    def segment_index(self, distance: float) -> int:
+        # Index of the segment the distance falls on, last segment for the end of the path
+        # Binary search over the cumulative lengths
+        low, high = 0, len(self.lengths) - 1
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.lengths[middle] <= distance:
+                low = middle
+            else:
+                high = middle
+        return low
 
-    # Calculate initial time to hit enemy's starting position
-    t_impact = calculate_time_to_hit(tx, ty, ex, ey, bullet_speed)
 
-    # print(f"Time to hit: {t_impact}")
+def smallest_root_in(a: float, b: float, c: float, low: float, high: float) -> Optional[float]:
+    # Smallest root of a * t^2 + b * t + c = 0 within [low, high], None if there is none
+    if abs(a) < EPSILON:
+        if abs(b) < EPSILON:
+            return None
+        roots = (-c / b,)
+    else:
+        discriminant = b * b - 4 * a * c
+        if discriminant < 0:
+            return None
+        root = math.sqrt(discriminant)
+        roots = sorted(((-b - root) / (2 * a), (-b + root) / (2 * a)))
 
-    # Find the exact position and velocity of the enemy at t_impact
-    enemy_impact_pos, enemy_velocity = enemy_position_velocity_at_impact(
-        waypoints, time_per_waypoint, t_impact, enemy_speed
-    )
+    for t in roots:
+        if low - EPSILON <= t <= high + EPSILON:
+            return max(t, low)
+    return None
 
-    # print(f"Enemy impact position: {enemy_impact_pos}")
-    # print(f"Enemy velocity vector: {enemy_velocity}")
 
-    # Calculate bullet direction based on tower position and enemy impact position
-    dx, dy = enemy_impact_pos[0] - tx, enemy_impact_pos[1] - ty
-    dist_to_enemy_impact = math.sqrt(dx ** 2 + dy ** 2)
+def solve_intercept(tower_position, bullet_speed: float, path_table: PathTable, distance: float,
+                    enemy_speed: float) -> Tuple[Tuple[float, float], float, Tuple[float, float]]:
+    """
+    Find where a projectile fired now meets an enemy moving along its path
+    :param tower_position: (row, col) the projectile is fired from
+    :param bullet_speed: Projectile speed
+    :param path_table: Arc length table of the enemy path
+    :param distance: Current distance of the enemy along its path
+    :param enemy_speed: Enemy speed along its path
+    :return: Projectile velocity (row, col), impact time and impact position
+    """
+    tower_row, tower_col = tower_position[0], tower_position[1]
+    points, lengths = path_table.points, path_table.lengths
 
-    direction_vector = (dx / dist_to_enemy_impact, dy / dist_to_enemy_impact)
-    bullet_velocity = (direction_vector[0] * bullet_speed, direction_vector[1] * bullet_speed)
+    if enemy_speed > 0:
+        for index in range(path_table.segment_index(distance), len(points) - 1):
+            segment_length = lengths[index + 1] - lengths[index]
+            if segment_length == 0:
+                continue
 
-    return bullet_velocity
+            # Times the enemy enters and leaves the segment
+            start_time = max((lengths[index] - distance) / enemy_speed, 0.0)
+            end_time = (lengths[index + 1] - distance) / enemy_speed
 
+            # Enemy position on the segment line at t = 0 relative to the tower and enemy velocity
+            (row, col), (next_row, next_col) = points[index], points[index + 1]
+            direction_row, direction_col = (next_row - row) / segment_length, (next_col - col) / segment_length
+            offset = distance - lengths[index]
+            relative_row = row + direction_row * offset - tower_row
+            relative_col = col + direction_col * offset - tower_col
+            velocity_row, velocity_col = direction_row * enemy_speed, direction_col * enemy_speed
 
-# Run calculation with given parameters
-# tower_position = (4, 0)
-# enemy_position = enemy_waypoints[0]
-#
-# bullet_velocity = calculate_bullet_velocity(
-#     tower_position[0], tower_position[1],
-#     enemy_position[0], enemy_position[1],
-#     BULLET_SPEED, enemy_waypoints, ENEMY_SPEED
-# )
-#
-# print("Bullet velocity vector:", bullet_velocity)
+            t = smallest_root_in(
+                velocity_row ** 2 + velocity_col ** 2 - bullet_speed ** 2,
+                2 * (relative_row * velocity_row + relative_col * velocity_col),
+                relative_row ** 2 + relative_col ** 2,
+                start_time, end_time,
+            )
+            if t is not None:
+                impact = (tower_row + relative_row + velocity_row * t, tower_col + relative_col + velocity_col * t)
+                return aim(tower_row, tower_col, impact, bullet_speed), t, impact
+
+    # Enemy cannot be caught before it stops, aim where it stops
+    impact = points[-1] if enemy_speed > 0 else path_table.position_at(distance)
+    t = math.hypot(impact[0] - tower_row, impact[1] - tower_col) / bullet_speed
+    return aim(tower_row, tower_col, impact, bullet_speed), t, impact
+
+
+def aim(tower_row: float, tower_col: float, impact: Tuple[float, float], bullet_speed: float) -> Tuple[float, float]:
+    # Velocity of a projectile flying from the tower towards the impact position
+    delta_row, delta_col = impact[0] - tower_row, impact[1] - tower_col
+    distance = math.hypot(delta_row, delta_col)
+    if distance == 0:
+        return 0.0, 0.0
+    return delta_row / distance * bullet_speed, delta_col / distance * bullet_speed
+
+
+def solve_intercepts(tower_positions, bullet_speeds, path_tables: List[PathTable], distances, enemy_speeds):
+    """
+    Solve many intercepts at once, same as calling solve_intercept for every shot
+    Every shot walks its own path, all shots still searching advance one segment per iteration
+    :return: Projectile velocities (n, 2), impact times (n,) and impact positions (n, 2)
+    """
+    if np is None or len(path_tables) < MIN_BATCH_SIZE:
+        results = [solve_intercept(*shot) for shot in zip(tower_positions, bullet_speeds, path_tables,
+                                                            distances, enemy_speeds)]
+        return ([result[0] for result in results], [result[1] for result in results],
+                [result[2] for result in results])
+
+    shot_count = len(path_tables)
+    towers = np.asarray(tower_positions, dtype=np.float64).reshape(-1, 2)
+    bullet_speeds = np.asarray(bullet_speeds, dtype=np.float64)
+    distances = np.asarray(distances, dtype=np.float64)
+    enemy_speeds = np.asarray(enemy_speeds, dtype=np.float64)
+
+    # Shots on the same path share one copy of its table in the concatenated arrays
+    table_offsets = {}
+    points, lengths = [], []
+    offset = 0
+    for table in path_tables:
+        if id(table) not in table_offsets:
+            table_offsets[id(table)] = offset
+            points.append(table.point_array)
+            lengths.append(table.length_array)
+            offset += len(table)
+    points = np.concatenate(points) if points else np.zeros((0, 2))
+    lengths = np.concatenate(lengths) if lengths else np.zeros(0)
+
+    starts = np.array([table_offsets[id(table)] for table in path_tables], dtype=np.int64)
+    ends = starts + np.array([len(table) for table in path_tables], dtype=np.int64) - 1
+    segments = np.array([starts[i] + table.segment_index(distances[i]) for i, table in enumerate(path_tables)],
+                        dtype=np.int64)
+
+    impact_times = np.full(shot_count, np.nan)
+    impacts = np.zeros((shot_count, 2))
+    searching = (segments < ends) & (enemy_speeds > 0)
+
+    while searching.any():
+        shots = np.flatnonzero(searching)
+        index = segments[shots]
+        speed = enemy_speeds[shots]
+
+        segment_vectors = points[index + 1] - points[index]
+        segment_lengths = lengths[index + 1] - lengths[index]
+        valid = segment_lengths > 0
+        safe_lengths = np.where(valid, segment_lengths, 1.0)
+        directions = segment_vectors / safe_lengths[:, None]
+
+        # Every table starts from length 0, so the distance along the path is comparable to the table lengths
+        offsets = distances[shots] - lengths[index]
+        start_times = np.maximum(-offsets / speed, 0.0)
+        end_times = (segment_lengths - offsets) / speed
+
+        relative = points[index] + directions * offsets[:, None] - towers[shots]
+        velocities = directions * speed[:, None]
+
+        a = np.einsum("ij,ij->i", velocities, velocities) - bullet_speeds[shots] ** 2
+        b = 2 * np.einsum("ij,ij->i", relative, velocities)
+        c = np.einsum("ij,ij->i", relative, relative)
+
+        t = _smallest_roots_in(a, b, c, start_times, end_times)
+        hit = valid & ~np.isnan(t)
+
+        hit_shots = shots[hit]
+        impact_times[hit_shots] = t[hit]
+        impacts[hit_shots] = towers[hit_shots] + relative[hit] + velocities[hit] * t[hit, None]
+
+        searching[hit_shots] = False
+        segments[shots] += 1
+        searching &= segments < ends
+
+    # Shots that never met the enemy aim at the end of the path, or the current position of a standing enemy
+    missed = np.flatnonzero(np.isnan(impact_times))
+    for shot in missed:
+        table = path_tables[shot]
+        impacts[shot] = table.points[-1] if enemy_speeds[shot] > 0 else table.position_at(distances[shot])
+    impact_times[missed] = np.hypot(*(impacts[missed] - towers[missed]).T) / bullet_speeds[missed]
+
+    deltas = impacts - towers
+    norms = np.hypot(deltas[:, 0], deltas[:, 1])
+    velocities = np.where(norms[:, None] > 0, deltas / np.where(norms > 0, norms, 1.0)[:, None], 0.0)
+    velocities *= bullet_speeds[:, None]
+
+    return velocities, impact_times, impacts
+
+
+def _smallest_roots_in(a, b, c, low, high):
+    # Vectorized smallest_root_in, NaN where there is no root in range
+    linear = np.abs(a) < EPSILON
+    safe_a = np.where(linear, 1.0, a)
+    discriminant = b * b - 4 * a * c
+    root = np.sqrt(np.maximum(discriminant, 0.0))
+    real = linear | (discriminant >= 0)
+
+    roots = np.sort(np.stack(((-b - root) / (2 * safe_a), (-b + root) / (2 * safe_a))), axis=0)
+    safe_b = np.where(np.abs(b) < EPSILON, 1.0, b)
+    linear_root = np.where(np.abs(b) < EPSILON, np.nan, -c / safe_b)
+    first = np.where(linear, linear_root, roots[0])
+    second = np.where(linear, np.nan, roots[1])
+
+    def in_range(t):
+        return real & (t >= low - EPSILON) & (t <= high + EPSILON)
+
+    return np.where(in_range(first), np.maximum(first, low),
+                    np.where(in_range(second), np.maximum(second, low), np.nan))
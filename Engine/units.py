@@ -0,0 +1,160 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+"""
+Tower and enemy stats
+
+Unit stats are defined in Engine/towers.json and Engine/enemies.json, so balance changes do not need code
+changes. The files are read and validated once when the module is imported and every unit type, and every
+level of a tower, is compiled into a frozen stat record. Records are shared by reference, so creating an
+enemy or upgrading a tower only replaces the record the unit points to.
+"""
+
+ENEMIES_PATH = "Engine/enemies.json"
+TOWERS_PATH = "Engine/towers.json"
+
+ENEMY_ASSET_PATH = "assets/enemies"
+PROJECTILE_ASSET_PATH = "assets/projectiles"
+TOWER_ASSET_PATH = "assets/towers"
+
+# Field name to the accepted types and the smallest allowed value, None for fields that are not numbers
+ENEMY_FIELDS = {
+    "health": (int, 1),
+    "speed": (int, 1),
+    "money_value": (int, 0),
+    "armor": (int, 0),
+    "enemy_asset": (str, None),
+}
+TOWER_FIELDS = {
+    "hp": (int, 1),
+    "cost": (int, 0),
+    "range": ((int, float), 0),
+    "shot_cooldown": (int, 1),
+    "damage": (int, 0),
+    "projectile_speed": ((int, float), 1),
+    "damage_type": (str, None),
+    "projectile_asset": (str, None),
+    "tower_asset": (str, None),
+}
+
+
+@dataclass(frozen=True, slots=True)
+class EnemyStats:
+    enemy_type: str
+    health: int
+    # Frames it takes to move one block
+    speed: int
+    money_value: int
+    armor: int
+    asset_path: str
+    # Blocks moved per second
+    node_speed: float
+
+
+@dataclass(frozen=True, slots=True)
+class TowerStats:
+    tower_type: str
+    level: int
+    hp: int
+    cost: int
+    range: float
+    shot_cooldown: int
+    damage: int
+    projectile_speed: float
+    damage_type: str
+    projectile_asset_path: str
+    tower_asset_path: str
+
+
+def validate_fields(source: str, data: dict, fields: dict):
+    # Raise ValueError naming the source if the data is missing fields, has unknown fields or invalid values
+    if not isinstance(data, dict):
+        raise ValueError(f"{source}: expected an object, got {type(data).__name__}")
+
+    missing = fields.keys() - data.keys()
+    unknown = data.keys() - fields.keys()
+    if missing or unknown:
+        raise ValueError(f"{source}: missing fields {sorted(missing)}, unknown fields {sorted(unknown)}")
+
+    for name, (field_type, minimum) in fields.items():
+        value = data[name]
+        # bool is an int subclass but never a valid stat
+        if isinstance(value, bool) or not isinstance(value, field_type):
+            raise ValueError(f"{source}: {name} has invalid type {type(value).__name__}")
+        if minimum is not None and value < minimum:
+            raise ValueError(f"{source}: {name} is {value}, smallest allowed value is {minimum}")
+
+
+def compile_enemy_stats(data: dict, source: str = ENEMIES_PATH) -> Dict[str, EnemyStats]:
+    enemy_stats = {}
+    for enemy_type, stats in data.items():
+        validate_fields(f"{source} {enemy_type}", stats, ENEMY_FIELDS)
+        enemy_stats[enemy_type] = EnemyStats(
+            enemy_type=enemy_type,
+            health=stats["health"],
+            speed=stats["speed"],
+            money_value=stats["money_value"],
+            armor=stats["armor"],
+            asset_path=os.path.join(ENEMY_ASSET_PATH, stats["enemy_asset"]),
+            node_speed=60 / stats["speed"],
+        )
+    return enemy_stats
+
+
+def compile_tower_stats(data: dict, source: str = TOWERS_PATH) -> Dict[str, Tuple[TowerStats, ...]]:
+    # Tower types map to a list of levels, level 0 is the tower when it is built
+    tower_stats = {}
+    for tower_type, levels in data.items():
+        if not isinstance(levels, list) or len(levels) == 0:
+            raise ValueError(f"{source} {tower_type}: expected a list of tower levels")
+
+        compiled_levels = []
+        for level, stats in enumerate(levels):
+            validate_fields(f"{source} {tower_type} level {level}", stats, TOWER_FIELDS)
+            compiled_levels.append(TowerStats(
+                tower_type=tower_type,
+                level=level,
+                hp=stats["hp"],
+                cost=stats["cost"],
+                range=float(stats["range"]),
+                shot_cooldown=stats["shot_cooldown"],
+                damage=stats["damage"],
+                projectile_speed=stats["projectile_speed"],
+                damage_type=stats["damage_type"],
+                projectile_asset_path=os.path.join(PROJECTILE_ASSET_PATH, stats["projectile_asset"]),
+                tower_asset_path=os.path.join(TOWER_ASSET_PATH, stats["tower_asset"]),
+            ))
+        tower_stats[tower_type] = tuple(compiled_levels)
+    return tower_stats
+
+
+def load_enemy_stats(path: str = ENEMIES_PATH) -> Dict[str, EnemyStats]:
+    with open(path, "r") as file:
+        return compile_enemy_stats(json.load(file), path)
+
+
+def load_tower_stats(path: str = TOWERS_PATH) -> Dict[str, Tuple[TowerStats, ...]]:
+    with open(path, "r") as file:
+        return compile_tower_stats(json.load(file), path)
+
+
+ENEMY_STATS: Dict[str, EnemyStats] = load_enemy_stats()
+TOWER_STATS: Dict[str, Tuple[TowerStats, ...]] = load_tower_stats()
+
+
+def get_enemy_stats(enemy_type: str) -> EnemyStats:
+    if enemy_type not in ENEMY_STATS:
+        raise ValueError(f"Unknown enemy type: {enemy_type}")
+    return ENEMY_STATS[enemy_type]
+
+
+def get_tower_stats(tower_type: str, level: int = 0) -> TowerStats:
+    if tower_type not in TOWER_STATS:
+        raise ValueError(f"Unknown tower type: {tower_type}")
+
+    levels = TOWER_STATS[tower_type]
+    if not 0 <= level < len(levels):
+        raise ValueError(f"Tower {tower_type} has no level {level}")
+    return levels[level]
@@ -0,0 +1,147 @@
+import heapq
+import json
+import math
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, List, Tuple
+
+"""
+Wave definitions and the spawn timeline
+
+Waves are defined in a JSON file, see Engine/waves.json. Every wave is a list of spawn groups, a group spawns
+count enemies of one type in bursts of burst enemies every interval frames, starting delay frames after the
+wave starts. A wave starts delay frames after the previous wave has spawned its last burst.
+
+The whole level is compiled into one timeline. Every group is a single entry of a heap ordered by the frame of
+its next burst, so a spawn costs O(log groups) and a frame without spawns costs one comparison no matter how
+many enemies the waves have. Spawns whose start block is occupied wait in a retry queue and are tried again
+every frame before any new spawns, in the order they were due.
+"""
+
+DEFAULT_WAVES_PATH = "Engine/waves.json"
+
+
+@dataclass(frozen=True)
+class SpawnGroup:
+    enemy_type: str
+    count: int
+    # Frames from the start of the wave to the first burst
+    delay: int = 0
+    # Frames between bursts
+    interval: int = 120
+    # Enemies spawned at once
+    burst: int = 1
+    # Index of the start block to spawn at, None spawns at a random free start block
+    start: Optional[int] = None
+
+    def __post_init__(self):
+        if self.count < 0 or self.delay < 0 or self.interval < 1 or self.burst < 1:
+            raise ValueError(f"Invalid spawn group: {self}")
+        if self.start is not None and self.start < 0:
+            raise ValueError(f"Invalid start block index: {self.start}")
+
+    @property
+    def duration(self) -> int:
+        # Frames from the start of the wave to the last burst
+        bursts = math.ceil(self.count / self.burst)
+        return self.delay + max(bursts - 1, 0) * self.interval
+
+
+@dataclass(frozen=True)
+class Wave:
+    groups: Tuple[SpawnGroup, ...]
+    # Frames from the last burst of the previous wave, or the start of the game, to the start of this wave
+    delay: int = 0
+
+    def __post_init__(self):
+        if self.delay < 0:
+            raise ValueError(f"Invalid wave delay: {self.delay}")
+
+    @property
+    def duration(self) -> int:
+        return max((group.duration for group in self.groups if group.count > 0), default=0)
+
+
+@dataclass(frozen=True, slots=True)
+class Spawn:
+    """ One enemy that is due to spawn """
+    wave: int
+    enemy_type: str
+    start: Optional[int]
+
+
+def parse_waves(data: dict) -> List[Wave]:
+    return [
+        Wave(groups=tuple(SpawnGroup(**group) for group in wave["groups"]), delay=wave.get("delay", 0))
+        for wave in data["waves"]
+    ]
+
+
+def load_waves(path: str = DEFAULT_WAVES_PATH) -> List[Wave]:
+    with open(path, "r") as file:
+        return parse_waves(json.load(file))
+
+
+class WaveSchedule:
+    def __init__(self, waves: List[Wave]):
+        self.waves = waves
+
+        # Heap of (frame of the next burst, wave index, group index, enemies spawned so far) per group
+        self.heap: List[Tuple[int, int, int, int]] = []
+        # Spawns that were due but could not be placed, tried again next frame
+        self.retry_queue: deque = deque()
+
+        # Frame every wave starts on
+        self.wave_start_frames: List[int] = []
+
+        wave_start = 0
+        for wave_index, wave in enumerate(waves):
+            wave_start += wave.delay
+            self.wave_start_frames.append(wave_start)
+
+            for group_index, group in enumerate(wave.groups):
+                if group.count > 0:
+                    self.heap.append((wave_start + group.delay, wave_index, group_index, 0))
+
+            wave_start += wave.duration
+
+        heapq.heapify(self.heap)
+
+    @property
+    def finished(self) -> bool:
+        # True when every enemy of every wave has spawned
+        return len(self.heap) == 0 and len(self.retry_queue) == 0
+
+    def has_due(self, frame: int) -> bool:
+        return len(self.retry_queue) > 0 or (len(self.heap) > 0 and self.heap[0][0] <= frame)
+
+    def due_spawns(self, frame: int) -> List[Spawn]:
+        """
+        Take every spawn that is due on the frame
+        :return: Spawns waiting for retry first, then the bursts of the frame in group order
+        """
+        spawns = list(self.retry_queue)
+        self.retry_queue.clear()
+
+        heap = self.heap
+        while heap and heap[0][0] <= frame:
+            burst_frame, wave_index, group_index, spawned = heapq.heappop(heap)
+            group = self.waves[wave_index].groups[group_index]
+
+            burst = min(group.burst, group.count - spawned)
+            spawns.extend(Spawn(wave_index, group.enemy_type, group.start) for _ in range(burst))
+
+            spawned += burst
+            if spawned < group.count:
+                heapq.heappush(heap, (burst_frame + group.interval, wave_index, group_index, spawned))
+
+        return spawns
+
+    def retry(self, spawn: Spawn):
+        # Spawn could not be placed, try again on the next frame
+        self.retry_queue.append(spawn)
+
+    def state(self) -> tuple:
+        # Remaining timeline, used for the game state digest
+        retries = tuple((spawn.wave, spawn.enemy_type, spawn.start) for spawn in self.retry_queue)
+        return tuple(sorted(self.heap)), retries
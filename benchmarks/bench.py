@@ -0,0 +1,436 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+from time import perf_counter
+from typing import Callable, List, Optional
+
+"""
+Benchmarks for the engine hot paths
+
+Run from the repository root:
+python -m benchmarks.bench --output results.json
+python -m benchmarks.bench --output new.json --baseline results.json --threshold 0.15
+
+Every case is built from a fixed seed so runs are comparable. Results are saved as JSON and when a baseline
+is given, cases slower than baseline by more than the threshold and cases of the baseline that raised are
+reported and the exit code is 1.
+"""
+
+# Render benchmarks need a display, dummy driver renders to memory only
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import Engine.targeting as targeting
+from Engine.enemy import Enemy, a_star_algorithm
+from Engine.engine import Engine
+from Engine.game import Game
+from Engine.level import Terrain
+from Engine.projectile import SECONDS_PER_TICK
+from Engine.tower import Tower
+from Engine.waves import SpawnGroup, Wave, WaveSchedule
+
+DEFAULT_SEED = 1234
+
+
+def measure(function: Callable, number: int, repeat: int) -> dict:
+    # Time number calls of function repeat times, report time per call in seconds
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            function()
+        times.append((perf_counter() - start) / number)
+
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def generate_terrain(rows: int, cols: int, rng: random.Random):
+    """
+    Generate a serpentine path that runs every other row from wall to wall
+    :return: Terrain, start block, end block and the free blocks next to the path
+    """
+    terrain = Terrain(rows, cols, 2)
+    path = []
+
+    for row in range(0, rows, 2):
+        cols_in_order = range(cols) if (row // 2) % 2 == 0 else range(cols - 1, -1, -1)
+        path.extend([row, col] for col in cols_in_order)
+
+        # Connect to the next run at the end of this run
+        if row + 2 < rows:
+            path.append([row + 1, path[-1][1]])
+
+    for row, col in path:
+        terrain.set_block_type(row, col, 0)
+
+    # Free blocks next to the path are possible tower slots
+    slot_candidates = []
+    for row in range(rows):
+        for col in range(cols):
+            if terrain.get_block_type(row, col) != 2:
+                continue
+            if any(terrain.in_bounds(row + dr, col + dc) and terrain.get_block_type(row + dr, col + dc) == 0
+                   for dr, dc in ((0, 1), (1, 0), (0, -1), (-1, 0))):
+                slot_candidates.append([row, col])
+    rng.shuffle(slot_candidates)
+
+    return terrain, path, slot_candidates
+
+
+def build_game(rows: int, cols: int, towers: int, enemies: int, seed: int) -> Game:
+    # Game on a generated map with towers next to the path and enemies spread over the path
+    rng = random.Random(seed)
+
+    terrain, path, slot_candidates = generate_terrain(rows, cols, rng)
+    tower_slots = slot_candidates[:towers]
+    for row, col in tower_slots:
+        terrain.set_block_type(row, col, 1)
+
+    game = Game(seed=seed)
+    for tower in list(game.level.towers):
+        game.level.update(3, current_position=tower.position)
+    game.level.load_terrain(terrain, [path[0]], [path[-1]], tower_slots)
+
+    for slot in tower_slots:
+        game.level.update(2, current_position=slot, tower=Tower("standard", slot))
+
+    # Enemies are placed from the end of the path backwards, same order they would have spawned in
+    enemy_blocks = sorted(rng.sample(range(len(path) - 1), enemies), reverse=True)
+    for block in enemy_blocks:
+        enemy = game.level.create_enemy("normal")
+        game.level.add_enemy(enemy, path[block])
+
+    return game
+
+
+def bench_a_star(seed: int) -> dict:
+    results = {}
+    for rows, cols in ((10, 20), (20, 40), (40, 80)):
+        terrain, path, _ = generate_terrain(rows, cols, random.Random(seed))
+        results[f"a_star/{rows}x{cols}"] = measure(
+            lambda: a_star_algorithm(path[0], terrain, path[-1]), number=5, repeat=5)
+    return results
+
+
+def bench_towers(seed: int) -> dict:
+    results = {}
+    for towers, enemies in ((1, 10), (10, 100), (50, 100), (50, 1000)):
+        game = build_game(40, 80, towers, enemies, seed)
+
+        # Enemies can not die so every call does the same work
+        for enemy in game.level.enemies:
+            enemy.current_hp = 10 ** 9
+
+        def tower_actions():
+            # Move frame forward by the cooldown so every tower is ready to shoot again
+            game.frame += 60
+            game.projectiles.clear()
+            game.tower_actions()
+
+        results[f"tower_actions/{towers}x{enemies}"] = measure(tower_actions, number=20, repeat=5)
+
+        def select_targets():
+            # Target of every tower without shooting, so the enemies and cooldowns stay the same
+            selection = targeting.select_targets(game.level.towers, game.level, game.frame + 60)
+            for tower_index in range(len(game.level.towers)):
+                selection.target(tower_index, set())
+
+        results[f"select_targets/{towers}x{enemies}"] = measure(select_targets, number=20, repeat=5)
+
+    return results
+
+
+def bench_mass_kill(seed: int) -> dict:
+    results = {}
+    for enemies in (100, 400):
+        # Every repeat kills all enemies of a fresh game, games are built before timing starts
+        games = iter([build_game(20, 40, 0, enemies, seed) for _ in range(3)])
+
+        def kill_all():
+            level = next(games).level
+            for enemy in list(level.enemies):
+                level.update(1, enemy=enemy)
+
+        results[f"mass_kill/{enemies}"] = measure(kill_all, number=1, repeat=3)
+
+    return results
+
+
+def bench_projectiles(seed: int) -> dict:
+    results = {}
+    for projectiles in (1000, 5000):
+        game = build_game(40, 80, 0, 1000, seed)
+        rng = random.Random(seed)
+
+        # Slow projectiles with a long lifetime so every call steps about the same amount of projectiles
+        for _ in range(projectiles):
+            game.projectiles.spawn((rng.uniform(0, 40), rng.uniform(0, 80)), (rng.uniform(-1, 1), rng.uniform(-1, 1)),
+                                   0, 0, 0, 10 ** 6)
+
+        def step_and_find_hits():
+            game.projectiles.step(SECONDS_PER_TICK, 40, 80)
+            game.projectiles.find_hits(game.level.enemies, game.level.enemy_store)
+
+        results[f"projectiles/{projectiles}"] = measure(step_and_find_hits, number=20, repeat=5)
+
+    return results
+
+
+def bench_units(seed: int) -> dict:
+    results = {}
+
+    def create_enemies():
+        for _ in range(1000):
+            Enemy("normal")
+
+    results["create_enemy/1000"] = measure(create_enemies, number=5, repeat=5)
+
+    def build_and_upgrade_towers():
+        for _ in range(1000):
+            Tower("standard", [0, 0]).upgrade_tower()
+
+    results["upgrade_tower/1000"] = measure(build_and_upgrade_towers, number=5, repeat=5)
+
+    return results
+
+
+def bench_waves(seed: int) -> dict:
+    results = {}
+    rng = random.Random(seed)
+
+    # 100 groups of 1000 enemies spread over about 100000 frames, one wave per 10 groups
+    waves = [Wave(groups=tuple(SpawnGroup("normal", 1000, delay=rng.randrange(100), interval=100,
+                                          burst=rng.choice((1, 5))) for _ in range(10)), delay=50)
+             for _ in range(10)]
+    enemies = sum(group.count for wave in waves for group in wave.groups)
+    last_frame = WaveSchedule(waves).wave_start_frames[-1] + waves[-1].duration
+
+    def drain_schedule():
+        wave_schedule = WaveSchedule(waves)
+        for frame in range(last_frame + 1):
+            if wave_schedule.has_due(frame):
+                wave_schedule.due_spawns(frame)
+
+    result = measure(drain_schedule, number=1, repeat=3)
+    result["spawns"] = enemies
+    result["frames"] = last_frame + 1
+    results[f"wave_schedule/{enemies}"] = result
+
+    return results
+
+
+def bench_game_update(seed: int) -> dict:
+    results = {}
+    for name, use_enemy_store in (("objects", False), ("enemy_store", True)):
+        # Every repeat runs a fresh game, games are built before timing starts
+        engines = iter([Engine(headless=True, use_enemy_store=use_enemy_store, seed=seed) for _ in range(5)])
+
+        def run_ticks():
+            next(engines).run_headless(max_ticks=2000)
+
+        result = measure(run_ticks, number=1, repeat=5)
+        result["ticks_per_second"] = 2000 / result["min"]
+        results[f"game_update/{name}"] = result
+
+    return results
+
+
+def bench_render(seed: int) -> dict:
+    from Engine.render import Render
+
+    game = build_game(10, 20, 4, 20, seed)
+    render = Render()
+    render_package = {
+        "money": game.money,
+        "lives": game.lives,
+        "current_frame": game.frame,
+        "level": game.level,
+    }
+
+    def render_update():
+        game.enemy_actions()
+        render_package["current_frame"] = game.frame
+        game.frame += 1
+        render.update(render_package)
+
+    try:
+        results = {"render_update/10x20": measure(render_update, number=60, repeat=5)}
+
+        render.show_ranges = True
+        results["render_update_ranges/10x20"] = measure(render_update, number=60, repeat=5)
+
+        def render_hud():
+            # Values do not change, so no widget renders again
+            render.draw_commands = []
+            render.render_hud(render_package)
+
+        results["render_hud/unchanged"] = measure(render_hud, number=200, repeat=5)
+
+        # Slow projectiles spread over the terrain, every frame all of them move a little
+        rng = random.Random(seed)
+        for _ in range(1000):
+            game.projectiles.spawn((rng.uniform(0, 10), rng.uniform(0, 20)), (rng.uniform(-1, 1), rng.uniform(-1, 1)),
+                                   0, 0, 0, 10 ** 6)
+        render_package["projectiles"] = game.projectiles
+
+        def render_projectiles():
+            game.projectiles.step(SECONDS_PER_TICK, 10, 20)
+            render_update()
+
+        results["render_update_projectiles/1000"] = measure(render_projectiles, number=20, repeat=5)
+        return results
+    finally:
+        render.close_window()
+
+
+def bench_background(seed: int) -> dict:
+    from Engine.render import Background
+
+    results = {}
+    for rows, cols in ((10, 20), (40, 80)):
+        game = build_game(rows, cols, 1, 0, seed)
+        background = Background(game.level)
+        background.create_background()
+        game.level.add_terrain_listener(background.invalidate_cells)
+
+        slot = game.level.towers[0].position
+
+        def toggle_tower():
+            # Sell and rebuild the tower, the cell is redrawn twice when it is visible and skipped when it is not
+            game.level.update(3, current_position=slot)
+            background.apply_changes()
+            game.level.update(2, current_position=slot, tower=Tower("standard", slot))
+            background.apply_changes()
+
+        results[f"background_rebuild/{rows}x{cols}"] = measure(background.create_background, number=5, repeat=5)
+        results[f"background_tower_toggle/{rows}x{cols}"] = measure(toggle_tower, number=20, repeat=5)
+    return results
+
+
+BENCHMARKS = {
+    "a_star": bench_a_star,
+    "towers": bench_towers,
+    "mass_kill": bench_mass_kill,
+    "projectiles": bench_projectiles,
+    "waves": bench_waves,
+    "units": bench_units,
+    "game_update": bench_game_update,
+    "render": bench_render,
+    "background": bench_background,
+}
+
+
+def run_benchmarks(names: List[str], seed: int) -> dict:
+    # Every result records the benchmark it came from, a benchmark that raises is recorded as an error
+    results = {}
+    for name in names:
+        # Keep anything the engine prints out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                benchmark_results = BENCHMARKS[name](seed)
+            except Exception as error:
+                results[name] = {"benchmark": name, "error": f"{type(error).__name__}: {error}"}
+                continue
+
+        for result in benchmark_results.values():
+            result["benchmark"] = name
+        results.update(benchmark_results)
+
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    # Cases slower than baseline by more than threshold, compared on the best time
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or "min" not in result or "min" not in base:
+            continue
+
+        ratio = result["min"] / base["min"]
+        if ratio > 1 + threshold:
+            regressions.append(f"{name}: {base['min'] * 1000:.3f} ms -> {result['min'] * 1000:.3f} ms ({ratio:.2f}x)")
+
+    return regressions
+
+
+def find_failures(results: dict, baseline: dict) -> List[str]:
+    # Cases measured in baseline whose benchmark raised in this run
+    errors = {result["benchmark"]: result["error"] for result in results.values() if "error" in result}
+
+    failures = []
+    for name, base in baseline.items():
+        if "min" in base and base.get("benchmark") in errors and name not in results:
+            failures.append(f"{name}: {errors[base['benchmark']]}")
+
+    return failures
+
+
+def print_results(results: dict):
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name:<32} error ({result['error']})")
+        else:
+            print(f"{name:<32} min {result['min'] * 1000:10.3f} ms   median {result['median'] * 1000:10.3f} ms")
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the engine hot paths")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), default=list(BENCHMARKS),
+                        help="Benchmarks to run, default is all")
+    parser.add_argument("--output", help="Save results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="Allowed slowdown compared to baseline, 0.15 is 15 percent")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    results = run_benchmarks(args.only, args.seed)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({
+                "meta": {
+                    "seed": args.seed,
+                    "python": sys.version.split()[0],
+                    "platform": platform.platform(),
+                },
+                "results": results,
+            }, file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)["results"]
+
+        failures = find_failures(results, baseline)
+        for failure in failures:
+            print(f"FAILED {failure}")
+
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+        if failures or regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,87 @@
+import argparse
+
+from Engine.batch import BatchJob, run_and_summarize
 from Engine.engine import Engine
+from Engine.events import ConsoleLogger, FileSink, EventCounter
+from Engine.replay import Recording, Replayer
+from Engine.trace import tracer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tower defence game")
+    parser.add_argument("--headless", action="store_true",
+                        help="Run the game logic without a window and without tick rate limit")
+    parser.add_argument("--ticks", type=int, default=None,
+                        help="Maximum amount of game updates in headless mode")
+    parser.add_argument("--enemy-store", action="store_true",
+                        help="Keep enemies in NumPy arrays, faster with large amounts of enemies")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of the game, same seed creates the same level")
+    parser.add_argument("--waves", metavar="PATH", default=None,
+                        help="Load the waves of enemies from PATH instead of Engine/waves.json")
+    parser.add_argument("--record", metavar="PATH", default=None,
+                        help="Save the seed and every player action to PATH on exit")
+    parser.add_argument("--replay", metavar="PATH", default=None,
+                        help="Replay a recording headless at maximum speed and check it ends in the same state")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print every game event and the startup report")
+    parser.add_argument("--event-log", metavar="PATH", default=None,
+                        help="Save every game event as JSON lines to PATH and print event counts on exit")
+    parser.add_argument("--batch", type=int, metavar="JOBS", default=None,
+                        help="Run JOBS headless games with seeds counting up from --seed and print a summary")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes used by --batch, default is one per core")
+    parser.add_argument("--tower-slots", type=int, nargs="*", default=None,
+                        help="Tower slot indices to place towers on in every --batch game")
+    parser.add_argument("--trace", metavar="PATH", default=None,
+                        help="Trace the game phases, print percentiles and save Chrome trace JSON to PATH on exit")
+    return parser.parse_args()
 
 
 def main():
-    game = Engine()
-    game.run()
+    args = parse_args()
+
+    if args.trace:
+        tracer.enable()
+
+    if args.batch:
+        first_seed = args.seed if args.seed is not None else 0
+        tower_slots = tuple(args.tower_slots) if args.tower_slots is not None else None
+        jobs = [BatchJob(seed=seed, tower_slots=tower_slots, max_ticks=args.ticks, use_enemy_store=args.enemy_store,
+                         waves_path=args.waves)
+                for seed in range(first_seed, first_seed + args.batch)]
+        run_and_summarize(jobs, workers=args.workers)
+    elif args.replay:
+        result = Replayer(Recording.load(args.replay)).run()
+        print(result)
+    else:
+        game = Engine(headless=args.headless, use_enemy_store=args.enemy_store, seed=args.seed, waves_path=args.waves,
+                      verbose=args.verbose)
+
+        events = game.game.events
+        if args.verbose:
+            events.subscribe(ConsoleLogger())
+        if args.event_log:
+            event_log = FileSink(args.event_log)
+            event_counter = EventCounter()
+            events.subscribe(event_log)
+            events.subscribe(event_counter)
+
+        result = game.run(max_ticks=args.ticks)
+
+        if args.event_log:
+            event_log.close()
+            print(dict(event_counter.counts))
+
+        if result is not None:
+            print(result)
+
+        if args.record:
+            game.recording.save(args.record)
+
+    if args.trace:
+        print(tracer.report())
+        tracer.export_chrome_trace(args.trace)
 
 
 if __name__ == '__main__':
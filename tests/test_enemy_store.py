@@ -0,0 +1,30 @@
+import pytest
+
+from Engine.game import Game
+from Engine.tower import Tower
+
+pytest.importorskip("numpy")
+
+
+def run_game(use_enemy_store: bool, seed: int, ticks: int) -> Game:
+    game = Game(use_enemy_store=use_enemy_store, seed=seed)
+
+    # Fill every tower slot so enemies get shot, damaged and killed as well as moved
+    for slot in game.level.tower_slots:
+        if not game.level.terrain.is_occupied(*slot):
+            game.level.update(2, current_position=slot, tower=Tower("standard", slot))
+
+    for _ in range(ticks):
+        if not game.game_running:
+            break
+        game.update()
+    return game
+
+
+@pytest.mark.parametrize("seed", (0, 1, 3))
+def test_enemy_store_matches_enemy_objects(seed):
+    objects = run_game(False, seed, 3000)
+    enemy_store = run_game(True, seed, 3000)
+
+    assert any(enemy.current_hp < enemy.max_hp for enemy in objects.level.enemies) or objects.enemies_killed > 0
+    assert enemy_store.state_digest() == objects.state_digest()
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from Engine.enemy import Enemy
+from Engine.projectile import HIT_RADIUS, VECTORIZED_HITS_MIN_PROJECTILES, ProjectilePool
+
+
+def make_pool(rng: random.Random, projectiles: int) -> ProjectilePool:
+    pool = ProjectilePool()
+    for _ in range(projectiles):
+        pool.spawn((rng.uniform(0, 10), rng.uniform(0, 10)), (0.0, 0.0), 10, 0, 0, 1.0)
+
+    # Released slots must not hit anything
+    for slot in rng.sample(pool.active_slots(), projectiles // 10):
+        pool.release(slot)
+    return pool
+
+
+def place_enemies(rng: random.Random, enemies: list):
+    # Creation order is shuffled so it differs from the list order
+    creation_indexes = list(range(len(enemies)))
+    rng.shuffle(creation_indexes)
+    for enemy, creation_index in zip(enemies, creation_indexes):
+        enemy.real_position = (rng.uniform(0, 10), rng.uniform(0, 10))
+        enemy.creation_index = creation_index
+
+
+def brute_force_hits(pool: ProjectilePool, enemies: list) -> list:
+    # First enemy in creation order within the hit radius of every projectile
+    hits = []
+    for slot in pool.active_slots():
+        touching = [enemy for enemy in enemies
+                    if (pool.row[slot] - enemy.real_position[0]) ** 2 + (pool.col[slot] - enemy.real_position[1]) ** 2
+                    <= HIT_RADIUS * HIT_RADIUS]
+        if touching:
+            hits.append((slot, min(touching, key=lambda enemy: enemy.creation_index)))
+    return hits
+
+
+@pytest.mark.parametrize("projectiles", (20, VECTORIZED_HITS_MIN_PROJECTILES * 3))
+@pytest.mark.parametrize("seed", range(3))
+def test_find_hits_matches_brute_force(seed, projectiles):
+    rng = random.Random(seed)
+    pool = make_pool(rng, projectiles)
+    enemies = [Enemy("normal") for _ in range(150)]
+    place_enemies(rng, enemies)
+
+    hits = pool.find_hits(enemies)
+
+    assert hits
+    assert hits == brute_force_hits(pool, enemies)
+
+
+@pytest.mark.parametrize("projectiles", (20, VECTORIZED_HITS_MIN_PROJECTILES * 3))
+def test_find_hits_matches_brute_force_with_enemy_store(projectiles):
+    pytest.importorskip("numpy")
+    from Engine.enemy_store import EnemyStore, StoredEnemy
+
+    rng = random.Random(projectiles)
+    pool = make_pool(rng, projectiles)
+    store = EnemyStore()
+    enemies = [StoredEnemy("normal", store) for _ in range(150)]
+    place_enemies(rng, enemies)
+
+    hits = pool.find_hits(enemies, store)
+
+    assert hits
+    assert hits == brute_force_hits(pool, enemies)
@@ -0,0 +1,37 @@
+from Engine.registry import EntityRegistry
+
+
+class Entity:
+    pass
+
+
+def test_stale_handle_after_destroy_and_create():
+    registry = EntityRegistry()
+    first = Entity()
+    first_id = registry.create(first, "enemy")
+    registry.destroy(first_id)
+
+    # New entity reuses the slot with a new generation
+    second = Entity()
+    second_id = registry.create(second, "enemy")
+
+    assert second_id != first_id
+    assert not registry.is_alive(first_id)
+    assert registry.get(first_id) is None
+    assert registry.get(second_id) is second
+    assert first.entity_id == 0
+
+
+def test_swap_remove_keeps_dense_list_and_creation_order():
+    registry = EntityRegistry()
+    entities = [Entity() for _ in range(4)]
+    ids = [registry.create(entity, "enemy") for entity in entities]
+
+    registry.destroy(ids[1])
+
+    assert sorted(map(id, registry.components("enemy"))) == sorted(map(id, [entities[0], entities[2], entities[3]]))
+    assert registry.in_creation_order("enemy") == [entities[0], entities[2], entities[3]]
+    assert [entity.creation_index for entity in registry.in_creation_order("enemy")] == [0, 2, 3]
+    for entity_id, entity in zip(ids, entities):
+        if entity_id != ids[1]:
+            assert registry.get(entity_id) is entity
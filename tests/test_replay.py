@@ -0,0 +1,52 @@
+from Engine.engine import Engine
+from Engine.package import ReturnPackage
+from Engine.replay import Recording, Replayer
+
+
+def play(engine: Engine, packages_by_frame: dict, ticks: int):
+    # Packages are applied before the tick of their frame, same as the replayer applies them
+    game = engine.game
+    for _ in range(ticks):
+        for return_package in packages_by_frame.get(game.frame, []):
+            engine.handle_package(return_package)
+        game.update()
+    engine.recording.finish(game)
+
+
+def test_recording_round_trip_with_tower_actions(tmp_path):
+    engine = Engine(headless=True, seed=7)
+    level = engine.game.level
+    empty_slots = [slot for slot in level.tower_slots if not level.terrain.is_occupied(*slot)]
+    forced_tower = level.towers[0].position
+    slot = empty_slots[0]
+
+    packages_by_frame = {
+        100: [ReturnPackage(new_tower_position=slot, new_tower_type="standard")],
+        300: [ReturnPackage(upgrade_tower_position=slot)],
+        500: [ReturnPackage(remove_tower_position=forced_tower)],
+        700: [ReturnPackage(remove_tower_position=slot)],
+    }
+    play(engine, packages_by_frame, 1000)
+
+    recording = engine.recording
+    assert [frame for frame, _ in recording.packages] == [100, 300, 500, 700]
+    assert len(level.towers) == 0
+
+    path = tmp_path / "recording.json"
+    recording.save(str(path))
+    result = Replayer(Recording.load(str(path))).run()
+
+    assert result.frame == recording.final_frame
+    assert result.digest == recording.final_digest
+    assert result.matches
+
+
+def test_replay_detects_a_different_game():
+    engine = Engine(headless=True, seed=7)
+    slot = next(slot for slot in engine.game.level.tower_slots if not engine.game.level.terrain.is_occupied(*slot))
+    play(engine, {100: [ReturnPackage(new_tower_position=slot, new_tower_type="standard")]}, 1000)
+
+    recording = engine.recording
+    recording.packages = []
+
+    assert not Replayer(recording).run().matches
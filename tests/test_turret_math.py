@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+from Engine.turret_math import PathTable, solve_intercept, solve_intercepts
+
+np = pytest.importorskip("numpy")
+
+
+def random_path(rng: random.Random, length: int):
+    # Grid walk of unit steps, same kind of path the enemies follow
+    waypoints = [(rng.randrange(20), rng.randrange(20))]
+    for _ in range(length):
+        row, col = waypoints[-1]
+        row_step, col_step = rng.choice(((0, 1), (1, 0), (0, -1), (-1, 0)))
+        waypoints.append((row + row_step, col + col_step))
+    return waypoints
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_solve_intercepts_matches_solve_intercept(seed):
+    rng = random.Random(seed)
+    tables = [PathTable(random_path(rng, rng.randrange(1, 30))) for _ in range(6)]
+
+    shots = []
+    for _ in range(64):
+        table = rng.choice(tables)
+        shots.append((
+            (rng.uniform(-5, 25), rng.uniform(-5, 25)),
+            rng.uniform(2, 20),
+            table,
+            rng.uniform(0, table.total_length),
+            rng.choice((0.0, rng.uniform(0.1, 5))),
+        ))
+
+    velocities, impact_times, impacts = solve_intercepts(*zip(*shots))
+
+    for shot, velocity, impact_time, impact in zip(shots, velocities, impact_times, impacts):
+        expected_velocity, expected_time, expected_impact = solve_intercept(*shot)
+        assert velocity == pytest.approx(expected_velocity, abs=1e-6)
+        assert impact_time == pytest.approx(expected_time, abs=1e-6)
+        assert impact == pytest.approx(expected_impact, abs=1e-6)
@@ -0,0 +1,34 @@
+from Engine.waves import Spawn, SpawnGroup, Wave, WaveSchedule
+
+
+def test_bursts_are_due_in_timeline_order():
+    schedule = WaveSchedule([
+        Wave(groups=(SpawnGroup("basic", count=2, interval=10), SpawnGroup("fast", count=1, delay=5))),
+        Wave(groups=(SpawnGroup("tank", count=1),), delay=3),
+    ])
+
+    assert schedule.due_spawns(0) == [Spawn(0, "basic", None)]
+    assert not schedule.has_due(4)
+    assert schedule.due_spawns(5) == [Spawn(0, "fast", None)]
+    assert schedule.due_spawns(10) == [Spawn(0, "basic", None)]
+    # Second wave starts 3 frames after the last burst of the first wave
+    assert not schedule.has_due(12)
+    assert schedule.due_spawns(13) == [Spawn(1, "tank", None)]
+    assert schedule.finished
+
+
+def test_retried_spawns_come_first_in_the_order_they_were_due():
+    schedule = WaveSchedule([Wave(groups=(
+        SpawnGroup("basic", count=2, interval=1, burst=2),
+        SpawnGroup("fast", count=1, delay=1),
+    ))])
+
+    first, second = schedule.due_spawns(0)
+    schedule.retry(first)
+    schedule.retry(second)
+    assert not schedule.finished
+    assert schedule.has_due(1)
+
+    # Retries are tried again before the new spawns of the frame
+    assert schedule.due_spawns(1) == [first, second, Spawn(0, "fast", None)]
+    assert schedule.finished